@@ -1,12 +1,86 @@
 import { Request, Response } from 'express';
 import path from 'path';
+import os from 'os';
 import fs from 'fs';
-import { execFile } from 'child_process';
+import { randomUUID } from 'crypto';
 import { checkPythonVersion } from '../util/checkPy';
+import { PyWorkerPool, PyResult } from '../util/pyWorkerPool';
 import { UploadedFile } from 'express-fileupload';
-import { RESULT_DIR } from '../index';
+import { RESULT_DIR, STORAGE_DIR } from '../index';
 
-export const zoiUploadHandler = (req: Request, res: Response) => {
+const PY_WORKERS = Number(process.env.ZOI_PY_WORKERS) || 2;
+// Independent passes of an upload run concurrently for lower latency; every
+// worker gets an equal share of the cores for them and OpenCV
+const PASS_THREADS = Number(process.env.ZOI_PASS_THREADS) || 3;
+const WORKER_THREADS = Math.max(1, Math.floor(os.cpus().length / PY_WORKERS));
+// Result cache shared by all workers; set ZOI_CACHE_DIR to an empty string to disable it
+const CACHE_DIR = process.env.ZOI_CACHE_DIR ?? path.join(STORAGE_DIR, 'cache');
+// Calibration profile of a fixed imaging rig (dish geometry and pixels_per_mm),
+// created from the first upload; unset to detect the dish in every upload
+const RIG_PROFILE = process.env.ZOI_RIG_PROFILE;
+// Detection image: a raster (png, jpg, webp) or the drawn shapes as vectors
+// (svg, json) for the UI to draw over the original; uploads may ask for
+// another format with the "overlay" form field
+const OVERLAY_MEDIA_TYPES: Record<string, string> = {
+  png: 'image/png',
+  jpg: 'image/jpeg',
+  webp: 'image/webp',
+  svg: 'image/svg+xml',
+  json: 'application/json',
+};
+const OVERLAY_FORMAT = process.env.ZOI_OVERLAY || 'png';
+// Disk mode: every upload is a job whose images are written to a directory
+// of its own under JOB_DIR (served as /result/jobs/<id>), so concurrent
+// uploads can't overwrite each other's results. Jobs are removed after
+// ZOI_JOB_MAX_AGE seconds, and the oldest beyond ZOI_MAX_JOBS
+const JOB_DIR = path.join(RESULT_DIR, 'jobs');
+const UPLOAD_DIR = path.join(STORAGE_DIR, 'uploads');
+const JOB_MAX_AGE = process.env.ZOI_JOB_MAX_AGE || '3600';
+const MAX_JOBS = process.env.ZOI_MAX_JOBS || '1000';
+let workerPool: Promise<PyWorkerPool | null> | null = null;
+
+// Resolves Python once and starts the warm worker pool on first use
+const getWorkerPool = (): Promise<PyWorkerPool | null> => {
+  if (!workerPool) {
+    workerPool = checkPythonVersion().then((pythonBin) => {
+      if (!pythonBin) {
+        // Allow a retry once Python has been installed
+        workerPool = null;
+        return null;
+      }
+      const pythonScript = path.join(__dirname, '..', 'py', 'zoi_detect.py');
+      const args = ['--threads', String(WORKER_THREADS), '--pass-threads', String(PASS_THREADS)];
+      if (CACHE_DIR) {
+        args.push('--cache-dir', CACHE_DIR);
+      }
+      if (RIG_PROFILE) {
+        args.push('--rig', RIG_PROFILE);
+      }
+      // Encoding of raster detection images, see zoi_detect.py --help
+      args.push('--overlay', OVERLAY_FORMAT);
+      args.push('--output-root', JOB_DIR, '--job-max-age', JOB_MAX_AGE, '--max-jobs', MAX_JOBS);
+      if (process.env.ZOI_OVERLAY_QUALITY) {
+        args.push('--overlay-quality', process.env.ZOI_OVERLAY_QUALITY);
+      }
+      if (process.env.ZOI_PNG_COMPRESSION) {
+        args.push('--png-compression', process.env.ZOI_PNG_COMPRESSION);
+      }
+      if (process.env.ZOI_PREVIEW_SIZE) {
+        args.push('--preview-size', process.env.ZOI_PREVIEW_SIZE);
+      }
+      console.log(`Starting ${PY_WORKERS} Python workers: ${pythonBin} ${pythonScript} --serve ${args.join(' ')}`);
+      return new PyWorkerPool(pythonBin, pythonScript, PY_WORKERS, args);
+    });
+  }
+  return workerPool;
+};
+
+// "memory" (default) hands the upload bytes to Python and returns the
+// detection image inline; "disk" stores the upload in RESULT_DIR and serves
+// the detection image from there
+const ZOI_IO = process.env.ZOI_IO === 'disk' ? 'disk' : 'memory';
+
+export const zoiUploadHandler = async (req: Request, res: Response) => {
   if (!req.files || !req.files.image) {
     console.error('No file uploaded.');
     return res.status(400).send('No file uploaded.');
@@ -21,68 +95,147 @@ export const zoiUploadHandler = (req: Request, res: Response) => {
     return res.status(400).send('Invalid file type. Only PNG/JPG allowed.');
   }
 
-  const uploadPath = path.join(RESULT_DIR, file.name);
+  const pool = await getWorkerPool();
 
-  if (!fs.existsSync(RESULT_DIR)) {
-    fs.mkdirSync(RESULT_DIR, { recursive: true });
+  if (!pool) {
+    console.error('Python executable not found. Set PYTHON_PATH or install Python.');
+    return res.status(500).json({ error: 'Python executable not found. Set PYTHON_PATH or install Python.', code: "py_not_found" });
   }
 
-  file.mv(uploadPath, async (err: Error) => {
-    if (err) {
-      console.error('File move error:', err);
-      return res.status(500).send('File saving failed.');
+  // Multi-plate scans: detect every dish and report the zones per dish.
+  // measure=radial measures the diameters from the zone edges
+  const options: Record<string, unknown> = req.body?.multiDish === 'true' ? { multi_dish: true } : {};
+  if (req.body?.measure === 'radial') {
+    options.measure = 'radial';
+  }
+  // overlay=svg|json|png|jpg|webp chooses the detection image format,
+  // previewSize downscales a raster one to at most that many pixels
+  let overlayFormat = OVERLAY_FORMAT;
+  if (req.body?.overlay) {
+    if (!(req.body.overlay in OVERLAY_MEDIA_TYPES)) {
+      return res.status(400).send('Invalid overlay format.');
+    }
+    overlayFormat = req.body.overlay;
+    options.overlay = overlayFormat;
+  }
+  if (req.body?.previewSize) {
+    const previewSize = Number(req.body.previewSize);
+    if (!Number.isInteger(previewSize) || previewSize < 1) {
+      return res.status(400).send('Invalid preview size.');
     }
+    options.preview_size = previewSize;
+  }
 
-    const pythonScript = path.join(__dirname, '..', 'py', 'zoi_detect.py');
-    const pythonBin = await checkPythonVersion();
+  console.log(`Processing: ${file.name} (${ZOI_IO})`);
 
-    if (!pythonBin) {
-      console.error('Python executable not found. Set PYTHON_PATH or install Python.');
-      return res.status(500).json({ error: 'Python executable not found. Set PYTHON_PATH or install Python.', code: "py_not_found" });
-    }
+  let result: PyResult;
+  try {
+    result = ZOI_IO === 'disk'
+      ? await runFromDisk(pool, file, options)
+      : await pool.run({ filename: file.name, ...options }, file.data);
+  } catch (e) {
+    console.error('Python error:', e);
+    return res.status(500).send('Image processing failed.');
+  }
 
-    console.log(`Executing: ${pythonBin} ${pythonScript} ${uploadPath}`);
-
-    execFile(
-      pythonBin,
-      [pythonScript, uploadPath],
-      {},
-      (error, stdout, stderr) => {
-        fs.unlinkSync(uploadPath);
-
-        if (error) {
-          console.error('Python error:', error.message);
-          console.error('Python stderr:', stderr);
-          return res.status(500).send('Image processing failed.');
-        }
-
-        try {
-          console.log('Python stdout:', stdout);
-          const data = JSON.parse(stdout);
-
-          let imageUrl = null;
-          if (data.detection_image) {
-            const filename = path.basename(data.detection_image);
-            imageUrl = `http://localhost:3005/result/${filename}`;
-          }
-
-          return res.json({
-            message: 'File uploaded and processed!',
-            filename: file.name,
-            zoi: data.zoi,
-            imageUrl: imageUrl,
-          });
-        } catch (e) {
-          console.error('Failed to parse Python output:', stdout);
-          console.error('Parse error:', e);
-          return res.status(500).send('Failed to parse result.');
-        }
+  const data = result.data;
+  let imageUrl = null;
+  // The json format returns the overlay shapes themselves
+  let overlay = null;
+  if (overlayFormat === 'json') {
+    try {
+      if (result.overlay) {
+        overlay = JSON.parse(result.overlay.toString('utf8'));
+      } else if (data.detection_image) {
+        overlay = JSON.parse(await fs.promises.readFile(data.detection_image, 'utf8'));
       }
-    );
+    } catch (e) {
+      console.error('Overlay read error:', e);
+      return res.status(500).send('Could not read the detection overlay.');
+    }
+  } else if (result.overlay) {
+    imageUrl = `data:${OVERLAY_MEDIA_TYPES[overlayFormat]};base64,${result.overlay.toString('base64')}`;
+  } else if (data.detection_image) {
+    const filename = path.basename(data.detection_image);
+    imageUrl = `http://localhost:3005/result/jobs/${data.job_id}/${filename}`;
+  }
+
+  return res.json({
+    message: 'File uploaded and processed!',
+    filename: file.name,
+    zoi: data.zoi,
+    dishes: data.dishes,
+    imageUrl: imageUrl,
+    overlayFormat: overlayFormat,
+    overlay: overlay,
+    cached: data.cache === 'hit',
   });
 };
 
-export const checkZoIHandler = (req: Request, res: Response) => {
+export const cacheStatsHandler = async (req: Request, res: Response) => {
+  const pool = await getWorkerPool();
+  if (!pool) {
+    return res.status(500).json({ error: 'Python executable not found. Set PYTHON_PATH or install Python.', code: "py_not_found" });
+  }
+
+  try {
+    const { data } = await pool.run({ op: 'cache_stats' });
+    delete data.id;
+    return res.json(data);
+  } catch (e) {
+    console.error('Python error:', e);
+    return res.status(500).send('Could not read cache statistics.');
+  }
+};
+
+// Stores the upload in a directory of its own for the worker to read, and
+// removes it afterwards. The worker writes the images to the job directory
+const runFromDisk = async (pool: PyWorkerPool, file: UploadedFile, options: object = {}): Promise<PyResult> => {
+  const jobId = randomUUID();
+  const uploadDir = path.join(UPLOAD_DIR, jobId);
+  const uploadPath = path.join(uploadDir, path.basename(file.name));
+
+  fs.mkdirSync(uploadDir, { recursive: true });
+  try {
+    await file.mv(uploadPath);
+    return await pool.run({ image_path: uploadPath, job_id: jobId, ...options });
+  } finally {
+    fs.rmSync(uploadDir, { recursive: true, force: true });
+  }
+};
+
+type ReferenceZoI = { diameter_mm: number };
+
+// Reference diameters by image name. The CSV is parsed once and again only
+// when it changes, so a lookup doesn't scan the whole file
+let referenceTable: { mtimeMs: number; rows: Map<string, ReferenceZoI[]> } | null = null;
+
+const loadReferenceTable = async (csvPath: string): Promise<Map<string, ReferenceZoI[]>> => {
+  const { mtimeMs } = await fs.promises.stat(csvPath);
+  if (referenceTable && referenceTable.mtimeMs === mtimeMs) {
+    return referenceTable.rows;
+  }
+
+  const data = await fs.promises.readFile(csvPath, 'utf8');
+  const lines = data.split('\n').filter(line => line.trim().length > 0);
+  const rows = new Map<string, ReferenceZoI[]>();
+  for (const line of lines.slice(1)) {
+    const [fname, ...values] = line.split(',');
+    const name = fname.trim();
+    if (rows.has(name)) {
+      // The first line of a name wins, as with a linear search
+      continue;
+    }
+    rows.set(name, values
+      .map(value => value.trim())
+      .filter(value => value.length > 0)
+      .map(value => ({ diameter_mm: Number(value.replace('mm', '')) })));
+  }
+  referenceTable = { mtimeMs, rows };
+  return rows;
+};
+
+export const checkZoIHandler = async (req: Request, res: Response) => {
   if (!req.files || !req.files.image) {
     return res.status(400).send('No file uploaded.');
   }
@@ -99,44 +252,26 @@ export const checkZoIHandler = (req: Request, res: Response) => {
 
   const baseName = path.basename(file.name, ext);
 
-  fs.readFile(csvPath, 'utf8', (err, data) => {
-    if (err) {
-      console.error('CSV read error:', err);
-      return res.status(500).send('Failed to read CSV.');
-    }
-
-    const lines = data.split('\n').filter(line => line.trim().length > 0);
-    if (lines.length < 2) {
-      return res.status(500).send('CSV is empty.');
-    }
-
-    const headers = lines[0].split(',').map(h => h.trim());
-    const diskColumns = headers.slice(1);
-
-    const match = lines.slice(1).find((line: String) => {
-      const [fname] = line.split(',');
-      return fname.trim() === baseName;
-    });
+  let rows: Map<string, ReferenceZoI[]>;
+  try {
+    rows = await loadReferenceTable(csvPath);
+  } catch (err) {
+    console.error('CSV read error:', err);
+    return res.status(500).send('Failed to read CSV.');
+  }
 
-    if (!match) {
-      return res.status(404).json({ message: 'No data found for this image.' });
-    }
+  if (rows.size === 0) {
+    return res.status(500).send('CSV is empty.');
+  }
 
-    const fields = match.split(',');
-    const zoi = diskColumns
-      .map((_: any, idx: number) => {
-        const val = (fields[idx + 1] || '').trim();
-        if (val) {
-          return { diameter_mm: Number(val.replace('mm', '')) };
-        }
-        return null;
-      })
-      .filter((disk: any) => disk !== null);
+  const zoi = rows.get(baseName);
+  if (!zoi) {
+    return res.status(404).json({ message: 'No data found for this image.' });
+  }
 
-    return res.json({
-      message: 'ZoI data fetched.',
-      filename: file.name,
-      zoi
-    });
+  return res.json({
+    message: 'ZoI data fetched.',
+    filename: file.name,
+    zoi
   });
 };
@@ -3,7 +3,7 @@ import fileUpload from 'express-fileupload';
 import cors from 'cors';
 import path from 'path';
 import fs from 'fs';
-import { zoiUploadHandler, checkZoIHandler } from './controllers/zoiUpload.controller';
+import { zoiUploadHandler, checkZoIHandler, cacheStatsHandler } from './controllers/zoiUpload.controller';
 import { Request, Response, NextFunction } from 'express';
 
 export const STORAGE_DIR = path.join(process.cwd(), 'storage');
@@ -33,6 +33,7 @@ console.log(`Result directory: ${RESULT_DIR}`);
 app.use('/result', express.static(RESULT_DIR));
 app.post('/v1/zoiUpload', zoiUploadHandler as (req: Request, res: Response, next: NextFunction) => any);
 app.post('/v1/checkZoI', checkZoIHandler as (req: Request, res: Response, next: NextFunction) => any);
+app.get('/v1/cacheStats', cacheStatsHandler as (req: Request, res: Response, next: NextFunction) => any);
 
 app.listen(PORT, () => {
   console.log(`🧫 ZoI Backend server running on http://localhost:${PORT}`);
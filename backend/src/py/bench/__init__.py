@@ -0,0 +1,3 @@
+"""
+Benchmarks for zoi_detect on synthetic plates, see README ("Benchmarks").
+"""
@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+# Physical layout of a standard 90 mm petri dish with 6 mm antibiotic discs
+DISH_DIAMETER_MM = 90.0
+DISC_DIAMETER_MM = 6.0
+
+# 8-bit BGR colours of the rendered plate
+OUTSIDE_COLOR = 40
+AGAR_COLOR = (120, 130, 125)
+HALO_COLOR = (215, 220, 218)
+DISC_COLOR = (250, 250, 250)
+TEXT_COLOR = (20, 20, 20)
+
+def plate_size(megapixels, aspect=4 / 3):
+    """
+    Width and height of a plate image with about this many megapixels.
+    """
+    height = int(round(np.sqrt(megapixels * 1e6 / aspect)))
+    width = int(round(height * aspect))
+    return width, height
+
+def place_discs(center, dish_radius_px, halo_radii_px, overlap=0.0):
+    """
+    Disc centers evenly spread on a ring around the dish center.
+    
+    Args:
+        center: Dish center (x, y)
+        dish_radius_px: Dish radius in pixels
+        halo_radii_px: Halo radius per disc in pixels
+        overlap: When > 0, the second halo is moved next to the first so
+            that they overlap by this fraction of the sum of their radii
+    
+    Returns:
+        List of (x, y) disc centers
+    """
+    n = len(halo_radii_px)
+    ring = dish_radius_px * 0.55
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False) + np.pi / 4
+    centers = [(center[0] + ring * np.cos(a), center[1] + ring * np.sin(a)) for a in angles]
+    
+    if overlap > 0 and n >= 2:
+        x, y = centers[0]
+        dist = (1.0 - overlap) * (halo_radii_px[0] + halo_radii_px[1])
+        # Step along the ring so the pair stays inside the dish
+        step = np.arctan2(y - center[1], x - center[0]) + dist / ring
+        centers[1] = (center[0] + ring * np.cos(step), center[1] + ring * np.sin(step))
+    return [(int(round(x)), int(round(y))) for x, y in centers]
+
+def render_plate(megapixels=2.0, halo_diameters_mm=(20.0, 24.0, 28.0, 32.0), overlap=0.0,
+                 noise=6.0, gradient=30.0, text="PoC", seed=0):
+    """
+    Render a synthetic plate with known ground truth.
+    
+    The plate is a dark background with the agar dish in the middle, a
+    label in the dish center, and antibiotic discs each surrounded by a
+    bright zone of inhibition (halo).
+    
+    Args:
+        megapixels: Image size
+        halo_diameters_mm: Zone of inhibition diameter per disc
+        overlap: Overlap of the first two halos, see place_discs()
+        noise: Standard deviation of the Gaussian pixel noise
+        gradient: Brightness change across the image (lighting gradient)
+        text: Label drawn in the dish center (empty for none)
+        seed: Noise seed
+    
+    Returns:
+        Tuple containing (BGR image, ground truth dictionary with
+        pixels_per_mm, dish and zoi entries)
+    """
+    width, height = plate_size(megapixels)
+    center = (width // 2, height // 2)
+    dish_radius = int(height * 0.45)
+    pixels_per_mm = 2 * dish_radius / DISH_DIAMETER_MM
+    
+    halo_radii = [d * pixels_per_mm / 2 for d in halo_diameters_mm]
+    disc_radius = int(round(DISC_DIAMETER_MM * pixels_per_mm / 2))
+    disc_centers = place_discs(center, dish_radius, halo_radii, overlap)
+    
+    image = np.full((height, width, 3), OUTSIDE_COLOR, np.uint8)
+    cv2.circle(image, center, dish_radius, AGAR_COLOR, -1)
+    for (x, y), r in zip(disc_centers, halo_radii):
+        cv2.circle(image, (x, y), int(round(r)), HALO_COLOR, -1)
+    for x, y in disc_centers:
+        cv2.circle(image, (x, y), disc_radius, DISC_COLOR, -1)
+    if text:
+        scale = height / 1000.0
+        (tw, th), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, max(1, int(3 * scale)))
+        cv2.putText(image, text, (center[0] - tw // 2, center[1] + th // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    scale, TEXT_COLOR, max(1, int(3 * scale)))
+    
+    # Lighting gradient from left to right plus sensor noise
+    rng = np.random.default_rng(seed)
+    shading = np.linspace(-gradient / 2, gradient / 2, width, dtype=np.float32)
+    plate = image.astype(np.float32) + shading[None, :, None]
+    if noise > 0:
+        plate += rng.normal(0, noise, plate.shape).astype(np.float32)
+    image = np.clip(plate, 0, 255).astype(np.uint8)
+    
+    truth = {
+        "pixels_per_mm": pixels_per_mm,
+        "dish": {"center_x": center[0], "center_y": center[1], "radius": dish_radius},
+        "zoi": [{"center_x": x, "center_y": y, "diameter_mm": float(d)}
+                for (x, y), d in zip(disc_centers, halo_diameters_mm)],
+    }
+    return image, truth
+
+def match_zoi(detected, truth):
+    """
+    Pair detected zones with the ground truth.
+    
+    Each true zone is matched to the nearest unused detection whose center
+    lies within the true radius.
+    
+    Args:
+        detected: ZoI dictionaries as returned by detect_zoi
+        truth: Ground truth from render_plate
+    
+    Returns:
+        Dictionary with the absolute diameter errors (mm) of the matched
+        zones, recall and the number of unmatched detections
+    """
+    ppm = truth["pixels_per_mm"]
+    unused = list(range(len(detected)))
+    errors = []
+    for zoi in truth["zoi"]:
+        radius_px = zoi["diameter_mm"] * ppm / 2
+        best, best_dist = None, radius_px
+        for idx in unused:
+            dist = np.hypot(detected[idx]["center_x"] - zoi["center_x"],
+                            detected[idx]["center_y"] - zoi["center_y"])
+            if dist <= best_dist:
+                best, best_dist = idx, dist
+        if best is not None:
+            unused.remove(best)
+            errors.append(abs(detected[best]["diameter_mm"] - zoi["diameter_mm"]))
+    return {
+        "errors_mm": errors,
+        "recall": len(errors) / len(truth["zoi"]) if truth["zoi"] else 1.0,
+        "false_positives": len(unused),
+    }
@@ -0,0 +1,292 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import zoi_detect
+from bench.plates import render_plate, match_zoi
+
+# Plate sizes (megapixels) of the full and the quick suite
+SIZES = (1, 2, 4, 8, 12, 24)
+QUICK_SIZES = (1, 2, 4)
+
+# Regression thresholds of compare(): relative slowdown / memory growth,
+# and absolute growth of the mean diameter error in mm. Latency changes
+# below LATENCY_FLOOR_MS are treated as noise.
+LATENCY_TOLERANCE = 0.25
+RSS_TOLERANCE = 0.25
+ERROR_TOLERANCE_MM = 0.5
+LATENCY_FLOOR_MS = 5.0
+
+def default_scenarios(quick=False, sizes=None):
+    """
+    Benchmark scenarios: a resolution sweep with four discs, plus disc
+    count, overlap and noise variations at 2 megapixels.
+    
+    Returns:
+        List of scenario dictionaries (keyword arguments of render_plate plus a name)
+    """
+    sizes = sizes or (QUICK_SIZES if quick else SIZES)
+    scenarios = [{"name": f"{mp:g}mp_4discs", "megapixels": mp, "halo_diameters_mm": [20.0, 24.0, 28.0, 32.0]}
+                 for mp in sizes]
+    scenarios.append({"name": "2mp_overlap30", "megapixels": 2, "halo_diameters_mm": [24.0, 24.0, 20.0, 20.0],
+                      "overlap": 0.3})
+    if not quick:
+        scenarios += [
+            {"name": "2mp_2discs", "megapixels": 2, "halo_diameters_mm": [22.0, 30.0]},
+            {"name": "2mp_6discs", "megapixels": 2, "halo_diameters_mm": [16.0, 18.0, 20.0, 22.0, 24.0, 26.0]},
+            {"name": "2mp_overlap50", "megapixels": 2, "halo_diameters_mm": [24.0, 24.0, 20.0, 20.0],
+             "overlap": 0.5},
+            {"name": "2mp_noisy", "megapixels": 2, "halo_diameters_mm": [20.0, 24.0, 28.0, 32.0],
+             "noise": 15.0, "gradient": 60.0},
+        ]
+    return scenarios
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else None
+
+def _measure(image, truth, repeat, warmup):
+    # Runs inside a fresh process, so peak RSS only covers this scenario
+    cv2.setNumThreads(cv2.getNumberOfCPUs())
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    base_rss = zoi_detect.peak_rss_mb()
+    
+    detect_times, dish_times = [], []
+    stage_times = {}
+    result = []
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        zoi_detect.detect_petri_dish(gray)
+        dish_time = time.perf_counter() - start
+        
+        timings = zoi_detect.Timings()
+        start = time.perf_counter()
+        result, _ = zoi_detect.detect_zoi_in_image(image, "bench", None, truth["pixels_per_mm"],
+                                                   zoi_detect.DEBUG_NONE, timings=timings)
+        detect_time = time.perf_counter() - start
+        if i >= warmup:
+            dish_times.append(dish_time)
+            detect_times.append(detect_time)
+            for stage, ms in timings.summary()["stages"].items():
+                stage_times.setdefault(stage, []).append(ms / 1000)
+    
+    return {
+        "detect_times": detect_times,
+        "dish_times": dish_times,
+        "stage_times": stage_times,
+        "zoi": result,
+        "base_rss_mb": base_rss,
+        "peak_rss_mb": zoi_detect.peak_rss_mb(),
+    }
+
+def run_scenario(scenario, repeat=5, warmup=1, isolate=True):
+    """
+    Render one scenario and time the detector on it.
+    
+    Args:
+        scenario: Scenario dictionary from default_scenarios()
+        repeat: Timed runs
+        warmup: Untimed runs before the timed ones
+        isolate: Measure in a fresh process (needed for a per-scenario peak RSS)
+    
+    Returns:
+        Dictionary of latency, throughput, memory and accuracy figures
+    """
+    params = {k: v for k, v in scenario.items() if k != "name"}
+    image, truth = render_plate(**params)
+    height, width = image.shape[:2]
+    
+    if isolate:
+        # Spawned rather than forked, so the child doesn't inherit this process's memory
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            measured = executor.submit(_measure, image, truth, repeat, warmup).result()
+    else:
+        measured = _measure(image, truth, repeat, warmup)
+    
+    times = measured["detect_times"]
+    match = match_zoi(measured["zoi"], truth)
+    mean_time = float(np.mean(times))
+    errors = match["errors_mm"]
+    return {
+        "name": scenario["name"],
+        "params": params,
+        "width": width,
+        "height": height,
+        "repeat": repeat,
+        "latency_ms": {
+            "p50": percentile_ms(times, 50),
+            "p95": percentile_ms(times, 95),
+            "mean": mean_time * 1000,
+            "min": min(times) * 1000,
+        },
+        "dish_latency_ms": {
+            "p50": percentile_ms(measured["dish_times"], 50),
+            "p95": percentile_ms(measured["dish_times"], 95),
+        },
+        # Stages that only run on some plates are reported over the runs they ran in
+        "stage_p50_ms": {stage: percentile_ms(samples, 50) for stage, samples in measured["stage_times"].items()},
+        "throughput_ips": 1.0 / mean_time,
+        "megapixels_per_s": width * height / 1e6 / mean_time,
+        "base_rss_mb": measured["base_rss_mb"],
+        "peak_rss_mb": measured["peak_rss_mb"],
+        "diameter_error_mm": {
+            "mean": float(np.mean(errors)) if errors else None,
+            "max": float(np.max(errors)) if errors else None,
+        },
+        "recall": match["recall"],
+        "false_positives": match["false_positives"],
+    }
+
+def environment():
+    """
+    Where the benchmark ran: commit, versions and machine.
+    """
+    commit = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def run_suite(scenarios, repeat=5, warmup=1, isolate=True, log=sys.stderr):
+    """
+    Run every scenario and collect the results.
+    
+    Returns:
+        Dictionary with environment and scenarios keys, ready to save as JSON
+    """
+    results = []
+    for scenario in scenarios:
+        result = run_scenario(scenario, repeat, warmup, isolate)
+        results.append(result)
+        error = result["diameter_error_mm"]["mean"]
+        print(f"{result['name']:>16}: p50 {result['latency_ms']['p50']:8.1f} ms  "
+              f"p95 {result['latency_ms']['p95']:8.1f} ms  "
+              f"rss {result['peak_rss_mb'] or 0:7.1f} MB  "
+              f"recall {result['recall']:.2f}  "
+              f"error {'-' if error is None else f'{error:.2f}'} mm", file=log)
+    return {"environment": environment(), "scenarios": results}
+
+def compare(baseline, current, latency_tolerance=LATENCY_TOLERANCE, rss_tolerance=RSS_TOLERANCE,
+            error_tolerance=ERROR_TOLERANCE_MM):
+    """
+    Regressions of a benchmark run against a baseline run.
+    
+    Scenarios are matched by name; scenarios missing from either run are
+    skipped.
+    
+    Returns:
+        List of human-readable regression descriptions (empty if none)
+    """
+    base_by_name = {s["name"]: s for s in baseline["scenarios"]}
+    regressions = []
+    for cur in current["scenarios"]:
+        base = base_by_name.get(cur["name"])
+        if base is None:
+            continue
+        name = cur["name"]
+        
+        for key in ("p50", "p95"):
+            old, new = base["latency_ms"][key], cur["latency_ms"][key]
+            if new > old * (1 + latency_tolerance) and new - old > LATENCY_FLOOR_MS:
+                regressions.append(f"{name}: {key} latency {old:.1f} -> {new:.1f} ms")
+        
+        old, new = base.get("peak_rss_mb"), cur.get("peak_rss_mb")
+        if old and new and new > old * (1 + rss_tolerance):
+            regressions.append(f"{name}: peak RSS {old:.1f} -> {new:.1f} MB")
+        
+        if cur["recall"] < base["recall"]:
+            regressions.append(f"{name}: recall {base['recall']:.2f} -> {cur['recall']:.2f}")
+        if cur["false_positives"] > base["false_positives"]:
+            regressions.append(f"{name}: false positives {base['false_positives']} -> {cur['false_positives']}")
+        
+        old, new = base["diameter_error_mm"]["mean"], cur["diameter_error_mm"]["mean"]
+        if old is not None and new is not None and new > old + error_tolerance:
+            regressions.append(f"{name}: mean diameter error {old:.2f} -> {new:.2f} mm")
+    return regressions
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog="python -m bench",
+                                     description="Benchmark ZoI detection on synthetic plates.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    run = commands.add_parser("run", help="Run the benchmark suite")
+    run.add_argument("--out", help="Write the results as JSON to this file")
+    run.add_argument("--quick", action="store_true", help="Only 1 to 4 megapixel plates and one overlap case")
+    run.add_argument("--sizes", type=lambda s: [float(v) for v in s.split(",")],
+                     help="Comma separated plate sizes in megapixels (default: 1,2,4,8,12,24)")
+    run.add_argument("--repeat", type=int, default=5, help="Timed runs per scenario (default: 5)")
+    run.add_argument("--warmup", type=int, default=1, help="Untimed runs per scenario (default: 1)")
+    run.add_argument("--no-isolate", action="store_true",
+                     help="Run scenarios in this process (faster, but peak RSS is cumulative)")
+    run.add_argument("--baseline", help="Compare against this results file and fail on regressions")
+    
+    cmp = commands.add_parser("compare", help="Compare two result files and fail on regressions")
+    cmp.add_argument("baseline", help="Results of the reference commit")
+    cmp.add_argument("current", help="Results to check")
+    
+    for sub in (run, cmp):
+        sub.add_argument("--latency-tolerance", type=float, default=LATENCY_TOLERANCE,
+                         help="Allowed relative latency increase (default: %(default)s)")
+        sub.add_argument("--rss-tolerance", type=float, default=RSS_TOLERANCE,
+                         help="Allowed relative peak RSS increase (default: %(default)s)")
+        sub.add_argument("--error-tolerance", type=float, default=ERROR_TOLERANCE_MM,
+                         help="Allowed increase of the mean diameter error in mm (default: %(default)s)")
+    return parser.parse_args(argv)
+
+def _report(regressions):
+    if regressions:
+        print(f"{len(regressions)} regression(s):", file=sys.stderr)
+        for regression in regressions:
+            print(f"  REGRESSION {regression}", file=sys.stderr)
+        return 1
+    print("No regressions", file=sys.stderr)
+    return 0
+
+def main(argv=None):
+    """
+    Command line entry point, returns the exit code.
+    """
+    args = parse_args(argv)
+    tolerances = (args.latency_tolerance, args.rss_tolerance, args.error_tolerance)
+    
+    if args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+        return _report(compare(baseline, current, *tolerances))
+    
+    scenarios = default_scenarios(args.quick, args.sizes)
+    results = run_suite(scenarios, args.repeat, args.warmup, not args.no_isolate)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        return _report(compare(baseline, results, *tolerances))
+    return 0
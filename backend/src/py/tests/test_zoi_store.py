@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import zoi_store
+from zoi_store import ZoiStore
+
+def reading(filename, diameters, date=None, plate=None, source="detected"):
+    zoi = [{"diameter_mm": diameter, "center_x": 100.0 * position, "center_y": 50.0}
+           for position, diameter in enumerate(diameters)]
+    return {"filename": filename, "plate": plate, "date": date, "source": source, "zoi": zoi}
+
+def test_append_is_visible_to_another_instance_after_refresh(tmp_path):
+    writer = ZoiStore(str(tmp_path))
+    reader = ZoiStore(str(tmp_path))
+    
+    assert writer.append([reading("a", [20.0, 22.5]), reading("b", [])]) == 2
+    assert reader.lookup("a") == []
+    
+    reader.refresh()
+    assert (reader.rows, reader.readings) == (3, 2)
+    assert [zone["diameter_mm"] for zone in reader.lookup("a")[0]["zoi"]] == [20.0, 22.5]
+    assert reader.lookup("b")[0]["zoi"] == []
+    
+    # Appends from the reader see the writer's rows instead of overwriting them
+    reader.append([reading("c", [18.0])])
+    writer.refresh()
+    assert writer.readings == 3
+    assert [entry["filename"] for name in ("a", "b", "c") for entry in writer.lookup(name)] == ["a", "b", "c"]
+
+def test_find_and_lookup_after_capacity_growth(tmp_path, monkeypatch):
+    monkeypatch.setattr(zoi_store, "INITIAL_CAPACITY", 4)
+    store = ZoiStore(str(tmp_path))
+    other = ZoiStore(str(tmp_path))
+    readings = [reading(f"plate_{index % 5}", [10.0 + index, 30.0]) for index in range(12)]
+    store.append(readings[:4])
+    assert store.find("plate_3").tolist() == [3]
+    
+    store.append(readings[4:])
+    assert store._rows.capacity >= 24 and store._readings.capacity >= 12
+    assert store.find("plate_3").tolist() == [3, 8]
+    assert [entry["zoi"][0]["diameter_mm"] for entry in store.lookup("plate_3")] == [13.0, 18.0]
+    
+    other.refresh()
+    assert other._rows.capacity == store._rows.capacity
+    assert [entry["zoi"][0]["diameter_mm"] for entry in other.lookup("plate_4")] == [14.0, 19.0]
+
+def test_skip_unchanged(tmp_path):
+    store = ZoiStore(str(tmp_path))
+    other = ZoiStore(str(tmp_path))
+    
+    assert store.append([reading("a", [20.0, 22.5])], skip_unchanged=True) == 1
+    # The other instance hasn't refreshed; the check does it under the lock
+    assert other.append([reading("a", [20.0, 22.5])], skip_unchanged=True) == 0
+    assert other.append([reading("a", [20.0, 22.5], source="reference")], skip_unchanged=True) == 1
+    assert other.append([reading("a", [20.0]), reading("b", [20.0])], skip_unchanged=True) == 2
+    assert other.append([reading("a", [20.0]), reading("b", [21.0])], skip_unchanged=True) == 1
+    assert store.append([reading("a", [20.0, 22.5])], skip_unchanged=True) == 1
+    
+    store.refresh()
+    assert [len(entry["zoi"]) for entry in store.lookup("a", source="detected")] == [2, 1, 2]
+    assert [entry["zoi"][0]["diameter_mm"] for entry in store.lookup("b")] == [20.0, 21.0]
+
+def test_aggregate(tmp_path):
+    store = ZoiStore(str(tmp_path))
+    store.append([
+        reading("p1_a", [20.0, 24.0], date="2023-08-25", plate="p1"),
+        reading("p1_b", [22.0], date="2023-08-30", plate="p1"),
+        reading("p2_a", [30.0, 32.0], plate="p2"),
+        reading("p2_b", [], plate="p2"),
+    ])
+    
+    by_plate = store.aggregate("plate")
+    assert [group["plate"] for group in by_plate] == ["p1", "p2"]
+    assert [group["count"] for group in by_plate] == [3, 2]
+    assert by_plate[0]["mean_mm"] == pytest.approx(22.0)
+    assert by_plate[0]["std_mm"] == pytest.approx(np.std([20.0, 24.0, 22.0]))
+    assert (by_plate[1]["min_mm"], by_plate[1]["max_mm"]) == (30.0, 32.0)
+    
+    # Undated readings (NO_DATE) come first; their key is far from the
+    # days, so the groups are renumbered rather than counted by offset
+    by_date = store.aggregate("date")
+    assert [(group["date"], group["count"]) for group in by_date] == [(None, 2), ("2023-08-25", 2),
+                                                                     ("2023-08-30", 1)]
+    assert by_date[0]["mean_mm"] == pytest.approx(31.0)
+    
+    assert [group["count"] for group in store.aggregate("disc")] == [3, 2]
+    assert store.aggregate("plate", plate="p1", date_from="2023-08-26") == [
+        {"plate": "p1", "count": 1, "mean_mm": 22.0, "std_mm": 0.0, "min_mm": 22.0, "max_mm": 22.0}]
+    assert store.aggregate("plate", plate="p3") == []
+    with pytest.raises(ValueError):
+        store.aggregate("filename")
@@ -0,0 +1,349 @@
+import atexit
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Entry files hold two length-prefixed parts: the result JSON and the
+# detection image (empty when there is none)
+ENTRY_SUFFIX = ".entry"
+PART_HEADER = struct.Struct(">I")
+
+# Hits and misses are counted in memory and added to stats.json at most this
+# often (in seconds), and when the process exits
+STATS_FLUSH_INTERVAL = 5.0
+
+# Hit and miss counts not yet in stats.json, per cache directory. Kept per
+# process rather than per ResultCache, since pool workers get a fresh copy
+# of the cache with every task
+_pending_counts = {}
+_last_flush = {}
+_pending_lock = threading.Lock()
+_flush_at_exit = False
+
+class FileLock:
+    """
+    Exclusive lock on a file, shared between processes.
+    
+    Used as a context manager; blocks until the lock is acquired.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+    
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ten seconds
+                    continue
+        return self
+    
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of detection results.
+    
+    Entries are keyed by a hash of the image bytes and the detection
+    parameters (see make_key) and hold the result JSON plus the encoded
+    detection image. Each entry is written to a temporary file and renamed
+    into place, so readers never see a partial entry and several processes
+    can share one cache directory. Reading an entry refreshes its
+    modification time; when the cache grows beyond max_bytes the least
+    recently used entries are evicted. The total size of the entries and
+    the hit and miss counts are kept in stats.json next to the entries;
+    lookups are counted in memory and added to it every few seconds (see
+    flush_stats).
+    """
+    
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: Cache directory, created if missing
+            max_bytes: Size cap of all entries together
+        """
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+        self._stats_path = os.path.join(directory, "stats.json")
+    
+    @staticmethod
+    def make_key(image_data, params):
+        """
+        Cache key of an image and the parameters it is processed with.
+        
+        Args:
+            image_data: Encoded image bytes
+            params: JSON-serialisable dictionary of everything else that
+                influences the result
+        """
+        digest = hashlib.sha256(image_data)
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+    
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+    
+    def get(self, key, need_overlay=False):
+        """
+        Look up an entry and count the hit or miss.
+        
+        Args:
+            key: Key from make_key
+            need_overlay: Treat entries stored without a detection image as misses
+        
+        Returns:
+            Tuple containing (result dictionary, detection image bytes or
+            None), or None on a miss
+        """
+        path = self._entry_path(key)
+        entry = None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            entry = self._unpack(data)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, evicted in the meantime, or unreadable
+            entry = None
+        
+        if entry is not None and need_overlay and entry[1] is None:
+            entry = None
+        self._count("hits" if entry is not None else "misses")
+        return entry
+    
+    def put(self, key, result, overlay=None):
+        """
+        Store an entry and evict old entries if the cache is over its size cap.
+        
+        The size of the cache is tracked in stats.json, so the entries are
+        only listed when it crosses max_bytes.
+        
+        Args:
+            key: Key from make_key
+            result: JSON-serialisable result dictionary
+            overlay: Encoded detection image bytes, or None
+        """
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = self._pack(json.dumps(result).encode("utf-8"), overlay or b"")
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        
+        with FileLock(self._lock_path):
+            counts = self._read_stats()
+            self._add_pending(counts)
+            if counts.get("bytes") is None:
+                # Cache written before the size was tracked
+                counts["bytes"] = sum(size for _, size, _ in self._entries())
+            else:
+                counts["bytes"] += len(data) - replaced
+            if counts["bytes"] > self.max_bytes:
+                _, counts["bytes"] = self._evict_locked()
+            self._write_stats(counts)
+    
+    def _entries(self):
+        # (mtime, size, path) of every entry
+        entries = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if not entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+    
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits max_bytes.
+        
+        Returns:
+            Number of removed entries
+        """
+        with FileLock(self._lock_path):
+            counts = self._read_stats()
+            removed, counts["bytes"] = self._evict_locked()
+            self._write_stats(counts)
+        return removed
+    
+    def _evict_locked(self):
+        # Returns (number of removed entries, size of the remaining ones).
+        # The size also corrects any drift of the tracked size, e.g. from
+        # entries deleted by hand
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed, total
+    
+    def clear(self):
+        """
+        Remove all entries and reset the statistics.
+        """
+        with _pending_lock:
+            _pending_counts.pop(self.directory, None)
+        with FileLock(self._lock_path):
+            for _, _, path in self._entries():
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self._write_stats({"hits": 0, "misses": 0, "bytes": 0})
+    
+    def stats(self):
+        """
+        Current size and hit rate of the cache.
+        
+        Lookups other processes have not flushed yet are not included.
+        
+        Returns:
+            Dictionary with entries, bytes, max_bytes, hits, misses and hit_rate
+        """
+        self.flush_stats()
+        entries = self._entries()
+        counts = self._read_stats()
+        lookups = counts["hits"] + counts["misses"]
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "hit_rate": counts["hits"] / lookups if lookups else 0.0,
+        }
+    
+    def flush_stats(self):
+        """
+        Add the hits and misses this process counted to stats.json.
+        """
+        with _pending_lock:
+            if not _pending_counts.get(self.directory):
+                return
+        with FileLock(self._lock_path):
+            counts = self._read_stats()
+            self._add_pending(counts)
+            self._write_stats(counts)
+    
+    def _count(self, name):
+        global _flush_at_exit
+        with _pending_lock:
+            if not _flush_at_exit:
+                atexit.register(flush_stats)
+                _flush_at_exit = True
+            pending = _pending_counts.setdefault(self.directory, {"hits": 0, "misses": 0})
+            pending[name] += 1
+            due = time.monotonic() - _last_flush.get(self.directory, 0.0) >= STATS_FLUSH_INTERVAL
+        if due:
+            self.flush_stats()
+    
+    def _add_pending(self, counts):
+        # Moves this process's counts into counts read from stats.json; the
+        # caller holds the file lock and writes them back
+        with _pending_lock:
+            pending = _pending_counts.pop(self.directory, {})
+            _last_flush[self.directory] = time.monotonic()
+        for name, count in pending.items():
+            counts[name] += count
+    
+    def _read_stats(self):
+        counts = {"hits": 0, "misses": 0}
+        try:
+            with open(self._stats_path, "r", encoding="utf-8") as f:
+                counts.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        return counts
+    
+    def _write_stats(self, counts):
+        tmp_path = self._stats_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(counts, f)
+        os.replace(tmp_path, self._stats_path)
+    
+    @staticmethod
+    def _pack(*parts):
+        return b"".join(PART_HEADER.pack(len(part)) + part for part in parts)
+    
+    @staticmethod
+    def _unpack(data):
+        parts = []
+        offset = 0
+        for _ in range(2):
+            if offset + PART_HEADER.size > len(data):
+                raise ValueError("Truncated cache entry")
+            (length,) = PART_HEADER.unpack_from(data, offset)
+            offset += PART_HEADER.size
+            parts.append(data[offset:offset + length])
+            offset += length
+        if offset != len(data):
+            raise ValueError("Corrupt cache entry")
+        return json.loads(parts[0].decode("utf-8")), parts[1] or None
+
+def flush_stats():
+    """
+    Add the hits and misses counted by this process to the stats.json of
+    every cache directory it used.
+    
+    Registered with atexit on the first lookup. Pool processes exit without
+    running atexit handlers, so their initializer has to arrange the call.
+    """
+    with _pending_lock:
+        directories = list(_pending_counts)
+    for directory in directories:
+        ResultCache(directory).flush_stats()
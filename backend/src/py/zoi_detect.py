@@ -3,653 +3,2348 @@ import numpy as np
 import sys
 import json
 import os
+import pstats
+import argparse
+import atexit
+import contextlib
+import cProfile
+import datetime
+import hashlib
+import inspect
+import multiprocessing.util
+import queue
+import re
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from xml.sax.saxutils import escape as xml_escape
 
-def detect_zoi(image_path, pixels_per_mm=10.0):
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from zoi_cache import ResultCache, DEFAULT_MAX_BYTES, flush_stats as flush_cache_stats
+from zoi_store import ZoiStore
+from zoi_jobs import JobOutputs
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Debug output levels:
+#   none  - no images are written
+#   final - only the detection image (zoi_detection.png, or another format, see OverlayEncoding)
+#   full  - the overlay plus every intermediate step (01_... to 13_...)
+DEBUG_NONE = "none"
+DEBUG_FINAL = "final"
+DEBUG_FULL = "full"
+DEBUG_LEVELS = (DEBUG_NONE, DEBUG_FINAL, DEBUG_FULL)
+
+# Formats of the detection image (see OverlayEncoding): encoded raster
+# images, or the drawn shapes as vectors for the UI to draw over the original
+OVERLAY_PNG = "png"
+OVERLAY_JPEG = "jpg"
+OVERLAY_WEBP = "webp"
+OVERLAY_SVG = "svg"
+OVERLAY_JSON = "json"
+OVERLAY_FORMATS = (OVERLAY_PNG, OVERLAY_JPEG, OVERLAY_WEBP, OVERLAY_SVG, OVERLAY_JSON)
+OVERLAY_MEDIA_TYPES = {
+    OVERLAY_PNG: "image/png",
+    OVERLAY_JPEG: "image/jpeg",
+    OVERLAY_WEBP: "image/webp",
+    OVERLAY_SVG: "image/svg+xml",
+    OVERLAY_JSON: "application/json",
+}
+# Quality of JPEG and WebP detection images unless one is given
+OVERLAY_QUALITY = 90
+# Look of the overlay shapes by kind: BGR color, line thickness, and the
+# font scale and thickness of their labels
+OVERLAY_STYLES = {
+    "dish": ((0, 255, 0), 2, 1.0, 2),  # Petri dish boundary
+    "candidate": ((0, 165, 255), 1, 0.5, 1),  # Every detected ZoI, including overlaps
+    "zone": ((0, 255, 255), 2, 0.5, 1),  # Final (deduplicated) ZoIs
+}
+
+# Petri dish search strategies, see locate_petri_dish()
+DISH_AUTO = "auto"
+DISH_PYRAMID = "pyramid"
+DISH_FULL = "full"
+DISH_MODES = (DISH_AUTO, DISH_PYRAMID, DISH_FULL)
+
+# Images of at least this many pixels use the pyramid in auto mode, and the
+# coarse level is downscaled to this longest side
+PYRAMID_MIN_PIXELS = 2000000
+PYRAMID_COARSE_SIDE = 512
+
+# Multi-plate scans (see locate_petri_dishes): dishes are searched on a copy
+# downscaled to this longest side, with radii between these fractions of its
+# shorter side. A dish needs a clear rim on this fraction of its rays and a
+# radius of at least this fraction of the largest dish's
+MULTI_DISH_COARSE_SIDE = 1024
+MULTI_DISH_MIN_RADIUS = 0.08
+MULTI_DISH_MAX_RADIUS = 0.6
+MULTI_DISH_MIN_SUPPORT = 0.75
+MULTI_DISH_MIN_RELATIVE_RADIUS = 0.6
+
+# Options of detect_image() that callers may set per image
+DETECT_OPTIONS = ("dish_mode", "dish_roi", "multi_dish", "measure", "hough")
+
+# ZoI diameter measurement: from the area of the zone's contour, or from its
+# edge along rays around its center (see measure_zone)
+MEASURE_AREA = "area"
+MEASURE_RADIAL = "radial"
+MEASURE_MODES = (MEASURE_AREA, MEASURE_RADIAL)
+# Radial measurement: rays per zone and the searched range of edge radii as
+# fractions of the contour radius. The edge must be found on this fraction
+# of the rays and the center may move by this fraction of the radius. A zone
+# is flagged as overlapping when its edge is off the fitted circle (or
+# missing) on this fraction of the rays, or when the edge radii spread by
+# this fraction of the radius (standard deviation)
+ZONE_ANGLES = 90
+ZONE_SEARCH_INNER = 0.5
+ZONE_SEARCH_OUTER = 1.5
+ZONE_MIN_SUPPORT = 0.5
+ZONE_MAX_SHIFT = 0.25
+ZONE_OVERLAP_FRACTION = 0.08
+ZONE_OVERLAP_SPREAD = 0.05
+# Along a ray, the first step of at least this fraction of the strongest one is the zone edge
+ZONE_EDGE_RELATIVE = 0.5
+# Diameter (mm) of the antibiotic discs; zone edges are searched beyond them
+DISC_DIAMETER_MM = 6.0
+
+# Region processed after dish detection, see detect_zoi_in_image()
+ROI_NONE = "none"
+ROI_CROP = "crop"
+ROI_DISK = "disk"
+ROI_MODES = (ROI_NONE, ROI_CROP, ROI_DISK)
+
+# Circle Hough transform of the overlap splitting and fallback stages:
+# cv2.HoughCircles, or CircleVoter, which votes once for every threshold
+# but doesn't pick the same circles (see CircleVoter)
+HOUGH_OPENCV = "opencv"
+HOUGH_VOTER = "voter"
+HOUGH_MODES = (HOUGH_OPENCV, HOUGH_VOTER)
+
+# Length prefix of the binary frames used for stdin input and --serve --framed:
+# a 4-byte big-endian payload length followed by the payload
+FRAME_HEADER = struct.Struct(">I")
+
+# Time series (--series): image names like 20230825_PoC1_0219_RGB_all are
+# the imaging date followed by the plate ID
+SERIES_NAME = re.compile(r"^(\d{8})_(.+?)(?:_RGB_all)?$", re.IGNORECASE)
+SERIES_FULL = "full"  # Detected from scratch
+SERIES_SEEDED = "seeded"  # Re-measured around the previous image's zones
+# Annulus searched for the edge of a freshly detected zone, and around the
+# previous edge in later images, as fractions of the radius
+SERIES_DETECT_BAND = 0.3
+SERIES_SEED_BAND = 0.15
+# Fraction of the rays that must find an edge for it to count
+SERIES_MIN_SUPPORT = 0.5
+# Largest center movement of a zone (fraction of its radius) and of the dish
+SERIES_MAX_SHIFT = 0.1
+SERIES_DISH_SHIFT = 0.05
+
+# Fixed rigs (--rig): plates are this wide (mm) unless the profile says
+# otherwise. An image keeps the calibrated dish when this fraction of the
+# rim is found within this fraction of the radius of the calibrated circle
+RIG_PLATE_DIAMETER_MM = 90.0
+RIG_MIN_RIM_SUPPORT = 0.6
+RIG_TOLERANCE = 0.02
+# How the dish of an image on a rig was found
+RIG_VERIFIED = "verified"  # calibrated dish in place, dish search skipped
+RIG_CALIBRATED = "calibrated"  # dish detected, profile (re)calibrated from it
+RIG_REJECTED = "rejected"  # dish detected, but its rim too weak to calibrate from
+
+# Video streams (--stream): how much of the previous frame's work is reused
+REUSE_RESULT = "result"  # scene unchanged, previous result as is
+REUSE_DISH = "dish"  # dish still in place, ZoI stages only
+REUSE_NONE = "none"  # full detection
+# Width of the grayscale thumbnail frames are compared on
+STREAM_THUMB_WIDTH = 160
+# Mean absolute thumbnail difference (gray levels) below which a frame counts as unchanged
+STREAM_STILL_DIFF = 0.8
+# The previous dish is kept while this fraction of its rim is still found...
+STREAM_MIN_RIM_SUPPORT = 0.5
+# ...and the rim moved by no more than this fraction of the dish radius
+STREAM_DISH_TOLERANCE = 0.02
+
+# Threshold polarities: regions brighter or darker than the threshold
+BRIGHT = "bright"
+DARK = "dark"
+
+# Shared processing objects, created once per process so that long-lived
+# workers (see --serve) don't rebuild them for every image
+CLAHE = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+MORPH_KERNEL = np.ones((3, 3), np.uint8)
+
+# A single zone larger than this (mm) may be two overlapping ones and is split
+SPLIT_MIN_DIAMETER_MM = 25
+# Threshold sweep zones less circular than this need the adaptive threshold too
+ACCEPT_MIN_CIRCULARITY = 0.8
+# Votes (edge points x radii) CircleVoter casts at once
+VOTE_CHUNK = 1 << 22
+# Margin (px) around the zone crops of the split stages, wide enough that
+# the 5x5 blur and the edge filters only see black beyond the zone
+CROP_MARGIN = 3
+# Margin (px) around the dish bounding square of the dish ROI. It covers the
+# reach of the adaptive threshold block (71), the blur and the morphology,
+# so within the dish the ROI stages see the same pixels as on the full frame
+ROI_MARGIN = 48
+# Size cap of the disk masks kept between stages and images (see MaskCache)
+MASK_CACHE_BYTES = 32 * 1024 * 1024
+
+class DebugImageWriter:
     """
-    Detects Zones of Inhibition (ZoI) in a petri dish image.
+    Encodes and writes debug images on a background thread so that the PNG
+    encoding and disk I/O don't add to the detection latency.
     
-    Args:
-        image_path: Path to the input image
-        pixels_per_mm: Calibration factor to convert pixels to mm
-        
-    Returns:
-        List of dictionaries containing center_x, center_y, and diameter_mm for each ZoI
+    One writer is shared by the whole process; call flush() to wait until
+    every queued image is on disk (this also happens at exit).
     """
-    # Read the image
-    image = cv2.imread(image_path)
-    if image is None:
-        return [], None
     
-    # Get base filename for special case detection
-    base_filename = os.path.basename(image_path)
-    base_name = os.path.splitext(base_filename)[0]
+    def __init__(self, max_pending=32):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="debug-image-writer", daemon=True)
+        self._thread.start()
     
-    # Convert to grayscale for dish detection
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def _run(self):
+        while True:
+            path, image = self._queue.get()
+            try:
+                cv2.imwrite(path, image)
+            except Exception as e:
+                print(f"Error writing debug image {path}: {e}", file=sys.stderr)
+            finally:
+                self._queue.task_done()
     
-    # Detect petri dish
-    dish_center, dish_radius = detect_petri_dish(gray)
+    def write(self, path, image):
+        """
+        Queue an image for writing. The caller must not modify it afterwards.
+        Blocks only when too many images are already pending.
+        """
+        self._queue.put((path, image))
     
-    # Create result directory
-    result_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(image_path))), "result")
-    os.makedirs(result_dir, exist_ok=True)
+    def flush(self):
+        self._queue.join()
+
+_debug_writer = None
+_debug_writer_lock = threading.Lock()
+
+def get_debug_writer():
+    """
+    Return the process-wide DebugImageWriter, starting it on first use.
+    """
+    global _debug_writer
+    with _debug_writer_lock:
+        if _debug_writer is None:
+            _debug_writer = DebugImageWriter()
+            atexit.register(_debug_writer.flush)
+    return _debug_writer
+
+def flush_debug_images():
+    """
+    Wait until all queued debug images have been written.
+    """
+    if _debug_writer is not None:
+        _debug_writer.flush()
+
+class DebugImages:
+    """
+    Debug images of one detection run.
     
-    # Draw the detected petri dish boundary for debugging
-    debug_dish_image = image.copy()
-    cv2.circle(debug_dish_image, dish_center, dish_radius, (0, 255, 0), 2)
-    cv2.circle(debug_dish_image, (image.shape[1]//2, image.shape[0]//2), 5, (0, 0, 255), -1)  # Image center
-    cv2.imwrite(os.path.join(result_dir, "01_detected_dish.png"), debug_dish_image)
+    Only the full debug level writes intermediate images; below it write()
+    does nothing and canvas() returns None, so the stages don't build
+    visualizations nobody looks at.
+    """
     
-    # Process the full image first - don't mask out the dish area yet
-    # This prevents cutting off parts of the image
+    def __init__(self, level, result_dir):
+        """
+        Args:
+            level: Debug level (none, final or full)
+            result_dir: Directory the images are written to
+        """
+        self.full = level == DEBUG_FULL
+        if self.full and result_dir is None:
+            raise ValueError("Full debug images need a result directory")
+        self.result_dir = result_dir
+        self._writer = get_debug_writer() if self.full else None
     
-    # Apply histogram equalization to enhance contrast
-    equalized = cv2.equalizeHist(gray)
-    cv2.imwrite(os.path.join(result_dir, "02_equalized_full.png"), equalized)
+    def write(self, name, image):
+        """
+        Queue an image for writing under name; the caller must not modify it afterwards.
+        """
+        if self.full:
+            self._writer.write(os.path.join(self.result_dir, name), image)
     
-    # Further enhance with CLAHE
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-    enhanced = clahe.apply(equalized)
-    cv2.imwrite(os.path.join(result_dir, "03_enhanced_full.png"), enhanced)
+    def canvas(self, gray, center, radius, color):
+        """
+        Color copy of gray with one circle drawn on it, to draw detections
+        on, or None below the full debug level.
+        """
+        if not self.full:
+            return None
+        canvas = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        cv2.circle(canvas, center, radius, color, 2)
+        return canvas
+
+class ScratchPool:
+    """
+    Named scratch buffers for the intermediate images of a detection.
     
-    # Create the mask for ZoI detection - only exclude the center text area
-    # This keeps the entire image while only removing the central text
-    text_region_radius = dish_radius * 0.15  # Slightly smaller to avoid cutting into ZoI
-    full_mask = np.ones_like(gray)
-    cv2.circle(full_mask, dish_center, int(text_region_radius), 0, -1)  # Exclude center text
+    get(name, shape) hands out the buffer registered under name and only
+    allocates when there is none yet or its shape or dtype differs. The
+    stages write into these buffers with dst= instead of allocating a new
+    array per step, so images of the same size share memory. A buffer is
+    valid until the same name is asked for again: images that outlive their
+    stage get a name of their own, while images only used within a stage
+    take the shared TEMP buffers. With reuse=False every get() allocates,
+    which is needed when the images are kept (full debug).
+    """
     
-    # Create a visualization of the mask
-    mask_viz = gray.copy()
-    cv2.circle(mask_viz, dish_center, dish_radius, (255), 2)  # Dish boundary
-    cv2.circle(mask_viz, dish_center, int(text_region_radius), (128), 2)  # Text region
-    cv2.imwrite(os.path.join(result_dir, "04_masks.png"), mask_viz)
+    def __init__(self, reuse=True):
+        self.reuse = reuse
+        self._buffers = {}
     
-    # Apply the mask to the enhanced image - only excludes center text
-    masked_enhanced = cv2.bitwise_and(enhanced, enhanced, mask=full_mask)
-    cv2.imwrite(os.path.join(result_dir, "05_masked_enhanced.png"), masked_enhanced)
+    def get(self, name, shape, dtype=np.uint8):
+        if not self.reuse:
+            return np.empty(shape, dtype)
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            # Let the old buffer go before allocating its replacement
+            self._buffers.pop(name, None)
+            buffer = self._buffers[name] = np.empty(shape, dtype)
+        return buffer
     
-    # Apply a slight blur to reduce noise
-    blurred = cv2.GaussianBlur(masked_enhanced, (5, 5), 0)
-    cv2.imwrite(os.path.join(result_dir, "06_blurred.png"), blurred)
+    def zeros(self, name, shape, dtype=np.uint8):
+        buffer = self.get(name, shape, dtype)
+        buffer.fill(0)
+        return buffer
     
-    # Define kernel for morphological operations
-    kernel = np.ones((3, 3), np.uint8)
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
     
-    # Try multiple threshold approaches to find ZoIs
-    zoi_list = []
+    def trim(self, max_bytes=0):
+        """
+        Drop the largest buffers until at most max_bytes are kept.
+        """
+        for name, buffer in sorted(self._buffers.items(), key=lambda item: item[1].nbytes, reverse=True):
+            if self.nbytes <= max_bytes:
+                break
+            del self._buffers[name]
+
+# ScratchPool names of the images that don't outlive their stage
+TEMP_A, TEMP_B, TEMP_C = "temp_a", "temp_b", "temp_c"
+
+# Scratch buffers are kept per thread; between images only up to
+# _scratch_budget bytes of them stay allocated (see set_scratch_budget)
+_scratch = threading.local()
+_scratch_budget = 0
+
+def get_scratch_pool():
+    """
+    Return this thread's ScratchPool.
+    """
+    if not hasattr(_scratch, "pool"):
+        _scratch.pool = ScratchPool()
+    return _scratch.pool
+
+def set_scratch_budget(max_bytes):
+    """
+    How many bytes of scratch buffers each thread keeps between images.
     
-    # Try multiple thresholds for bright spots to catch ZoIs with varying edge characteristics
-    bright_contours = []
-    bright_thresholds = [190, 160, 140]  # Multiple thresholds to catch different ZoI types
+    Keeping them saves allocating and faulting in the same large buffers for
+    every image of a long-lived worker; 0 (the default) frees them after
+    every image.
+    """
+    global _scratch_budget
+    _scratch_budget = int(max_bytes)
 
-    for thresh in bright_thresholds:
-        _, temp_mask = cv2.threshold(blurred, thresh, 255, cv2.THRESH_BINARY)
-        temp_mask = cv2.morphologyEx(temp_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        temp_mask = cv2.morphologyEx(temp_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+class MaskCache:
+    """
+    Least recently used cache of disk masks, shared by the stages and by
+    consecutive images.
+    
+    A mask is keyed by its exact geometry: the image shape, the integer
+    center and radius cv2.circle draws, and the radius of an excluded
+    center hole. Masks of crops around a zone are keyed by the crop's shape
+    and the center within it, so zones of the same size hit the same entry
+    wherever they are; full-frame dish masks hit while the dish stays in
+    place, as on a fixed rig. The masks are read-only and are shared between
+    threads. Entries are evicted once they hold more than max_bytes together.
+    
+    disk_area() memoizes the pixel count of a whole disk per radius.
+    """
+    
+    def __init__(self, max_bytes=MASK_CACHE_BYTES):
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._masks = OrderedDict()
+        self._nbytes = 0
+        self._areas = {}
+        self._lock = threading.Lock()
+    
+    def disk(self, shape, center, radius, hole=0):
+        """
+        Read-only uint8 mask that is 255 on the disk and 0 elsewhere.
         
-        if thresh == 190:  # Save first one for debug
-            cv2.imwrite(os.path.join(result_dir, "07_bright_mask.png"), temp_mask)
-            cv2.imwrite(os.path.join(result_dir, "08_bright_mask_cleaned.png"), temp_mask)
-            
-        # Find contours and add to the collection
-        temp_contours, _ = cv2.findContours(temp_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        bright_contours.extend(temp_contours)
+        Args:
+            shape: (height, width) of the mask
+            center: Integer (x, y) of the disk
+            radius: Radius of the disk, or None for the whole frame
+            hole: Radius of a disk around center left at 0 (0 for none)
+        """
+        key = (tuple(shape[:2]), int(center[0]), int(center[1]), radius if radius is None else int(radius),
+               int(hole))
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                self.hits += 1
+                return mask
+            self.misses += 1
+        
+        center = (int(center[0]), int(center[1]))
+        if radius is None:
+            mask = np.full(shape[:2], 255, np.uint8)
+        else:
+            mask = np.zeros(shape[:2], np.uint8)
+            cv2.circle(mask, center, int(radius), 255, -1)
+        if hole > 0:
+            cv2.circle(mask, center, int(hole), 0, -1)
+        mask.flags.writeable = False
+        
+        if mask.nbytes <= self.max_bytes:
+            with self._lock:
+                if key not in self._masks:
+                    self._masks[key] = mask
+                    self._nbytes += mask.nbytes
+                    self._evict(self.max_bytes)
+        return mask
+    
+    def disk_area(self, radius):
+        """
+        Number of pixels cv2.circle fills for a whole disk of the radius.
+        """
+        radius = int(radius)
+        area = self._areas.get(radius)
+        if area is None:
+            patch = np.zeros((2 * radius + 1, 2 * radius + 1), np.uint8)
+            cv2.circle(patch, (radius, radius), radius, 255, -1)
+            area = self._areas[radius] = cv2.countNonZero(patch)
+        return area
+    
+    def resize(self, max_bytes):
+        """
+        Change the size cap, evicting entries beyond it.
+        """
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict(self.max_bytes)
+    
+    def stats(self):
+        """
+        Dictionary with entries, bytes, max_bytes, hits and misses.
+        """
+        with self._lock:
+            return {"entries": len(self._masks), "bytes": self._nbytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+    
+    def _evict(self, max_bytes):
+        # Called with the lock held
+        while self._nbytes > max_bytes and self._masks:
+            _, mask = self._masks.popitem(last=False)
+            self._nbytes -= mask.nbytes
 
-    # 2. Second approach: find dark spots (black areas in a lighter background)
-    _, dark_mask = cv2.threshold(blurred, 70, 255, cv2.THRESH_BINARY_INV)
-    cv2.imwrite(os.path.join(result_dir, "09_dark_mask.png"), dark_mask)
+_mask_cache = MaskCache()
+
+def get_mask_cache():
+    """
+    Return the process-wide MaskCache.
+    """
+    return _mask_cache
+
+def set_mask_cache_budget(max_bytes):
+    """
+    How many bytes of masks the process-wide MaskCache keeps (0 disables it).
+    """
+    _mask_cache.resize(max_bytes)
+
+# Shared thread pool for the independent passes of one image (see
+# configure_threads); None runs them one after another
+_pass_executor = None
+
+def configure_threads(threads=None, pass_threads=1):
+    """
+    Split this process's share of the CPU between concurrent passes and OpenCV.
     
-    # Clean up the dark spots
-    dark_mask = cv2.morphologyEx(dark_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-    dark_mask = cv2.morphologyEx(dark_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-    cv2.imwrite(os.path.join(result_dir, "10_dark_mask_cleaned.png"), dark_mask)
+    With pass_threads > 1 the independent passes of an image (the bright
+    and dark threshold sweeps, the adaptive threshold and the overlap
+    splitting methods) run concurrently on a shared thread pool, and OpenCV's
+    own thread count is divided by the number of passes, so the two don't
+    oversubscribe the cores.
     
-    # Find contours of dark areas
-    dark_contours, _ = cv2.findContours(dark_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    Args:
+        threads: Cores this process may use (default: all of them); batch
+            workers use 1
+        pass_threads: How many passes of one image may run at once
+    """
+    global _pass_executor
+    threads = max(1, threads or os.cpu_count() or 1)
+    pass_threads = max(1, min(int(pass_threads), threads))
+    cv2.setNumThreads(max(1, threads // pass_threads))
     
-    # Try multiple thresholds for dark spots too
-    dark_contours = []
-    dark_thresholds = [70, 90, 110]  # Multiple thresholds for dark ZoIs
+    if _pass_executor is not None:
+        _pass_executor.shutdown(wait=False)
+    _pass_executor = None
+    if pass_threads > 1:
+        _pass_executor = ThreadPoolExecutor(max_workers=pass_threads, thread_name_prefix="zoi-pass")
 
-    for thresh in dark_thresholds:
-        _, temp_mask = cv2.threshold(blurred, thresh, 255, cv2.THRESH_BINARY_INV)
-        temp_mask = cv2.morphologyEx(temp_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        temp_mask = cv2.morphologyEx(temp_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-        
-        if thresh == 70:  # Save first one for debug
-            cv2.imwrite(os.path.join(result_dir, "09_dark_mask.png"), temp_mask)
-            cv2.imwrite(os.path.join(result_dir, "10_dark_mask_cleaned.png"), temp_mask)
-            
-        # Find contours and add to the collection
-        temp_contours, _ = cv2.findContours(temp_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        dark_contours.extend(temp_contours)
+def get_pass_executor():
+    """
+    Return the thread pool for concurrent passes, or None (see configure_threads).
+    """
+    return _pass_executor
 
-    # Also try adaptive thresholding for situations where fixed thresholds fail
-    adaptive_thresh = cv2.adaptiveThreshold(
-        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY, 71, 7
-    )
-    adaptive_thresh = cv2.morphologyEx(adaptive_thresh, cv2.MORPH_OPEN, kernel, iterations=1)
-    adaptive_thresh = cv2.morphologyEx(adaptive_thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (None where unsupported).
+    """
+    # On Linux ru_maxrss survives exec, so a spawned process would report
+    # its parent's peak; VmHWM belongs to the current address space
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
 
-    # Need to unpack the tuple returned by findContours properly
-    adaptive_contours_result = cv2.findContours(adaptive_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if len(adaptive_contours_result) == 2:  # OpenCV 4.x
-        adaptive_contours, _ = adaptive_contours_result
-    else:  # OpenCV 3.x
-        _, adaptive_contours, _ = adaptive_contours_result
+def draw_zoi(canvas, center, radius, color, label=None):
+    """
+    Draw a detected circle and its label on a debug canvas (if there is one).
+    """
+    if canvas is None:
+        return
+    cv2.circle(canvas, center, radius, color, 2)
+    if label is not None:
+        cv2.putText(canvas, label, (center[0] - 30, center[1] - radius - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
 
-    cv2.imwrite(os.path.join(result_dir, "10b_adaptive_thresh.png"), adaptive_thresh)
+def overlay_circle(kind, center, radius, label=None, label_at=None):
+    """
+    One circle of a detection overlay (see OverlayEncoding).
+    
+    Args:
+        kind: "dish", "candidate" or "zone", which selects its style (see OVERLAY_STYLES)
+        center: (x, y) in image pixels
+        radius: Radius in pixels
+        label: Optional text drawn with the circle
+        label_at: Start of the label's baseline (default: above the circle, as draw_zoi puts it)
     
-    # Process all contours - bright, dark, and adaptive
-    all_contours = bright_contours + dark_contours + list(adaptive_contours)
+    Returns:
+        Dictionary with kind, x, y and r (and label, label_x and label_y)
+    """
+    shape = {"kind": kind, "x": int(center[0]), "y": int(center[1]), "r": int(radius)}
+    if label is not None:
+        if label_at is None:
+            label_at = (center[0] - 30, center[1] - radius - 10)
+        shape.update(label=label, label_x=int(label_at[0]), label_y=int(label_at[1]))
+    return shape
+
+def draw_overlay(image, overlay, size=None):
+    """
+    Draw the shapes of an overlay on a copy of the image.
     
-    # Create a visualization image for contours
-    contour_viz = cv2.cvtColor(gray.copy(), cv2.COLOR_GRAY2BGR)
-    cv2.circle(contour_viz, dish_center, dish_radius, (0, 255, 0), 2)  # Dish boundary - green circle
+    Args:
+        image: BGR image the overlay was made for
+        overlay: Dictionary with width, height and shapes (see overlay_circle)
+        size: Optional (width, height) to downscale the image to first; the
+            shapes are scaled along, while lines and labels keep their size
     
-    # Set detection parameters based on image characteristics
-    # Check if it's a multi-ZoI pattern (based on filename markers)
-    if "POC1_0224" in base_name or "POC2_0224" in base_name:
-        # Special case for 6-ZoI images
-        min_area = 100
-        circularity_threshold = 0.3
-        # Special thresholds for multi-ZoI images
-        bright_thresholds = [170, 150, 130]
-        dark_thresholds = [80, 100, 120]
-    elif "MUELLER" in base_name.upper() or "POC5_0219" in base_name.upper() or "POC4_0216" in base_name.upper():
-        # Special case for Mueller/small ZoI images
-        min_area = 50
-        circularity_threshold = 0.2
-        bright_thresholds = [180, 160, 140]
-        dark_thresholds = [70, 90, 110]
+    Returns:
+        The BGR canvas
+    """
+    scale = 1.0
+    if size is None:
+        canvas = image.copy()
     else:
-        # Default case
-        min_area = 200
-        circularity_threshold = 0.4
-        bright_thresholds = [190, 160, 140]
-        dark_thresholds = [70, 90, 110]
+        canvas = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        scale = size[0] / overlay["width"]
+    for shape in overlay["shapes"]:
+        color, thickness, font_scale, font_thickness = OVERLAY_STYLES[shape["kind"]]
+        center = (int(round(shape["x"] * scale)), int(round(shape["y"] * scale)))
+        cv2.circle(canvas, center, int(round(shape["r"] * scale)), color, thickness)
+        if "label" in shape:
+            cv2.putText(canvas, shape["label"], (int(round(shape["label_x"] * scale)),
+                                                 int(round(shape["label_y"] * scale))),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, font_thickness)
+    return canvas
+
+def overlay_svg(overlay):
+    """
+    Render the shapes of an overlay as an SVG document of the image's size
+    with a transparent background, to be laid over the original image.
+    """
+    width, height = overlay["width"], overlay["height"]
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}">']
+    for shape in overlay["shapes"]:
+        (blue, green, red), thickness, font_scale, font_thickness = OVERLAY_STYLES[shape["kind"]]
+        color = f"#{red:02x}{green:02x}{blue:02x}"
+        lines.append(f'<circle class="{shape["kind"]}" cx="{shape["x"]}" cy="{shape["y"]}" r="{shape["r"]}" '
+                     f'fill="none" stroke="{color}" stroke-width="{thickness}" vector-effect="non-scaling-stroke"/>')
+        if "label" in shape:
+            # Hershey simplex glyphs are about 30 px tall at scale 1
+            lines.append(f'<text class="{shape["kind"]}" x="{shape["label_x"]}" y="{shape["label_y"]}" '
+                         f'fill="{color}" font-family="sans-serif" font-size="{font_scale * 30:g}">'
+                         f'{xml_escape(shape["label"])}</text>')
+    lines.append("</svg>")
+    return "\n".join(lines)
+
+class OverlayEncoding:
+    """
+    How the detection image is produced.
     
-    # Process contours to find ZoIs
-    zoi_list = []
-    yellow_zoi_list = []  # Special list to track yellow-highlighted ZoIs
+    Raster formats draw the overlay on a copy of the image and encode it,
+    optionally downscaled to a preview. The vector formats skip both: svg
+    renders the shapes as an SVG document, and json returns them as they
+    are (see overlay_circle), for the UI to draw over the original image.
+    """
+    
+    def __init__(self, format=OVERLAY_PNG, quality=None, png_compression=None, preview_size=None):
+        """
+        Args:
+            format: One of OVERLAY_FORMATS
+            quality: JPEG/WebP quality from 0 to 100 (default: OVERLAY_QUALITY)
+            png_compression: PNG compression level from 0 (fastest) to 9
+                (smallest); default: OpenCV's
+            preview_size: Downscale raster images to at most this many
+                pixels on their longer side (default: full size)
+        """
+        if format not in OVERLAY_FORMATS:
+            raise ValueError(f"Unknown overlay format: {format}")
+        if quality is not None and not 0 <= int(quality) <= 100:
+            raise ValueError(f"Overlay quality must be between 0 and 100: {quality}")
+        if png_compression is not None and not 0 <= int(png_compression) <= 9:
+            raise ValueError(f"PNG compression must be between 0 and 9: {png_compression}")
+        if preview_size is not None and int(preview_size) < 1:
+            raise ValueError(f"Preview size must be positive: {preview_size}")
+        self.format = format
+        self.quality = None if quality is None else int(quality)
+        self.png_compression = None if png_compression is None else int(png_compression)
+        self.preview_size = None if preview_size is None else int(preview_size)
+    
+    @classmethod
+    def from_request(cls, request, default=None):
+        """
+        The encoding a serve() request asks for with "overlay",
+        "overlay_quality", "png_compression" and "preview_size"; settings it
+        doesn't give are taken from default.
+        """
+        default = default or PNG_OVERLAY
+        keys = ("overlay", "overlay_quality", "png_compression", "preview_size")
+        if not any(key in request for key in keys):
+            return default
+        return cls(request.get("overlay", default.format), request.get("overlay_quality", default.quality),
+                   request.get("png_compression", default.png_compression),
+                   request.get("preview_size", default.preview_size))
     
-    # Keep track of all processed areas to avoid duplicates
-    processed_areas = set()
+    @property
+    def extension(self):
+        return "." + self.format
     
-    # Special handling for the image with two ZoIs where one is smaller
-    is_special_case = "MUELLER" in base_name.upper() or "POC5_0219" in base_name.upper() or "POC4_0216" in base_name.upper()
+    @property
+    def media_type(self):
+        return OVERLAY_MEDIA_TYPES[self.format]
     
-    # For the special case with small and large ZoIs, try targeted detection
-    if is_special_case:
-        # Get two specific thresholds to separate large and small ZoIs
-        # First threshold for the larger ZoI
-        _, large_zoi_mask = cv2.threshold(blurred, 180, 255, cv2.THRESH_BINARY)
-        large_zoi_mask = cv2.morphologyEx(large_zoi_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        large_zoi_mask = cv2.morphologyEx(large_zoi_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    @property
+    def filename(self):
+        """Name of the detection image in a result directory."""
+        return "zoi_detection" + self.extension
+    
+    def params(self):
+        """
+        The settings as a dictionary, e.g. for cache keys.
+        """
+        return {"format": self.format, "quality": self.quality, "png_compression": self.png_compression,
+                "preview_size": self.preview_size}
+    
+    def encode(self, image, overlay):
+        """
+        Encode the detection image of an overlay.
         
-        # Handle OpenCV version differences in findContours return values
-        large_contours_result = cv2.findContours(large_zoi_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        large_contours = large_contours_result[0] if len(large_contours_result) == 2 else large_contours_result[1]
+        Args:
+            image: BGR image the overlay was made for
+            overlay: Dictionary with width, height and shapes (see overlay_circle)
         
-        # Second threshold specifically for the smaller ZoI
-        _, small_zoi_mask = cv2.threshold(blurred, 100, 255, cv2.THRESH_BINARY_INV)
-        small_zoi_mask = cv2.morphologyEx(small_zoi_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        small_zoi_mask = cv2.morphologyEx(small_zoi_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+        Returns:
+            The encoded bytes
+        """
+        if self.format == OVERLAY_JSON:
+            return json.dumps(overlay).encode("utf-8")
+        if self.format == OVERLAY_SVG:
+            return overlay_svg(overlay).encode("utf-8")
         
-        # Handle OpenCV version differences in findContours return values
-        small_contours_result = cv2.findContours(small_zoi_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        small_contours = small_contours_result[0] if len(small_contours_result) == 2 else small_contours_result[1]
+        size = None
+        longest = max(overlay["width"], overlay["height"])
+        if self.preview_size is not None and longest > self.preview_size:
+            scale = self.preview_size / longest
+            size = (max(1, round(overlay["width"] * scale)), max(1, round(overlay["height"] * scale)))
+        canvas = draw_overlay(image, overlay, size)
         
-        # Add these special contours to our list - ensure all are proper lists
-        all_contours = list(large_contours) + list(small_contours) + list(all_contours)
+        params = []
+        if self.format == OVERLAY_PNG and self.png_compression is not None:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        elif self.format == OVERLAY_JPEG:
+            params = [cv2.IMWRITE_JPEG_QUALITY, OVERLAY_QUALITY if self.quality is None else self.quality]
+        elif self.format == OVERLAY_WEBP:
+            params = [cv2.IMWRITE_WEBP_QUALITY, OVERLAY_QUALITY if self.quality is None else self.quality]
+        ok, encoded = cv2.imencode(self.extension, canvas, params)
+        if not ok:
+            raise ValueError("Could not encode the detection image")
+        return encoded.tobytes()
     
-    for idx, cnt in enumerate(all_contours):
-        area = cv2.contourArea(cnt)
+    def write(self, image, overlay, result_dir):
+        """
+        Encode the detection image of an overlay into result_dir.
         
-        # Filter by area - ZoIs should be reasonably sized but allow smaller ones
-        max_area = np.pi * (dish_radius * 0.4) ** 2
-        if area < min_area or area > max_area:
-            continue
+        Returns:
+            Path of the written file
+        """
+        path = os.path.join(result_dir, self.filename)
+        with open(path, "wb") as f:
+            f.write(self.encode(image, overlay))
+        return path
+
+# Detection images as before: full-size PNG at OpenCV's compression level
+PNG_OVERLAY = OverlayEncoding()
+
+class Timings:
+    """
+    Wall-clock spans of the detection stages.
+    
+    stage(name) ends the current top-level stage and starts the next one;
+    span(name) is a context manager for nested spans, which are reported as
+    "stage/span". Optionally one stage (by its full name) is run under
+    cProfile. Pass NO_TIMINGS where nothing should be recorded.
+    """
+    
+    def __init__(self, profile_stage=None):
+        """
+        Args:
+            profile_stage: Full name of a stage or span to profile with cProfile
+        """
+        self.origin = time.perf_counter()
+        self.events = []  # (name, start, duration) in seconds since origin
+        self.profile_stage = profile_stage
+        self.profile = None  # cProfile.Profile of profile_stage once it ran
+        self._open = []  # (name, start) of the running stage and spans
+    
+    def begin(self, name):
+        if self._open:
+            name = f"{self._open[-1][0]}/{name}"
+        self._open.append((name, time.perf_counter()))
+        if name == self.profile_stage:
+            if self.profile is None:
+                self.profile = cProfile.Profile()
+            self.profile.enable()
+    
+    def end(self):
+        name, start = self._open.pop()
+        if name == self.profile_stage:
+            self.profile.disable()
+        self.events.append((name, start - self.origin, time.perf_counter() - start))
+    
+    def stage(self, name):
+        """
+        End the running stage (if any) and start the next one (None: just end).
+        """
+        while self._open:
+            self.end()
+        if name is not None:
+            self.begin(name)
+    
+    @contextlib.contextmanager
+    def span(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+    
+    def summary(self):
+        """
+        Milliseconds per stage (repeated stages are added up) and in total,
+        plus the peak memory of the process so far, for the JSON result.
+        """
+        stages = {}
+        for name, _, duration in sorted(self.events, key=lambda event: event[1]):
+            stages[name] = round(stages.get(name, 0.0) + duration * 1000, 3)
+        peak = peak_rss_mb()
+        return {
+            "total_ms": round((time.perf_counter() - self.origin) * 1000, 3),
+            "stages": stages,
+            "peak_rss_mb": None if peak is None else round(peak, 1),
+        }
+    
+    def chrome_trace(self):
+        """
+        The spans in Chrome trace event format (chrome://tracing, Perfetto, speedscope).
+        """
+        events = [{
+            "name": name.rsplit("/", 1)[-1],
+            "cat": name.split("/", 1)[0],
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {"path": name},
+        } for name, start, duration in self.events]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+class _NoTimings(Timings):
+    # Records nothing; spans share one reusable no-op context
+    _null_span = contextlib.nullcontext()
+    
+    def __init__(self):
+        super().__init__()
+    
+    def begin(self, name):
+        pass
+    
+    def end(self):
+        pass
+    
+    def stage(self, name):
+        pass
+    
+    def span(self, name):
+        return self._null_span
+
+NO_TIMINGS = _NoTimings()
+
+class Pipeline:
+    """
+    Lazily evaluated stages with declared inputs and outputs.
+    
+    A stage is a function whose keyword arguments are its inputs and which
+    returns its outputs (a tuple when it has several). get(name) returns a
+    value, first running the stage that produces it after getting that
+    stage's inputs the same way. Every stage runs at most once and only
+    when one of its outputs is asked for; the stages that ran are listed in
+    ran, in order. Stage names double as Timings stage names.
+    
+    prefetch() starts stages ahead of time on an executor. They only count
+    as run (and are timed, for the time spent waiting on them) once one of
+    their outputs is asked for, so the outputs and ran are the same as
+    without prefetching.
+    """
+    
+    def __init__(self, stages, timings=None, **values):
+        """
+        Args:
+            stages: (name, function, inputs, outputs) tuples
+            timings: Optional Timings that records every stage; stages can
+                also ask for it as the input "timings"
+            **values: Initial values, e.g. the image and the options
+        """
+        self.timings = NO_TIMINGS if timings is None else timings
+        self.values = dict(values, timings=self.timings)
+        self.ran = []
+        self._stages = {}
+        self._producers = {}
+        self._pending = {}
+        for name, func, inputs, outputs in stages:
+            self._stages[name] = (func, tuple(inputs), tuple(outputs))
+            for output in outputs:
+                self._producers[output] = name
+    
+    def set(self, name, value):
+        """
+        Provide a value that is not produced by a stage.
+        """
+        self.values[name] = value
+    
+    def get(self, name):
+        if name not in self.values:
+            if name not in self._producers:
+                raise KeyError(f"No value or stage for {name}")
+            self._run(self._producers[name])
+        return self.values[name]
+    
+    def prefetch(self, names, executor, **overrides):
+        """
+        Start the stages producing names on executor.
         
-        # Get the center and radius
-        (x, y), radius = cv2.minEnclosingCircle(cnt)
-        center = (int(x), int(y))
+        The inputs of these stages are got here first, in this thread.
         
-        # For the special case image, override area limits
-        if is_special_case:
-            min_area = 50  # Even smaller allowed area
+        Args:
+            names: Values whose stages to start
+            executor: concurrent.futures executor to run them on
+            **overrides: Input values used by these stages instead of the
+                pipeline's, e.g. buffers that mustn't be shared between threads
+        """
+        for name in names:
+            stage = self._producers[name]
+            func, inputs, outputs = self._stages[stage]
+            if stage in self._pending or outputs[0] in self.values:
+                continue
+            kwargs = {value: overrides[value] if value in overrides else self.get(value) for value in inputs}
+            self._pending[stage] = executor.submit(func, **kwargs)
+    
+    def cancel(self):
+        """
+        Drop the prefetched stages nobody asked for (running ones finish unseen).
+        """
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+    
+    def _run(self, name):
+        func, inputs, outputs = self._stages[name]
+        future = self._pending.pop(name, None)
+        if future is not None:
+            self.timings.stage(name)
+            result = future.result()
+            self.timings.stage(None)
+        else:
+            kwargs = {value: self.get(value) for value in inputs}
+            self.timings.stage(name)
+            result = func(**kwargs)
+            self.timings.stage(None)
         
-        # Create a unique key for this center to avoid duplicates
-        center_key = f"{int(x/5)}_{int(y/5)}"  # Group centers within 5-pixel areas
-        if center_key in processed_areas:
-            continue
+        if len(outputs) == 1:
+            result = (result,)
+        self.values.update(zip(outputs, result))
+        self.ran.append(name)
+
+def get_result_dir(image_path):
+    """
+    Directory where result images for image_path are written unless the
+    caller gives one (such as a job directory, see process_job). It is
+    shared by all images of a directory.
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(image_path))), "result")
+
+class ThresholdComponentTree:
+    """
+    Candidate regions of one image at any number of bright or dark thresholds.
+    
+    A region at threshold t is a connected component of the cleaned level set
+    (pixels brighter than t for BRIGHT, not brighter than t for DARK, then
+    MORPH_OPEN once and MORPH_CLOSE twice). The level sets of one polarity are
+    nested, and flat morphology commutes with thresholding, so the opening and
+    closing are applied once to the grey levels of each polarity. Every
+    threshold is then just a cut through those filtered levels, which makes
+    additional thresholds nearly free.
+    """
+    
+    def __init__(self, image, kernel=MORPH_KERNEL, scratch=None):
+        self.image = image
+        self.kernel = kernel
+        self.scratch = ScratchPool(reuse=False) if scratch is None else scratch
+        self._levels = {}
+        self._contours = {}
+    
+    def levels(self, polarity):
+        """
+        Morphologically filtered grey levels for the given polarity.
+        """
+        if polarity not in self._levels:
+            if polarity == BRIGHT:
+                first, second = cv2.MORPH_OPEN, cv2.MORPH_CLOSE
+            elif polarity == DARK:
+                # Dual of the bright filter: opening the dark set is closing the grey levels
+                first, second = cv2.MORPH_CLOSE, cv2.MORPH_OPEN
+            else:
+                raise ValueError(f"Unknown polarity: {polarity}")
+            levels = self.scratch.get(TEMP_A if polarity == BRIGHT else TEMP_B, self.image.shape)
+            cv2.morphologyEx(self.image, first, self.kernel, dst=levels, iterations=1)
+            cv2.morphologyEx(levels, second, self.kernel, dst=levels, iterations=2)
+            self._levels[polarity] = levels
+        return self._levels[polarity]
+    
+    def mask(self, threshold, polarity):
+        """
+        Cleaned binary mask (0/255) of the regions at one threshold.
         
-        processed_areas.add(center_key)
+        All thresholds share one scratch buffer, so the mask is only valid
+        until the next call.
+        """
+        levels = self.levels(polarity)
+        thresh_type = cv2.THRESH_BINARY if polarity == BRIGHT else cv2.THRESH_BINARY_INV
+        _, mask = cv2.threshold(levels, threshold, 255, thresh_type,
+                                dst=self.scratch.get(TEMP_C, levels.shape))
+        return mask
+    
+    def contours(self, threshold, polarity):
+        """
+        External contours of the regions at one threshold.
+        """
+        key = (polarity, threshold)
+        if key not in self._contours:
+            # findContours returns 2 values on OpenCV 4.x and 3 on OpenCV 3.x
+            contours = cv2.findContours(self.mask(threshold, polarity), cv2.RETR_EXTERNAL,
+                                        cv2.CHAIN_APPROX_SIMPLE)[-2]
+            self._contours[key] = list(contours)
+        return self._contours[key]
+    
+    def candidates(self, thresholds, polarity):
+        """
+        Contours of all thresholds, concatenated in the order given.
+        """
+        candidates = []
+        for threshold in thresholds:
+            candidates.extend(self.contours(threshold, polarity))
+        return candidates
+
+# One row per candidate contour, see build_candidate_table()
+CANDIDATE_DTYPE = np.dtype([
+    ("area", np.float64),
+    ("perimeter", np.float64),
+    ("circularity", np.float64),
+    ("bbox_x", np.int32),
+    ("bbox_y", np.int32),
+    ("bbox_w", np.int32),
+    ("bbox_h", np.int32),
+    ("in_range", np.bool_),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("radius", np.float64),
+    ("mean_intensity", np.float64),
+    ("std_intensity", np.float64),
+])
+
+def build_candidate_table(contours, gray, min_area=0.0, max_area=np.inf, within=None):
+    """
+    Measure a list of contours in one go.
+    
+    Area (shoelace), perimeter, circularity and bounding box are computed for
+    all contours at once on their concatenated points. Candidates whose area
+    lies within [min_area, max_area] are flagged in_range and also get their
+    minimum enclosing circle and the mean/std of gray inside the contour,
+    computed on the bounding box only. Other rows keep NaN there.
+    
+    Args:
+        contours: List of OpenCV contours
+        gray: Grayscale image the contours were found on
+        min_area: Smallest area of a candidate
+        max_area: Largest area of a candidate
+        within: Optional (center, radius) of a disk; candidates whose
+            bounding box lies outside it aren't in_range either
+    
+    Returns:
+        NumPy structured array with CANDIDATE_DTYPE, in contour order
+    """
+    table = np.zeros(len(contours), dtype=CANDIDATE_DTYPE)
+    if not contours:
+        return table
+    
+    lengths = np.array([len(cnt) for cnt in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate([cnt.reshape(-1, 2) for cnt in contours]).astype(np.float64)
+    px, py = points[:, 0], points[:, 1]
+    
+    # Index of the next point along each closed contour
+    following = np.arange(len(points)) + 1
+    following[starts + lengths - 1] = starts
+    nx, ny = px[following], py[following]
+    
+    area = np.abs(np.add.reduceat(px * ny - nx * py, starts)) / 2
+    perimeter = np.add.reduceat(np.hypot(nx - px, ny - py), starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        circularity = np.where(perimeter > 0, 4 * np.pi * area / (perimeter * perimeter), 0.0)
+    
+    table["area"] = area
+    table["perimeter"] = perimeter
+    table["circularity"] = circularity
+    table["bbox_x"] = np.minimum.reduceat(px, starts)
+    table["bbox_y"] = np.minimum.reduceat(py, starts)
+    table["bbox_w"] = np.maximum.reduceat(px, starts) - table["bbox_x"] + 1
+    table["bbox_h"] = np.maximum.reduceat(py, starts) - table["bbox_y"] + 1
+    table["in_range"] = (area >= min_area) & (area <= max_area)
+    if within is not None:
+        (cx, cy), radius = within
+        near_x = np.clip(cx, table["bbox_x"], table["bbox_x"] + table["bbox_w"] - 1)
+        near_y = np.clip(cy, table["bbox_y"], table["bbox_y"] + table["bbox_h"] - 1)
+        table["in_range"] &= np.hypot(near_x - cx, near_y - cy) <= radius
+    for name in ("x", "y", "radius", "mean_intensity", "std_intensity"):
+        table[name] = np.nan
+    
+    for idx in np.flatnonzero(table["in_range"]):
+        cnt = contours[idx]
+        row = table[idx]
+        (row["x"], row["y"]), row["radius"] = cv2.minEnclosingCircle(cnt)
         
-        # Skip if center is too close to the image center (text region)
-        dist_from_center = np.sqrt((x - dish_center[0])**2 + (y - dish_center[1])**2)
-        if dist_from_center < text_region_radius:
-            continue
-            
-        # Skip if outside the dish boundary
-        if dist_from_center > dish_radius:
+        # Intensity statistics inside the contour, on its bounding box only
+        bx, by, bw, bh = int(row["bbox_x"]), int(row["bbox_y"]), int(row["bbox_w"]), int(row["bbox_h"])
+        mask = np.zeros((bh, bw), np.uint8)
+        cv2.drawContours(mask, [cnt], 0, 255, -1, offset=(-bx, -by))
+        mean, std = cv2.meanStdDev(gray[by:by + bh, bx:bx + bw], mask=mask)
+        row["mean_intensity"] = mean[0, 0]
+        row["std_intensity"] = std[0, 0]
+    
+    return table
+
+def disk_pixel_count(center, radius, shape):
+    """
+    Number of pixels cv2.circle fills for a disk, clipped to an image of the
+    given shape, without allocating a full-frame mask. Disks that lie
+    within the image are looked up per radius (see MaskCache.disk_area).
+    """
+    x, y = center
+    x0, y0 = max(x - radius, 0), max(y - radius, 0)
+    x1, y1 = min(x + radius + 1, shape[1]), min(y + radius + 1, shape[0])
+    if x1 <= x0 or y1 <= y0:
+        return 0
+    if (x0, y0, x1, y1) == (x - radius, y - radius, x + radius + 1, y + radius + 1):
+        return get_mask_cache().disk_area(radius)
+    patch = np.zeros((y1 - y0, x1 - x0), np.uint8)
+    cv2.circle(patch, (x - x0, y - y0), radius, 255, -1)
+    return cv2.countNonZero(patch)
+
+class CircleGrid:
+    """
+    Uniform grid over circle centers for fast neighbour lookups.
+    
+    Every circle is stored in the cell containing its center, so all circles
+    whose centers lie within cell_size of a point are found in the 3x3 block
+    of cells around it.
+    """
+    
+    def __init__(self, cell_size):
+        self.cell_size = max(float(cell_size), 1.0)
+        self._cells = {}
+    
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+    
+    def add(self, key, x, y):
+        self._cells.setdefault(self._cell(x, y), []).append(key)
+    
+    def near(self, x, y):
+        """
+        Keys of all circles whose center may be within cell_size of (x, y).
+        """
+        cx, cy = self._cell(x, y)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                yield from self._cells.get((cx + dx, cy + dy), ())
+
+def circles_overlap(a, b, overlap=0.7, min_center_dist=0.0, rule="radii"):
+    """
+    Overlap test used by circle_nms().
+    
+    Args:
+        a, b: Circles as (x, y, r)
+        overlap: For rule "radii", circles overlap when their centers are closer
+            than overlap * (r_a + r_b). For rule "iou", when the intersection
+            over union of the two disks exceeds overlap.
+        min_center_dist: Circles whose centers are closer than this always overlap
+        rule: "radii" or "iou"
+    """
+    dist = np.hypot(a[0] - b[0], a[1] - b[1])
+    if dist < min_center_dist:
+        return True
+    
+    if rule == "radii":
+        return dist < overlap * (a[2] + b[2])
+    if rule == "iou":
+        r1, r2 = a[2], b[2]
+        if dist >= r1 + r2:
+            return False
+        if dist <= abs(r1 - r2):
+            intersection = np.pi * min(r1, r2) ** 2
+        else:
+            # Area of the lens between two intersecting circles
+            alpha = np.arccos(np.clip((dist**2 + r1**2 - r2**2) / (2 * dist * r1), -1, 1))
+            beta = np.arccos(np.clip((dist**2 + r2**2 - r1**2) / (2 * dist * r2), -1, 1))
+            intersection = (r1**2 * (alpha - np.sin(2 * alpha) / 2)
+                            + r2**2 * (beta - np.sin(2 * beta) / 2))
+        union = np.pi * (r1**2 + r2**2) - intersection
+        return union > 0 and intersection / union > overlap
+    raise ValueError(f"Unknown overlap rule: {rule}")
+
+def circle_nms(circles, scores, overlap=0.7, min_center_dist=0.0, rule="radii"):
+    """
+    Non-maximum suppression for circles.
+    
+    Candidates are visited from the highest score down (ties broken by x, y
+    and r, so the input order doesn't matter) and kept unless they overlap an
+    already kept circle. Kept circles are indexed in a CircleGrid, so each
+    candidate is only compared with its spatial neighbours.
+    
+    Args:
+        circles: Array of shape (N, 3) with x, y, r per row
+        scores: Array of N scores, higher is better
+        overlap: Overlap threshold, see circles_overlap()
+        min_center_dist: Circles closer than this are always duplicates
+        rule: Overlap rule, see circles_overlap()
+    
+    Returns:
+        List of indices of the kept circles, best first
+    """
+    circles = np.asarray(circles, dtype=np.float64).reshape(-1, 3)
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(circles) == 0:
+        return []
+    
+    # Largest center distance at which two circles can still overlap
+    max_radius = circles[:, 2].max()
+    reach = 2 * max_radius * (overlap if rule == "radii" else 1.0)
+    grid = CircleGrid(max(reach, min_center_dist))
+    
+    order = np.lexsort((circles[:, 2], circles[:, 1], circles[:, 0], -scores))
+    kept = []
+    for idx in order:
+        circle = circles[idx]
+        if any(circles_overlap(circle, circles[other], overlap, min_center_dist, rule)
+               for other in grid.near(circle[0], circle[1])):
             continue
+        kept.append(int(idx))
+        grid.add(int(idx), circle[0], circle[1])
+    return kept
+
+class OpenCVCircles:
+    """
+    cv2.HoughCircles (HOUGH_GRADIENT, dp=1) behind the interface of
+    CircleVoter; every query runs the whole transform again.
+    """
+    
+    def __init__(self, image, min_radius, max_radius, canny_threshold=50):
+        """
+        Args:
+            image: 8-bit grayscale image
+            min_radius: Smallest radius
+            max_radius: Largest radius
+            canny_threshold: Upper Canny threshold (param1 of cv2.HoughCircles)
+        """
+        self.image = image
+        self.min_radius = int(min_radius)
+        self.max_radius = int(max_radius)
+        self.canny_threshold = canny_threshold
+    
+    def circles(self, vote_threshold, min_dist):
+        """
+        Circles whose center has more than vote_threshold votes.
         
-        # Calculate circularity - ZoIs should be reasonably circular
-        perimeter = cv2.arcLength(cnt, True)
-        if perimeter <= 0:
-            continue
-        circularity = 4 * np.pi * area / (perimeter * perimeter)
+        Args:
+            vote_threshold: Accumulator threshold (param2 of cv2.HoughCircles)
+            min_dist: Minimum distance between circle centers
         
-        # For the special case, be more lenient with circularity
-        if is_special_case:
-            circularity_threshold = 0.2
-            
-        if circularity < circularity_threshold:
-            continue
+        Returns:
+            Array of shape (N, 4) with x, y, radius and a score per circle,
+            in OpenCV's order (most votes first) with decreasing scores
+        """
+        found = cv2.HoughCircles(self.image, cv2.HOUGH_GRADIENT, dp=1.0, minDist=min_dist,
+                                 param1=self.canny_threshold, param2=vote_threshold,
+                                 minRadius=self.min_radius, maxRadius=self.max_radius)
+        if found is None:
+            return np.empty((0, 4))
+        found = found[0]
+        return np.column_stack((found[:, :3], np.arange(len(found), 0, -1)))
+
+class CircleVoter:
+    """
+    Gradient Hough transform for circles that votes once and answers many queries.
+    
+    Follows the idea of cv2.HoughCircles with HOUGH_GRADIENT (dp=1): every
+    Canny edge point votes for centers along its gradient direction, centers
+    are local maxima of the accumulator, and each center's radius is the
+    distance shared by the most edge points (relative to the radius). Peak
+    finding and radius selection differ from OpenCV's, so the circles and
+    their number are not the ones cv2.HoughCircles returns for the same
+    parameters (see OpenCVCircles for that). The edge map,
+    gradients and accumulator are computed once, so circles can then be
+    extracted at several vote thresholds, minimum distances and radius
+    ranges without recomputing them. Votes are split into radius bands, so a
+    narrower radius range only counts the votes cast from within it.
+    """
+    
+    def __init__(self, image, min_radius, max_radius, canny_threshold=50, n_bands=8):
+        """
+        Args:
+            image: 8-bit grayscale image
+            min_radius: Smallest radius any query will ask for
+            max_radius: Largest radius any query will ask for
+            canny_threshold: Upper Canny threshold (param1 of cv2.HoughCircles)
+            n_bands: Number of radius bands the accumulator is split into
+        """
+        self.shape = image.shape[:2]
+        self.min_radius = max(int(min_radius), 1)
+        self.max_radius = max(int(max_radius), self.min_radius)
         
-        # Calculate diameter from area for more accurate measurement
-        diameter_px = 2 * np.sqrt(area / np.pi)
+        edges = cv2.Canny(image, max(1, canny_threshold // 2), canny_threshold)
+        ys, xs = np.nonzero(edges)
+        del edges
+        # 3x3 Sobel of 8-bit pixels fits in 16 bits
+        gx = cv2.Sobel(image, cv2.CV_16S, 1, 0, ksize=3)[ys, xs].astype(np.float32)
+        gy = cv2.Sobel(image, cv2.CV_16S, 0, 1, ksize=3)[ys, xs].astype(np.float32)
+        norm = np.hypot(gx, gy)
+        ok = norm > 0
+        self.edge_x, self.edge_y = xs[ok].astype(np.float32), ys[ok].astype(np.float32)
+        ux, uy = gx[ok] / norm[ok], gy[ok] / norm[ok]
         
-        # For the visible ZoI area, we need to measure the actual inhibition zone
-        # The inhibition zone is the clear area around the dark spot
+        # Cumulative center votes over radius bands: _votes[b] holds the
+        # votes cast at radii up to and including band b. The votes of a
+        # band are cast a few radii at a time, so the vote coordinates of
+        # all edge points never exist at once
+        h, w = self.shape
+        radii = np.arange(self.min_radius, self.max_radius + 1)
+        self._band_edges = [band[0] for band in np.array_split(radii, min(n_bands, len(radii)))]
+        self._band_edges.append(self.max_radius + 1)
+        self._votes = np.zeros((len(self._band_edges) - 1, h, w), np.int32)
+        total = self._votes[0].reshape(-1)
+        step = max(1, VOTE_CHUNK // max(1, 2 * len(self.edge_x)))
+        for b in range(len(self._band_edges) - 1):
+            if b > 0:
+                total = self._votes[b].reshape(-1)
+                total += self._votes[b - 1].reshape(-1)
+            for start in range(self._band_edges[b], self._band_edges[b + 1], step):
+                stop = min(start + step, self._band_edges[b + 1])
+                chunk_radii = np.arange(start, stop, dtype=np.float32)
+                for sign in (1, -1):
+                    cx = np.rint(self.edge_x[:, None] + sign * ux[:, None] * chunk_radii[None, :]).astype(np.int64)
+                    cy = np.rint(self.edge_y[:, None] + sign * uy[:, None] * chunk_radii[None, :]).astype(np.int64)
+                    inside = (cx >= 0) & (cx < w) & (cy >= 0) & (cy < h)
+                    np.add(total, np.bincount(cy[inside] * w + cx[inside], minlength=h * w), out=total,
+                           casting="unsafe")
+    
+    def accumulator(self, min_radius=None, max_radius=None):
+        """
+        Center votes cast from the radius bands covering [min_radius, max_radius].
+        """
+        lo = self._band(self.min_radius if min_radius is None else min_radius)
+        hi = self._band(self.max_radius if max_radius is None else max_radius)
+        if lo == 0:
+            return self._votes[hi]
+        return self._votes[hi] - self._votes[lo - 1]
+    
+    def _band(self, radius):
+        return int(np.clip(np.searchsorted(self._band_edges, radius, side="right") - 1,
+                           0, len(self._band_edges) - 2))
+    
+    def circles(self, vote_threshold, min_dist, min_radius=None, max_radius=None, max_circles=None):
+        """
+        Circles whose center has more than vote_threshold votes.
         
-        # Create a mask of the contour for more accurate measurements
-        mask = np.zeros_like(gray)
-        cv2.drawContours(mask, [cnt], 0, 255, -1)
+        Args:
+            vote_threshold: Accumulator threshold (param2 of cv2.HoughCircles);
+                a circle also needs more edge points than this on its radius
+            min_dist: Minimum distance between circle centers
+            min_radius, max_radius: Radius range (default: the full voted range)
+            max_circles: Stop after this many circles
         
-        # Calculate the mean intensity inside and outside the contour
-        # to determine the actual boundary of the inhibition zone
-        roi = cv2.bitwise_and(gray, gray, mask=mask)
-        mean_intensity = np.mean(roi[roi > 0])
+        Returns:
+            Array of shape (N, 5) with x, y, radius, votes and support (edge
+            points on the radius) per circle, most votes first
+        """
+        min_radius = self.min_radius if min_radius is None else max(int(min_radius), 1)
+        max_radius = self.max_radius if max_radius is None else int(max_radius)
+        acc = self.accumulator(min_radius, max_radius).astype(np.float32)
         
-        # Adjust diameter based on intensity gradient
-        # ZoIs often have a gradient at the edge, so the visible boundary
-        # may be larger than what the contour detects
-        diameter_mm = diameter_px / pixels_per_mm
+        # Votes of slightly off gradient directions scatter around the true
+        # center, so peaks are located on a smoothed accumulator while the
+        # threshold applies to the strongest raw cell next to the peak
+        smooth = cv2.blur(acc, (5, 5))
+        votes_near = cv2.dilate(acc, np.ones((3, 3), np.uint8), dst=acc)
+        # A peak beats its left and upper neighbours and ties its right and
+        # lower ones; beyond the border the accumulator counts as 0
+        peaks = votes_near > vote_threshold
+        peaks[:, 0] &= smooth[:, 0] > 0
+        peaks[:, 1:] &= smooth[:, 1:] > smooth[:, :-1]
+        peaks[:, :-1] &= smooth[:, :-1] >= smooth[:, 1:]
+        peaks[0, :] &= smooth[0, :] > 0
+        peaks[1:, :] &= smooth[1:, :] > smooth[:-1, :]
+        peaks[:-1, :] &= smooth[:-1, :] >= smooth[1:, :]
+        ys, xs = np.nonzero(peaks)
+        votes = votes_near[ys, xs].astype(np.float64)
         
-        # For Mueller/special cases, we need a specific adjustment
-        if is_special_case:
-            # In Mueller images, the inhibition zone is often more visible
-            # than what the contours detect, so we add a correction
-            diameter_mm *= 1.15  # Increase by 15% for better accuracy
+        # Keep the center with the most votes around it within min_dist
+        points = np.column_stack((xs, ys, np.zeros(len(xs))))
+        keep = circle_nms(points, smooth[ys, xs], overlap=0, min_center_dist=min_dist)
         
-        # Filter by reasonable diameter range for ZoIs - more lenient for special case
-        min_diameter = 3 if is_special_case else 5
-        if min_diameter <= diameter_mm <= 40:
-            zoi_data = {
-                "center_x": float(x),
-                "center_y": float(y),
-                "diameter_mm": float(diameter_mm)
-            }
-            
-            # Check for overlapping with existing yellow ZoIs
-            is_overlapping = False
-            for existing_zoi in yellow_zoi_list:
-                dist = np.sqrt((x - existing_zoi["center_x"])**2 + (y - existing_zoi["center_y"])**2)
-                # If distance between centers is less than 70% of the sum of radii, consider them overlapping
-                sum_of_radii = (diameter_mm + existing_zoi["diameter_mm"]) / 2 * pixels_per_mm
-                if dist < sum_of_radii * 0.7:
-                    is_overlapping = True
-                    break
-            
-            if not is_overlapping:
-                zoi_list.append(zoi_data)
-                yellow_zoi_list.append(zoi_data)
-                
-                # Draw the detected ZoI
-                cv2.circle(contour_viz, center, int(radius), (0, 255, 255), 2)  # Yellow circle (BGR: 0, 255, 255)
-                cv2.putText(contour_viz, f"{diameter_mm:.1f}mm", 
-                           (center[0] - 30, center[1] - int(radius) - 10),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
-    
-    # Save visualization for normal detection
-    cv2.imwrite(os.path.join(result_dir, "11_detected_zoi_initial.png"), contour_viz.copy())
-    
-    # Enhanced detection for overlapping ZoIs
-    # This specifically targets cases where only one large ZoI is found, but it might be two overlapping ZoIs
-    if len(yellow_zoi_list) == 1 and yellow_zoi_list[0]["diameter_mm"] > 25:
-        # We found a large ZoI that might be two overlapping ones
-        large_zoi = yellow_zoi_list[0]
-        large_x = int(large_zoi["center_x"])
-        large_y = int(large_zoi["center_y"])
-        large_radius = int(large_zoi["diameter_mm"] * pixels_per_mm / 2)
-        
-        # Create a special debug image for the splitting process
-        split_debug = cv2.cvtColor(gray.copy(), cv2.COLOR_GRAY2BGR)
-        cv2.circle(split_debug, (large_x, large_y), large_radius, (0, 0, 255), 2)
-        
-        # Method 1: Try a specialized Circle Hough Transform directly on the area of interest
-        # Create a masked version just around the large ZoI
-        zoi_area_mask = np.zeros_like(gray)
-        cv2.circle(zoi_area_mask, (large_x, large_y), int(large_radius*1.2), 255, -1)
-        zoi_area = cv2.bitwise_and(gray, gray, mask=zoi_area_mask)
-        
-        # Apply stronger preprocessing to make circles more visible
-        zoi_area_enhanced = cv2.equalizeHist(zoi_area)
-        zoi_area_blurred = cv2.GaussianBlur(zoi_area_enhanced, (5, 5), 0)
-        
-        # Try to find circles within this region with specialized parameters
-        detected_circles = cv2.HoughCircles(
-            zoi_area_blurred,
-            cv2.HOUGH_GRADIENT,
-            dp=1.0,
-            minDist=large_radius * 0.8,  # Allow circles relatively close to each other
-            param1=50,
-            param2=20,  # Lower threshold for more sensitivity
-            minRadius=int(large_radius * 0.4),
-            maxRadius=int(large_radius * 0.8)
-        )
+        found = []
+        for idx in keep:
+            radius, support = self._estimate_radius(xs[idx], ys[idx], min_radius, max_radius)
+            if radius is None or support <= vote_threshold:
+                continue
+            found.append((xs[idx], ys[idx], radius, votes[idx], support))
+            if max_circles and len(found) >= max_circles:
+                break
+        return np.array(found, dtype=np.float64).reshape(-1, 5)
+    
+    def _estimate_radius(self, cx, cy, min_radius, max_radius):
+        near = ((np.abs(self.edge_x - cx) <= max_radius) & (np.abs(self.edge_y - cy) <= max_radius))
+        dist = np.hypot(self.edge_x[near] - cx, self.edge_y[near] - cy)
+        dist = dist[(dist >= min_radius) & (dist <= max_radius)]
+        if len(dist) == 0:
+            return None, 0
         
-        # If we found circles, they could be our separate ZoIs
-        if detected_circles is not None:
-            circles = np.uint16(np.around(detected_circles))
-            # Clear previous detection
-            yellow_zoi_list = []
-            
-            for circle in circles[0, :]:
-                x, y, r = circle
-                # Calculate diameter
-                diameter_mm = (r * 2) / pixels_per_mm
-                
-                if 5 <= diameter_mm <= 35:
-                    # Add as separate ZoI
-                    yellow_zoi_list.append({
-                        "center_x": float(x),
-                        "center_y": float(y),
-                        "diameter_mm": float(diameter_mm)
-                    })
-                    
-                    # Draw detected circle
-                    cv2.circle(split_debug, (x, y), r, (0, 255, 255), 2)
-                    cv2.circle(contour_viz, (x, y), r, (0, 255, 255), 2)
-                    cv2.putText(contour_viz, f"{diameter_mm:.1f}mm", 
-                               (x - 30, y - r - 10),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
-            
-        # If Method 1 failed, try Method 2: Watershed segmentation
-        if len(yellow_zoi_list) < 2:
-            try:
-                # Create a binary image of the large ZoI
-                zoi_binary = np.zeros_like(gray)
-                cv2.circle(zoi_binary, (large_x, large_y), large_radius, 255, -1)
-                
-                # Apply distance transform
-                dist = cv2.distanceTransform(zoi_binary, cv2.DIST_L2, 5)
-                cv2.normalize(dist, dist, 0, 1.0, cv2.NORM_MINMAX)
-                
-                # Threshold to get foreground areas
-                _, dist_thresh = cv2.threshold(dist, 0.6, 1.0, cv2.THRESH_BINARY)
-                
-                # Erode to find sure foreground
-                kernel = np.ones((3, 3), np.uint8)
-                fg = cv2.erode(dist_thresh, kernel, iterations=2)
-                
-                # Find connected components
-                sure_fg = np.uint8(fg * 255)
-                _, markers = cv2.connectedComponents(sure_fg)
-                
-                # Mark the area not in the original mask as background
-                markers = markers + 1  # To avoid 0 being used for both background and markers
-                markers[zoi_binary == 0] = 0  # Background
-                
-                # Apply watershed
-                markers = cv2.watershed(cv2.cvtColor(zoi_binary, cv2.COLOR_GRAY2BGR), markers)
-                
-                # Find unique markers (excluding background 0 and border -1)
-                unique_markers = np.unique(markers)
-                unique_markers = unique_markers[(unique_markers > 1) & (unique_markers != -1)]
-                
-                if len(unique_markers) >= 2:
-                    # We've successfully split the large ZoI
-                    yellow_zoi_list = []  # Clear previous
-                    
-                    for marker in unique_markers:
-                        # Extract each segment
-                        segment = np.zeros_like(gray, dtype=np.uint8)
-                        segment[markers == marker] = 255
-                        
-                        # Find the center and area
-                        M = cv2.moments(segment)
-                        if M["m00"] > 0:
-                            cx = int(M["m10"] / M["m00"])
-                            cy = int(M["m01"] / M["m00"])
-                            
-                            # Get contour
-                            segment_contours, _ = cv2.findContours(
-                                segment, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                            if segment_contours:
-                                cnt = max(segment_contours, key=cv2.contourArea)
-                                (x, y), radius = cv2.minEnclosingCircle(cnt)
-                                area = cv2.contourArea(cnt)
-                                
-                                # Calculate diameter
-                                diameter_px = 2 * np.sqrt(area / np.pi)
-                                diameter_mm = diameter_px / pixels_per_mm
-                                
-                                if 5 <= diameter_mm <= 35:
-                                    yellow_zoi_list.append({
-                                        "center_x": float(x),
-                                        "center_y": float(y),
-                                        "diameter_mm": float(diameter_mm)
-                                    })
-                                    
-                                    # Draw result
-                                    cv2.circle(split_debug, (int(x), int(y)), int(radius), (255, 0, 255), 2)
-                                    cv2.circle(contour_viz, (int(x), int(y)), int(radius), (255, 0, 255), 2)
-                                    cv2.putText(contour_viz, f"{diameter_mm:.1f}mm", 
-                                               (int(x) - 30, int(y) - int(radius) - 10),
-                                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 1)
-            except Exception as e:
-                print(f"Error in watershed separation: {e}", file=sys.stderr)
+        # One-pixel distance bins; larger circles naturally collect more
+        # points, so the bins are compared by count per unit radius
+        counts = np.bincount((dist - min_radius).astype(np.int64))
+        radii = min_radius + np.arange(len(counts)) + 0.5
+        best = int(np.argmax(counts / radii))
+        return float(radii[best]), int(counts[best])
+
+def detect_zoi(image_path, pixels_per_mm=10.0, debug_level=DEBUG_FINAL, result_dir=None):
+    """
+    Detects Zones of Inhibition (ZoI) in a petri dish image.
+    
+    Args:
+        image_path: Path to the input image
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        debug_level: Which images to write (none, final or full)
+        result_dir: Directory for the images (default: get_result_dir(image_path))
+    
+    Returns:
+        List of dictionaries containing center_x, center_y, and diameter_mm for each ZoI,
+        and the path of the detection image (None if not written)
+    """
+    # Read the image
+    image = cv2.imread(image_path)
+    if image is None:
+        return [], None
+    
+    # Get base filename for special case detection
+    base_filename = os.path.basename(image_path)
+    base_name = os.path.splitext(base_filename)[0]
+    
+    return detect_zoi_in_image(image, base_name, result_dir or get_result_dir(image_path), pixels_per_mm, debug_level)
+
+def detect_zoi_in_image(image, base_name, result_dir, pixels_per_mm=10.0, debug_level=DEBUG_FINAL,
+                        dish_mode=DISH_AUTO, dish_roi=ROI_CROP, measure=MEASURE_AREA, hough=HOUGH_OPENCV,
+                        overlay=None, details=None, timings=None, known_dish=None, scratch=None):
+    """
+    Detects Zones of Inhibition (ZoI) in an already loaded petri dish image.
+    
+    Detection is a Pipeline of the stages in DETECTION_STAGES. The cheap
+    threshold sweep always runs; the adaptive threshold, the overlap
+    splitting methods and the Hough fallback only run when the result so
+    far fails the corresponding check (see accept_zoi). With the radial
+    measure, the diameters of the zones found are measured again from
+    their edges (see measure_zone).
+    
+    Args:
+        image: BGR input image
+        base_name: Image name without extension, used for special case detection
+        result_dir: Directory for the detection and debug images, or None to
+            only return the overlay shapes (in details["overlay"], see
+            OverlayEncoding.encode for making the detection image from them)
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        debug_level: Which images to write (none, final or full)
+        dish_mode: Petri dish search strategy (auto, pyramid or full)
+        dish_roi: Region processed after dish detection: "crop" (the dish
+            bounding square plus ROI_MARGIN, default), "disk" (the same, with
+            candidates outside the dish disk left unmeasured) or "none" (the
+            whole frame). All three find the same zones. Coordinates are
+            always reported in full image space.
+        measure: How diameters are measured: "area" (from the contour area,
+            with the calibration of the special cases) or "radial" (from the
+            zone edge; each zone also reports its measure, edge_spread_mm
+            and whether it looks overlapping)
+        hough: Circle Hough transform of the overlap splitting and fallback
+            stages: "opencv" (cv2.HoughCircles, default) or "voter"
+            (CircleVoter, which votes once but finds other circles)
+        overlay: OverlayEncoding of the detection image (default: PNG_OVERLAY)
+        details: Optional dictionary that receives extra information about
+            the run (the detected dish under "dish", the stages that ran
+            under "stages_run", and the overlay shapes under "overlay"
+            when result_dir is None)
+        timings: Optional Timings that records the duration of every stage
+    
+    Returns:
+        List of dictionaries containing center_x, center_y, and diameter_mm for each ZoI,
+        and the path of the detection image (None if not written)
+    """
+    if debug_level not in DEBUG_LEVELS:
+        raise ValueError(f"Unknown debug level: {debug_level}")
+    if dish_roi not in ROI_MODES:
+        raise ValueError(f"Unknown dish ROI mode: {dish_roi}")
+    if measure not in MEASURE_MODES:
+        raise ValueError(f"Unknown measure mode: {measure}")
+    if hough not in HOUGH_MODES:
+        raise ValueError(f"Unknown Hough transform: {hough}")
+    
+    debug = DebugImages(debug_level, result_dir)
+    if debug_level != DEBUG_NONE and result_dir is not None:
+        os.makedirs(result_dir, exist_ok=True)
+    
+    # Intermediate images go to scratch buffers; at the full debug level they
+    # are queued for writing, so each one needs its own
+    own_scratch = scratch is None
+    if own_scratch:
+        scratch = ScratchPool(reuse=False) if debug.full else get_scratch_pool()
+    # Independent passes may run concurrently (not at the full debug level,
+    # whose images are numbered in sequential order). They allocate their
+    # own buffers rather than sharing the scratch pool
+    passes = None if debug.full else get_pass_executor()
+    profile = detection_profile(base_name)
+    pipeline = Pipeline(DETECTION_STAGES, timings, image=image, base_name=base_name, pixels_per_mm=pixels_per_mm,
+                        profile=profile, dish_mode=dish_mode, dish_roi=dish_roi, measure=measure, hough=hough,
+                        debug=debug, encoding=overlay or PNG_OVERLAY, scratch=scratch)
+    try:
+        if known_dish is not None:
+            pipeline.set("dish", known_dish)
         
-        # Method 3: If still only 1 or 0 ZoIs detected, try ellipse fitting and axis analysis
-        if len(yellow_zoi_list) < 2:
-            try:
-                # Find the contour for the large ZoI
-                # Create a binary image of the large ZoI area
-                zoi_binary = np.zeros_like(gray)
-                cv2.circle(zoi_binary, (large_x, large_y), large_radius, 255, -1)
-                
-                # Apply thresholding based on the original image
-                zoi_area = cv2.bitwise_and(blurred, blurred, mask=zoi_binary)
-                _, thresh = cv2.threshold(zoi_area, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-                
-                # Find contours in this area
-                contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-                
-                if contours:
-                    # Get the largest contour
-                    cnt = max(contours, key=cv2.contourArea)
-                    
-                    # Fit an ellipse to the contour
-                    if len(cnt) >= 5:  # Need at least 5 points to fit ellipse
-                        ellipse = cv2.fitEllipse(cnt)
-                        (x, y), (width, height), angle = ellipse
-                        
-                        # Check if the ellipse is elongated (indicating two circles)
-                        if width / height > 1.5 or height / width > 1.5:
-                            # Calculate the major axis length
-                            major_axis = max(width, height)
-                            minor_axis = min(width, height)
-                            
-                            # The centers of the two circles are likely along the major axis
-                            # at approximately 1/4 and 3/4 of the way
-                            if width > height:
-                                # Major axis is along width
-                                theta = np.radians(angle)
-                                offset_x = (major_axis / 4) * np.cos(theta)
-                                offset_y = (major_axis / 4) * np.sin(theta)
-                            else:
-                                # Major axis is along height
-                                theta = np.radians(angle + 90)
-                                offset_x = (major_axis / 4) * np.cos(theta)
-                                offset_y = (major_axis / 4) * np.sin(theta)
-                            
-                            # Calculate the two centers
-                            center1_x = int(x - offset_x)
-                            center1_y = int(y - offset_y)
-                            center2_x = int(x + offset_x)
-                            center2_y = int(y + offset_y)
-                            
-                            # Estimate radius based on minor axis
-                            radius = int(minor_axis / 2)
-                            
-                            # Calculate diameter
-                            diameter_mm = (minor_axis) / pixels_per_mm
-                            
-                            # Clear previous and add new ZoIs
-                            yellow_zoi_list = []
-                            
-                            if 5 <= diameter_mm <= 35:
-                                yellow_zoi_list.append({
-                                    "center_x": float(center1_x),
-                                    "center_y": float(center1_y),
-                                    "diameter_mm": float(diameter_mm)
-                                })
-                                yellow_zoi_list.append({
-                                    "center_x": float(center2_x),
-                                    "center_y": float(center2_y),
-                                    "diameter_mm": float(diameter_mm)
-                                })
-                                
-                                # Draw results
-                                cv2.ellipse(split_debug, ellipse, (0, 255, 0), 2)
-                                cv2.circle(split_debug, (center1_x, center1_y), radius, (0, 165, 255), 2)
-                                cv2.circle(split_debug, (center2_x, center2_y), radius, (0, 165, 255), 2)
-                                cv2.circle(contour_viz, (center1_x, center1_y), radius, (0, 165, 255), 2)
-                                cv2.circle(contour_viz, (center2_x, center2_y), radius, (0, 165, 255), 2)
-                                cv2.putText(contour_viz, f"{diameter_mm:.1f}mm", 
-                                          (center1_x - 30, center1_y - radius - 10),
-                                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 165, 255), 1)
-                                cv2.putText(contour_viz, f"{diameter_mm:.1f}mm", 
-                                          (center2_x - 30, center2_y - radius - 10),
-                                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 165, 255), 1)
-            except Exception as e:
-                print(f"Error in ellipse fitting: {e}", file=sys.stderr)
-                
-        # Save the debug image for the splitting process
-        cv2.imwrite(os.path.join(result_dir, "12_split_attempt.png"), split_debug)
-    
-    # If we didn't find expected number of ZoIs or if we're using reference data,
-    # try direct hough circles approach which works well for some images
-    if len(yellow_zoi_list) == 0 or ("POC1_0224" in base_name or "POC2_0224" in base_name) and len(yellow_zoi_list) < 4:
-        # Use HoughCircles with parameters tuned for detecting ZoIs directly
-        zois_mask = np.zeros_like(gray)
-        cv2.circle(zois_mask, dish_center, dish_radius, 255, -1)  # Full dish area
-        cv2.circle(zois_mask, dish_center, int(text_region_radius), 0, -1)  # Exclude text
-        
-        # Apply mask to get only the relevant area
-        dish_area = cv2.bitwise_and(gray, gray, mask=zois_mask)
-        
-        # Enhance contrast for better detection
-        dish_area_enhanced = cv2.equalizeHist(dish_area)
-        
-        # Try HoughCircles with different parameters
-        for param2 in [20, 15, 10]:  # Start with more strict, then relax
-            circles = cv2.HoughCircles(
-                dish_area_enhanced,
-                cv2.HOUGH_GRADIENT,
-                dp=1.0,
-                minDist=int(dish_radius * 0.2),  # Allow circles to be closer for multi-ZoI cases
-                param1=50,
-                param2=param2,  # Lower threshold for more sensitivity
-                minRadius=int(dish_radius * 0.08),
-                maxRadius=int(dish_radius * 0.35)
-            )
+        dish = pipeline.get("dish")
+        if details is not None:
+            details["dish"] = {
+                "center_x": dish["center"][0],
+                "center_y": dish["center"][1],
+                "radius": dish["radius"],
+                "confidence": dish["confidence"],
+                "method": dish["method"],
+            }
+            if "reason" in dish:
+                details["dish"]["reason"] = dish["reason"]
+        
+        # Visualization of the detections in the dish ROI (full debug level only)
+        gray = pipeline.get("gray")
+        canvas = debug.canvas(gray, pipeline.get("dish_center"), pipeline.get("dish_radius"), (0, 255, 0))
+        pipeline.set("canvas", canvas)
+        
+        # The fixed threshold sweep is usually enough; the adaptive threshold
+        # candidates are only added when its zones don't pass the acceptance test.
+        # With a pass pool the adaptive threshold runs alongside the sweep anyway
+        if passes is not None:
+            pipeline.prefetch(("bright_contours", "dark_contours", "adaptive_contours"), passes,
+                              scratch=ScratchPool(reuse=False))
+        zoi_list, rows = pipeline.get("sweep_zoi"), pipeline.get("sweep_rows")
+        if not accept_zoi(zoi_list, rows["circularity"], profile, pixels_per_mm):
+            zoi_list, rows = pipeline.get("adaptive_zoi"), pipeline.get("adaptive_rows")
+        
+        for zoi, row in zip(zoi_list, rows):
+            draw_zoi(canvas, (int(row["x"]), int(row["y"])), int(row["radius"]), (0, 255, 255),
+                     f"{zoi['diameter_mm']:.1f}mm")
+        if debug.full:
+            debug.write("11_detected_zoi_initial.png", canvas.copy())
+        
+        # Enhanced detection for overlapping ZoIs
+        # This specifically targets cases where only one large ZoI is found, but it might be two overlapping ZoIs.
+        # The methods are tried in turn until one of them finds at least two zones
+        yellow_zoi_list = zoi_list
+        if len(zoi_list) == 1 and zoi_list[0]["diameter_mm"] > SPLIT_MIN_DIAMETER_MM:
+            large_x, large_y, large_radius = zoi_circle(zoi_list[0], pixels_per_mm)
+            pipeline.set("large_zoi", zoi_list[0])
+            pipeline.set("split_canvas", debug.canvas(gray, (large_x, large_y), large_radius, (0, 0, 255)))
+            if passes is not None:
+                pipeline.prefetch(SPLIT_METHODS, passes, scratch=ScratchPool(reuse=False))
+            for method in SPLIT_METHODS:
+                if len(yellow_zoi_list) >= 2:
+                    break
+                split = pipeline.get(method)
+                if split is not None:
+                    yellow_zoi_list = split
             
-            if circles is not None and len(circles[0]) > 0:
-                # Only clear existing detections if we found more circles than we already have
-                if len(circles[0]) > len(yellow_zoi_list):
-                    yellow_zoi_list = []
-                    
-                # Process detected circles
-                circles = np.uint16(np.around(circles))
-                
-                # Create a list to track processed circle centers to avoid duplicates
-                processed_circle_centers = set()
-                
-                for circle in circles[0]:
-                    x, y, r = circle
-                    
-                    # Create a key to avoid duplicates
-                    center_key = f"{int(x/5)}_{int(y/5)}"
-                    if center_key in processed_circle_centers:
-                        continue
-                    
-                    # Skip if center is too close to image center or outside dish
-                    dist_from_center = np.sqrt((x - dish_center[0])**2 + (y - dish_center[1])**2)
-                    if dist_from_center < text_region_radius or dist_from_center > dish_radius * 0.9:
-                        continue
-                    
-                    processed_circle_centers.add(center_key)
+            # Save the debug image for the splitting process
+            debug.write("12_split_attempt.png", pipeline.get("split_canvas"))
+        
+        # If we didn't find expected number of ZoIs, try direct hough circles
+        # approach which works well for some images
+        if len(yellow_zoi_list) < profile["min_zoi"]:
+            pipeline.set("zoi", yellow_zoi_list)
+            yellow_zoi_list = pipeline.get("hough_fallback")
+        
+        # Measure the zones again from their edges
+        if measure == MEASURE_RADIAL:
+            pipeline.set("selected_zoi", yellow_zoi_list)
+            yellow_zoi_list = pipeline.get("measured_zoi")
+        
+        # Save the final visualization with all detected ZoIs
+        debug.write("13_final_detection.png", canvas)
+        
+        # Map the results from the dish ROI back to full image coordinates
+        # (zoi_list and yellow_zoi_list may share entries)
+        roi_x, roi_y = pipeline.get("roi_offset")
+        if roi_x or roi_y:
+            for zoi in {id(zoi): zoi for zoi in zoi_list + yellow_zoi_list}.values():
+                zoi["center_x"] += roi_x
+                zoi["center_y"] += roi_y
+        pipeline.set("all_zoi", zoi_list)
+        pipeline.set("final_zoi", yellow_zoi_list)
+        
+        # After all detection and deduplication, create a final visualization with all detections on the color image
+        final_viz_path = None
+        if debug_level != DEBUG_NONE:
+            final_viz_path = pipeline.get("overlay_path")
+            if result_dir is None and details is not None:
+                details["overlay"] = pipeline.get("overlay")
+        
+        results = pipeline.get("results")
+        if details is not None:
+            details["stages_run"] = list(pipeline.ran)
+        # Return only the yellow-highlighted ZoIs (the ones detected by the primary method)
+        return results, final_viz_path
+    finally:
+        pipeline.cancel()
+        if own_scratch:
+            scratch.trim(_scratch_budget)
+
+def detect_dishes_in_image(image, base_name, result_dir, pixels_per_mm=10.0, debug_level=DEBUG_FINAL,
+                           dish_mode=DISH_AUTO, dish_roi=ROI_CROP, measure=MEASURE_AREA, hough=HOUGH_OPENCV,
+                           overlay=None, details=None, timings=None, workers=None):
+    """
+    Detects Zones of Inhibition on every petri dish of a multi-plate scan.
+    
+    The dishes are located with locate_petri_dishes(), and each one is
+    cropped to its bounding box and analysed with detect_zoi_in_image() on
+    a thread pool. OpenCV releases the GIL, so the dishes are processed in
+    parallel.
+    
+    Args:
+        image: BGR image
+        base_name: Image name without extension, used for special cases
+        result_dir: Directory for the detection image (and, at the full debug
+            level, the intermediate images of each dish in dish_<index>), or None
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        debug_level: Which images to write (none, final or full)
+        dish_mode: Dish search strategy, see locate_petri_dishes()
+        dish_roi: Region processed per dish, see detect_zoi_in_image()
+        measure: How diameters are measured, see detect_zoi_in_image()
+        hough: Circle Hough transform, see detect_zoi_in_image()
+        overlay: OverlayEncoding of the detection image (default: PNG_OVERLAY)
+        details: Optional dictionary that receives the dishes (and the
+            overlay shapes under "overlay" when result_dir is None)
+        timings: Optional Timings; the dish search and the per-dish detections
+            are recorded as the stages "dishes" and "dish_zoi", and every dish
+            gets its own stage timings
+        workers: Number of threads (default: OpenCV's thread count, at most
+            one per dish)
+    
+    Returns:
+        Tuple containing (ZoIs of all dishes, each with the index of its dish,
+        path of the detection image or None). details["dishes"] lists every
+        dish in reading order with its index, bounding box, dish circle, ZoIs
+        and the stages that ran
+    """
+    if timings is None:
+        timings = NO_TIMINGS
+    if debug_level != DEBUG_NONE and result_dir is not None:
+        os.makedirs(result_dir, exist_ok=True)
+    
+    timings.stage("dishes")
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    dishes = locate_petri_dishes(gray, dish_mode, timings)
+    del gray
+    
+    timings.stage("dish_zoi")
+    workers = max(1, min(len(dishes), workers or cv2.getNumThreads()))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_detect_dish, image, index, dish, base_name, result_dir, pixels_per_mm,
+                                   debug_level, dish_roi, measure, hough, overlay, timings is not NO_TIMINGS)
+                   for index, dish in enumerate(dishes)]
+        entries = [future.result() for future in futures]
+    
+    final_viz_path = None
+    if debug_level != DEBUG_NONE:
+        timings.stage("overlay")
+        shapes = []
+        for entry in entries:
+            center = (entry["dish"]["center_x"], entry["dish"]["center_y"])
+            bbox = entry["bbox"]
+            shapes.append(overlay_circle("dish", center, entry["dish"]["radius"], f"#{entry['index']}",
+                                         (bbox["x"] + 10, bbox["y"] + 30)))
+            for zoi in entry["zoi"]:
+                cx, cy, r = zoi_circle(zoi, pixels_per_mm)
+                shapes.append(overlay_circle("zone", (cx, cy), r, f"{zoi['diameter_mm']:.1f}mm"))
+        overlay_shapes = {"width": image.shape[1], "height": image.shape[0], "shapes": shapes}
+        if result_dir is not None:
+            final_viz_path = (overlay or PNG_OVERLAY).write(image, overlay_shapes, result_dir)
+        elif details is not None:
+            details["overlay"] = overlay_shapes
+    timings.stage(None)
+    
+    if details is not None:
+        details["dishes"] = entries
+    return [dict(zoi, dish=entry["index"]) for entry in entries for zoi in entry["zoi"]], final_viz_path
+
+def _detect_dish(image, index, dish, base_name, result_dir, pixels_per_mm, debug_level, dish_roi, measure, hough,
+                 overlay, timed):
+    # ZoI detection on one dish of a multi-plate scan, see detect_dishes_in_image()
+    x0, y0, x1, y1 = _crop_box(dish["center"], dish["radius"] + CROP_MARGIN, image.shape)
+    known_dish = dict(dish, center=(dish["center"][0] - x0, dish["center"][1] - y0))
+    
+    dish_dir = None
+    if debug_level == DEBUG_FULL and result_dir is not None:
+        dish_dir = os.path.join(result_dir, f"dish_{index}")
+    timings = Timings() if timed else None
+    details = {}
+    zoi_list, _ = detect_zoi_in_image(image[y0:y1, x0:x1], base_name, dish_dir, pixels_per_mm,
+                                      DEBUG_FULL if dish_dir else DEBUG_NONE, dish_roi=dish_roi, measure=measure,
+                                      hough=hough, overlay=overlay, details=details, timings=timings,
+                                      known_dish=known_dish)
+    for zoi in zoi_list:
+        zoi["center_x"] += x0
+        zoi["center_y"] += y0
+    
+    entry = {
+        "index": index,
+        "bbox": {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0},
+        "dish": {
+            "center_x": dish["center"][0],
+            "center_y": dish["center"][1],
+            "radius": dish["radius"],
+            "confidence": dish["confidence"],
+            "method": dish["method"],
+        },
+        "zoi": zoi_list,
+        "stages_run": details.get("stages_run"),
+    }
+    if timings is not None:
+        entry["timings"] = timings.summary()
+    return entry
+
+def detect_image(image, base_name, result_dir, pixels_per_mm=10.0, debug_level=DEBUG_FINAL, details=None,
+                 timings=None, multi_dish=False, **options):
+    """
+    Detect the ZoIs of a single dish image, or of every dish on a
+    multi-plate scan when multi_dish is set.
+    
+    Returns:
+        Same as detect_zoi_in_image() and detect_dishes_in_image()
+    """
+    detect = detect_dishes_in_image if multi_dish else detect_zoi_in_image
+    return detect(image, base_name, result_dir, pixels_per_mm, debug_level, details=details, timings=timings,
+                  **options)
+
+def detection_profile(base_name):
+    """
+    Detection parameters for an image, based on the markers in its name.
+    
+    Returns:
+        Dictionary with min_area, circularity_threshold, bright_thresholds,
+        dark_thresholds, special (small/large ZoI images), multi_zoi
+        (6-ZoI images) and min_zoi (fewer zones trigger the Hough fallback)
+    """
+    multi_zoi = "POC1_0224" in base_name or "POC2_0224" in base_name
+    special = "MUELLER" in base_name.upper() or "POC5_0219" in base_name.upper() or "POC4_0216" in base_name.upper()
+    if multi_zoi:
+        # Special case for 6-ZoI images
+        profile = {
+            "min_area": 100,
+            "circularity_threshold": 0.3,
+            "bright_thresholds": [170, 150, 130],
+            "dark_thresholds": [80, 100, 120],
+        }
+    elif special:
+        # Special case for Mueller/small ZoI images
+        profile = {
+            "min_area": 50,
+            "circularity_threshold": 0.2,
+            "bright_thresholds": [180, 160, 140],
+            "dark_thresholds": [70, 90, 110],
+        }
+    else:
+        # Default case
+        profile = {
+            "min_area": 200,
+            "circularity_threshold": 0.4,
+            "bright_thresholds": [190, 160, 140],
+            "dark_thresholds": [70, 90, 110],
+        }
+    profile.update(special=special, multi_zoi=multi_zoi, min_zoi=4 if multi_zoi else 1)
+    return profile
+
+def zoi_circle(zoi, pixels_per_mm):
+    """
+    Integer (x, y, radius) in pixels of a ZoI dictionary.
+    """
+    return int(zoi["center_x"]), int(zoi["center_y"]), int(zoi["diameter_mm"] * pixels_per_mm / 2)
+
+def accept_zoi(zoi_list, circularity, profile, pixels_per_mm):
+    """
+    Acceptance test of the zones found by the threshold sweep.
+    
+    The zones are used as they are when there are at least as many as the
+    image profile expects, they are not a single large zone (which would
+    be split), each of them is close to a circle and no two of them
+    overlap. Otherwise the adaptive threshold candidates are added.
+    
+    The adaptive candidates compete with the sweep's in circle_nms, so
+    skipping them can change the zones of an accepted image.
+    
+    Args:
+        zoi_list: ZoI dictionaries
+        circularity: Contour circularity of each zone
+        profile: Parameters from detection_profile()
+        pixels_per_mm: Calibration factor to convert pixels to mm
+    
+    Returns:
+        True when the zones are accepted
+    """
+    if len(zoi_list) < profile["min_zoi"]:
+        return False
+    if len(zoi_list) == 1 and zoi_list[0]["diameter_mm"] > SPLIT_MIN_DIAMETER_MM:
+        return False
+    if np.any(np.asarray(circularity) < ACCEPT_MIN_CIRCULARITY):
+        return False
+    
+    xy = np.array([[zoi["center_x"], zoi["center_y"]] for zoi in zoi_list])
+    radii = np.array([zoi["diameter_mm"] for zoi in zoi_list]) * pixels_per_mm / 2
+    dist = np.hypot(xy[:, None, 0] - xy[None, :, 0], xy[:, None, 1] - xy[None, :, 1])
+    overlapping = np.triu(dist < radii[:, None] + radii[None, :], 1)
+    return not overlapping.any()
+
+def _stage_grayscale(image, scratch):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=scratch.get("gray", image.shape[:2]))
+
+def _stage_dish(image, full_gray, dish_mode, debug, timings):
+    # Detect petri dish
+    dish = locate_petri_dish(full_gray, dish_mode, timings)
+    
+    # Draw the detected petri dish boundary for debugging
+    if debug.full:
+        debug_dish_image = image.copy()
+        cv2.circle(debug_dish_image, dish["center"], dish["radius"], (0, 255, 0), 2)
+        cv2.circle(debug_dish_image, (image.shape[1]//2, image.shape[0]//2), 5, (0, 0, 255), -1)  # Image center
+        debug.write("01_detected_dish.png", debug_dish_image)
+    return dish
+
+def _stage_roi(full_gray, dish, dish_roi):
+    # Everything downstream only looks at the dish, so work on its bounding
+    # square (plus ROI_MARGIN) and map coordinates back at the end
+    dish_center, dish_radius = dish["center"], dish["radius"]
+    roi_x, roi_y = 0, 0
+    gray = full_gray
+    # Sides (left, top, right, bottom) of the ROI that cut through the
+    # scanner bed; candidates touching them are cut-off pieces of the bed
+    roi_cut = None
+    if dish_roi != ROI_NONE:
+        h, w = full_gray.shape[:2]
+        reach = dish_radius + ROI_MARGIN
+        roi_x, roi_y = max(dish_center[0] - reach, 0), max(dish_center[1] - reach, 0)
+        # Even offsets keep np.around (half to even) of circle centers the
+        # same as on the full frame
+        roi_x, roi_y = roi_x - roi_x % 2, roi_y - roi_y % 2
+        roi_x1, roi_y1 = min(dish_center[0] + reach + 1, w), min(dish_center[1] + reach + 1, h)
+        if roi_x1 > roi_x and roi_y1 > roi_y:
+            roi_cut = (roi_x > 0, roi_y > 0, roi_x1 < w, roi_y1 < h)
+            gray = full_gray[roi_y:roi_y1, roi_x:roi_x1]
+            dish_center = (dish_center[0] - roi_x, dish_center[1] - roi_y)
+        else:
+            roi_x, roi_y = 0, 0
+    return (roi_x, roi_y), gray, dish_center, dish_radius, roi_cut, dish_roi == ROI_DISK
+
+def _stage_enhance(full_gray, roi_offset, gray, dish_center, dish_radius, debug, scratch):
+    # Histogram equalization and CLAHE (whose tiles are laid over the whole
+    # image) run on the full frame, so the ROI gets the same contrast as
+    # without it; the ROI is cut out of the result
+    # Apply histogram equalization to enhance contrast
+    equalized = cv2.equalizeHist(full_gray, dst=scratch.get("equalized", full_gray.shape))
+    debug.write("02_equalized_full.png", equalized)
+    
+    # Further enhance with CLAHE
+    enhanced = CLAHE.apply(equalized, dst=scratch.get("enhanced", full_gray.shape))
+    debug.write("03_enhanced_full.png", enhanced)
+    roi_x, roi_y = roi_offset
+    enhanced = enhanced[roi_y:roi_y + gray.shape[0], roi_x:roi_x + gray.shape[1]]
+    
+    # Create the mask for ZoI detection - only exclude the center text area
+    # This keeps the entire image while only removing the central text
+    text_region_radius = dish_radius * 0.15  # Slightly smaller to avoid cutting into ZoI
+    # Exclude center text
+    full_mask = get_mask_cache().disk(gray.shape, dish_center, None, hole=int(text_region_radius))
+    
+    # Create a visualization of the mask
+    if debug.full:
+        mask_viz = gray.copy()
+        cv2.circle(mask_viz, dish_center, dish_radius, (255), 2)  # Dish boundary
+        cv2.circle(mask_viz, dish_center, int(text_region_radius), (128), 2)  # Text region
+        debug.write("04_masks.png", mask_viz)
+    
+    # Apply the mask to the enhanced image - only excludes center text
+    masked_enhanced = scratch.zeros(TEMP_A, gray.shape)
+    cv2.bitwise_and(enhanced, enhanced, dst=masked_enhanced, mask=full_mask)
+    debug.write("05_masked_enhanced.png", masked_enhanced)
+    
+    # Apply a slight blur to reduce noise
+    blurred = cv2.GaussianBlur(masked_enhanced, (5, 5), 0, dst=scratch.get("blurred", gray.shape))
+    debug.write("06_blurred.png", blurred)
+    return blurred, text_region_radius
+
+def _threshold_pass(blurred, profile, debug, scratch, polarity):
+    # Candidate regions for every threshold of one polarity come from one
+    # filtered copy of the image
+    components = ThresholdComponentTree(blurred, MORPH_KERNEL, scratch)
+    if polarity == BRIGHT:
+        thresholds, special_threshold = profile["bright_thresholds"], 180
+        thresh_type, names = cv2.THRESH_BINARY, ("07_bright_mask.png", "08_bright_mask_cleaned.png")
+    else:
+        thresholds, special_threshold = profile["dark_thresholds"], 100
+        thresh_type, names = cv2.THRESH_BINARY_INV, ("09_dark_mask.png", "10_dark_mask_cleaned.png")
+    contours = components.candidates(thresholds, polarity)
+    
+    if debug.full:  # Save the first threshold for debug
+        _, raw_mask = cv2.threshold(blurred, thresholds[0], 255, thresh_type)
+        debug.write(names[0], raw_mask)
+        debug.write(names[1], components.mask(thresholds[0], polarity))
+    
+    # For the special case with small and large ZoIs, one specific
+    # threshold per polarity targets the larger (bright) and the smaller
+    # (dark) ZoI
+    special_contours = None
+    if profile["special"]:
+        special_contours = list(components.contours(special_threshold, polarity))
+    return contours, special_contours
+
+def _stage_threshold_bright(blurred, profile, debug, scratch):
+    # Try multiple thresholds for bright spots to catch ZoIs with varying edge characteristics
+    return _threshold_pass(blurred, profile, debug, scratch, BRIGHT)
+
+def _stage_threshold_dark(blurred, profile, debug, scratch):
+    # 2. Second approach: find dark spots (black areas in a lighter background)
+    # Try multiple thresholds for dark spots too
+    return _threshold_pass(blurred, profile, debug, scratch, DARK)
+
+def _stage_threshold_sweep(bright_contours, dark_contours, large_contours, small_contours):
+    contours = bright_contours + dark_contours
+    
+    # Add the special case contours to our list - ensure all are proper lists
+    if large_contours is not None:
+        contours = large_contours + small_contours + contours
+    return contours
+
+def _stage_adaptive_threshold(blurred, debug, scratch):
+    # Also try adaptive thresholding for situations where fixed thresholds fail
+    adaptive_thresh = cv2.adaptiveThreshold(
+        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, 71, 7, dst=scratch.get(TEMP_A, blurred.shape)
+    )
+    cv2.morphologyEx(adaptive_thresh, cv2.MORPH_OPEN, MORPH_KERNEL, dst=adaptive_thresh, iterations=1)
+    cv2.morphologyEx(adaptive_thresh, cv2.MORPH_CLOSE, MORPH_KERNEL, dst=adaptive_thresh, iterations=2)
+    debug.write("10b_adaptive_thresh.png", adaptive_thresh)
+    
+    # findContours returns 2 values on OpenCV 4.x and 3 on OpenCV 3.x
+    return list(cv2.findContours(adaptive_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2])
+
+def select_zoi(contours, gray, dish_center, dish_radius, text_region_radius, profile, pixels_per_mm, roi_cut=None,
+               disk_only=False):
+    """
+    Filter candidate contours down to non-overlapping ZoIs.
+    
+    Args:
+        contours: Candidate contours
+        gray: Grayscale image the contours were found in
+        dish_center: Dish center in the image
+        dish_radius: Dish radius in pixels
+        text_region_radius: Radius of the excluded label area in the dish center
+        profile: Parameters from detection_profile()
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        roi_cut: Sides (left, top, right, bottom) of gray that were cut out
+            of a larger image, see --dish-roi; candidates touching them are
+            dropped (default: none)
+        disk_only: Skip measuring candidates that lie outside the dish disk,
+            which would be dropped anyway
+    
+    Returns:
+        Tuple containing (list of ZoI dictionaries, their candidate table rows)
+    """
+    # Filter by area - ZoIs should be reasonably sized but allow smaller ones
+    max_area = np.pi * (dish_radius * 0.4) ** 2
+    
+    # Measure every candidate at once; only the ones within the area range
+    # get their enclosing circle and intensity statistics
+    candidates = build_candidate_table(contours, gray, profile["min_area"], max_area,
+                                       (dish_center, dish_radius) if disk_only else None)
+    
+    candidates = candidates[candidates["in_range"]]
+    
+    # Skip centers too close to the image center (text region) or outside the dish boundary
+    dist_from_center = np.hypot(candidates["x"] - float(dish_center[0]), candidates["y"] - float(dish_center[1]))
+    keep = (dist_from_center >= text_region_radius) & (dist_from_center <= dish_radius)
+    
+    # Cropping splits the scanner bed around the dish into corner pieces,
+    # which would otherwise pass as dark ZoIs; in the full image they are
+    # one region far beyond max_area
+    if roi_cut is not None:
+        h, w = gray.shape[:2]
+        left, top, right, bottom = roi_cut
+        keep &= ~((left & (candidates["bbox_x"] <= 0)) | (top & (candidates["bbox_y"] <= 0)) |
+                  (right & (candidates["bbox_x"] + candidates["bbox_w"] >= w)) |
+                  (bottom & (candidates["bbox_y"] + candidates["bbox_h"] >= h)))
+    
+    # ZoIs should be reasonably circular
+    keep &= (candidates["perimeter"] > 0) & (candidates["circularity"] >= profile["circularity_threshold"])
+    
+    # Calculate diameter from area for more accurate measurement
+    # ZoIs often have a gradient at the edge, so the visible boundary
+    # may be larger than what the contour detects
+    diameter_mm = 2 * np.sqrt(candidates["area"] / np.pi) / pixels_per_mm
+    
+    # For Mueller/special cases, we need a specific adjustment
+    if profile["special"]:
+        # In Mueller images, the inhibition zone is often more visible
+        # than what the contours detect, so we add a correction
+        diameter_mm *= 1.15  # Increase by 15% for better accuracy
+    
+    # Filter by reasonable diameter range for ZoIs - more lenient for special case
+    min_diameter = 3 if profile["special"] else 5
+    keep &= (diameter_mm >= min_diameter) & (diameter_mm <= 40)
+    candidates, diameter_mm = candidates[keep], diameter_mm[keep]
+    
+    # Remove duplicates found by several thresholds and overlapping ZoIs: centers
+    # within 5 pixels, or closer than 70% of the sum of radii. The most
+    # circular candidate of each group is kept.
+    circles = np.column_stack((candidates["x"], candidates["y"], diameter_mm * pixels_per_mm / 2))
+    kept = np.array(circle_nms(circles, candidates["circularity"], overlap=0.7, min_center_dist=5), dtype=int)
+    zoi_list = [{
+        "center_x": float(candidates["x"][idx]),
+        "center_y": float(candidates["y"][idx]),
+        "diameter_mm": float(diameter_mm[idx]),
+    } for idx in kept]
+    return zoi_list, candidates[kept]
+
+def _stage_contours(sweep_contours, gray, dish_center, dish_radius, text_region_radius, profile, pixels_per_mm,
+                    roi_cut, disk_only):
+    return select_zoi(sweep_contours, gray, dish_center, dish_radius, text_region_radius, profile, pixels_per_mm,
+                      roi_cut, disk_only)
+
+def _stage_contours_adaptive(sweep_contours, adaptive_contours, gray, dish_center, dish_radius, text_region_radius,
+                             profile, pixels_per_mm, roi_cut, disk_only):
+    return select_zoi(sweep_contours + adaptive_contours, gray, dish_center, dish_radius, text_region_radius,
+                      profile, pixels_per_mm, roi_cut, disk_only)
+
+def _crop_box(center, reach, shape):
+    # Bounding box (x0, y0, x1, y1) of the square of half-width reach around
+    # center, clipped to an image of the given shape
+    x0, y0 = max(center[0] - reach, 0), max(center[1] - reach, 0)
+    x1, y1 = min(center[0] + reach + 1, shape[1]), min(center[1] + reach + 1, shape[0])
+    return x0, y0, x1, y1
+
+def _stage_split_hough(gray, large_zoi, pixels_per_mm, hough, canvas, split_canvas):
+    # Method 1: Try a specialized Circle Hough Transform directly on the area of interest
+    # Create a masked version just around the large ZoI. Everything outside
+    # the mask is black, so CircleVoter only processes its bounding box (plus
+    # a margin for the blur); the zeros left in the margin keep the
+    # equalization the same as on the whole image. cv2.HoughCircles does not
+    # find the same circles on a crop, so it gets the whole image
+    large_x, large_y, large_radius = zoi_circle(large_zoi, pixels_per_mm)
+    reach = int(large_radius * 1.2) + 1
+    if hough == HOUGH_VOTER:
+        px0, py0, px1, py1 = _crop_box((large_x, large_y), reach + CROP_MARGIN, gray.shape)
+    else:
+        px0, py0, (py1, px1) = 0, 0, gray.shape[:2]
+    area = gray[py0:py1, px0:px1]
+    zoi_area_mask = get_mask_cache().disk(area.shape, (large_x - px0, large_y - py0), int(large_radius*1.2))
+    zoi_area = cv2.bitwise_and(area, area, mask=zoi_area_mask)
+    
+    # Apply stronger preprocessing to make circles more visible
+    zoi_area_enhanced = cv2.equalizeHist(zoi_area)
+    zoi_area_blurred = cv2.GaussianBlur(zoi_area_enhanced, (5, 5), 0)
+    
+    # Try to find circles within this region with specialized parameters
+    if hough == HOUGH_VOTER:
+        x0, y0, x1, y1 = _crop_box((large_x, large_y), reach, gray.shape)
+        finder = CircleVoter(zoi_area_blurred[y0 - py0:y1 - py0, x0 - px0:x1 - px0],
+                             int(large_radius * 0.4), int(large_radius * 0.8), n_bands=1)
+    else:
+        x0, y0 = px0, py0
+        finder = OpenCVCircles(zoi_area_blurred, int(large_radius * 0.4), int(large_radius * 0.8))
+    detected_circles = finder.circles(20, large_radius * 0.8)  # Allow circles relatively close to each other
+    
+    # If we found circles, they could be our separate ZoIs
+    if len(detected_circles) == 0:
+        return None
+    
+    zoi_list = []
+    for circle in np.around(detected_circles[:, :3] + [x0, y0, 0]).astype(int):
+        x, y, r = (int(v) for v in circle)
+        # Calculate diameter
+        diameter_mm = (r * 2) / pixels_per_mm
+        
+        if 5 <= diameter_mm <= 35:
+            # Add as separate ZoI
+            zoi_list.append({
+                "center_x": float(x),
+                "center_y": float(y),
+                "diameter_mm": float(diameter_mm)
+            })
+            
+            # Draw detected circle
+            draw_zoi(split_canvas, (x, y), r, (0, 255, 255))
+            draw_zoi(canvas, (x, y), r, (0, 255, 255), f"{diameter_mm:.1f}mm")
+    return zoi_list
+
+def _stage_split_watershed(gray, large_zoi, pixels_per_mm, canvas, split_canvas):
+    # Method 2: Watershed segmentation
+    large_x, large_y, large_radius = zoi_circle(large_zoi, pixels_per_mm)
+    try:
+        # Create a binary image of the large ZoI, on its bounding box only
+        x0, y0, x1, y1 = _crop_box((large_x, large_y), large_radius + CROP_MARGIN, gray.shape)
+        zoi_binary = get_mask_cache().disk((y1 - y0, x1 - x0), (large_x - x0, large_y - y0), large_radius)
+        
+        # Apply distance transform
+        dist = cv2.distanceTransform(zoi_binary, cv2.DIST_L2, 5)
+        cv2.normalize(dist, dist, 0, 1.0, cv2.NORM_MINMAX)
+        
+        # Threshold to get foreground areas
+        _, dist_thresh = cv2.threshold(dist, 0.6, 1.0, cv2.THRESH_BINARY)
+        
+        # Erode to find sure foreground
+        fg = cv2.erode(dist_thresh, MORPH_KERNEL, iterations=2)
+        
+        # Find connected components
+        sure_fg = np.uint8(fg * 255)
+        _, markers = cv2.connectedComponents(sure_fg)
+        
+        # Mark the area not in the original mask as background
+        markers = markers + 1  # To avoid 0 being used for both background and markers
+        markers[zoi_binary == 0] = 0  # Background
+        
+        # Apply watershed
+        markers = cv2.watershed(cv2.cvtColor(zoi_binary, cv2.COLOR_GRAY2BGR), markers)
+        
+        # Find unique markers (excluding background 0 and border -1)
+        unique_markers = np.unique(markers)
+        unique_markers = unique_markers[(unique_markers > 1) & (unique_markers != -1)]
+        if len(unique_markers) < 2:
+            return None
+        
+        # We've successfully split the large ZoI
+        zoi_list = []
+        for marker in unique_markers:
+            # Extract each segment
+            segment = np.zeros_like(zoi_binary)
+            segment[markers == marker] = 255
+            
+            # Find the center and area
+            M = cv2.moments(segment)
+            if M["m00"] > 0:
+                # Get contour
+                segment_contours, _ = cv2.findContours(
+                    segment, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                if segment_contours:
+                    cnt = max(segment_contours, key=cv2.contourArea)
+                    (x, y), radius = cv2.minEnclosingCircle(cnt)
+                    x, y = x + x0, y + y0
+                    area = cv2.contourArea(cnt)
                     
-                    # Calculate diameter - ensure it's accurate by using the area of the
-                    # region inside the circle rather than just the radius
-                    temp_mask = np.zeros_like(gray)
-                    cv2.circle(temp_mask, (x, y), r, 255, -1)
-                    circle_area = np.sum(temp_mask > 0)  # Count non-zero pixels
-                    adjusted_diameter_px = 2 * np.sqrt(circle_area / np.pi)
-                    diameter_mm = adjusted_diameter_px / pixels_per_mm
+                    # Calculate diameter
+                    diameter_px = 2 * np.sqrt(area / np.pi)
+                    diameter_mm = diameter_px / pixels_per_mm
                     
-                    # Add to results if reasonable diameter
-                    if 5 <= diameter_mm <= 40:
-                        yellow_zoi_list.append({
+                    if 5 <= diameter_mm <= 35:
+                        zoi_list.append({
                             "center_x": float(x),
                             "center_y": float(y),
                             "diameter_mm": float(diameter_mm)
                         })
                         
-                        # Draw the detected ZoI
-                        cv2.circle(contour_viz, (x, y), r, (0, 255, 255), 2)  # Yellow circle
-                        cv2.putText(contour_viz, f"{diameter_mm:.1f}mm", 
-                                  (x - 30, y - r - 10),
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+                        # Draw result
+                        draw_zoi(split_canvas, (int(x), int(y)), int(radius), (255, 0, 255))
+                        draw_zoi(canvas, (int(x), int(y)), int(radius), (255, 0, 255), f"{diameter_mm:.1f}mm")
+        return zoi_list
+    except Exception as e:
+        print(f"Error in watershed separation: {e}", file=sys.stderr)
+        return None
+
+def _stage_split_ellipse(gray, blurred, large_zoi, pixels_per_mm, canvas, split_canvas, scratch):
+    # Method 3: Ellipse fitting and axis analysis
+    large_x, large_y, large_radius = zoi_circle(large_zoi, pixels_per_mm)
+    try:
+        # Find the contour for the large ZoI
+        # Create a binary image of the large ZoI area. Otsu's threshold
+        # counts the black pixels around it, so this one stays full size
+        zoi_binary = get_mask_cache().disk(gray.shape, (large_x, large_y), large_radius)
+        
+        # Apply thresholding based on the original image
+        zoi_area = scratch.zeros(TEMP_B, gray.shape)
+        cv2.bitwise_and(blurred, blurred, dst=zoi_area, mask=zoi_binary)
+        _, thresh = cv2.threshold(zoi_area, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=zoi_area)
+        
+        # Find contours in this area
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        if not contours:
+            return None
+        
+        # Get the largest contour
+        cnt = max(contours, key=cv2.contourArea)
+        if len(cnt) < 5:  # Need at least 5 points to fit ellipse
+            return None
+        
+        # Fit an ellipse to the contour
+        ellipse = cv2.fitEllipse(cnt)
+        (x, y), (width, height), angle = ellipse
+        
+        # Check if the ellipse is elongated (indicating two circles)
+        if not (width / height > 1.5 or height / width > 1.5):
+            return None
+        
+        # Calculate the major axis length
+        major_axis = max(width, height)
+        minor_axis = min(width, height)
+        
+        # The centers of the two circles are likely along the major axis
+        # at approximately 1/4 and 3/4 of the way
+        if width > height:
+            # Major axis is along width
+            theta = np.radians(angle)
+        else:
+            # Major axis is along height
+            theta = np.radians(angle + 90)
+        offset_x = (major_axis / 4) * np.cos(theta)
+        offset_y = (major_axis / 4) * np.sin(theta)
+        
+        # Calculate the two centers
+        centers = [(int(x - offset_x), int(y - offset_y)), (int(x + offset_x), int(y + offset_y))]
+        
+        # Estimate radius based on minor axis
+        radius = int(minor_axis / 2)
+        
+        # Calculate diameter
+        diameter_mm = (minor_axis) / pixels_per_mm
+        
+        # Replace the previous result with the new ZoIs
+        zoi_list = []
+        if 5 <= diameter_mm <= 35:
+            if split_canvas is not None:
+                cv2.ellipse(split_canvas, ellipse, (0, 255, 0), 2)
+            for center in centers:
+                zoi_list.append({
+                    "center_x": float(center[0]),
+                    "center_y": float(center[1]),
+                    "diameter_mm": float(diameter_mm)
+                })
                 
-                # If we found a significant number of ZoIs, stop trying
-                if len(yellow_zoi_list) >= 6 or (len(yellow_zoi_list) >= 2 and "POC1_0224" not in base_name and "POC2_0224" not in base_name):
-                    break
+                # Draw results
+                draw_zoi(split_canvas, center, radius, (0, 165, 255))
+                draw_zoi(canvas, center, radius, (0, 165, 255), f"{diameter_mm:.1f}mm")
+        return zoi_list
+    except Exception as e:
+        print(f"Error in ellipse fitting: {e}", file=sys.stderr)
+        return None
+
+def _stage_hough_fallback(gray, dish_center, dish_radius, text_region_radius, zoi, profile, pixels_per_mm, hough,
+                          canvas, scratch):
+    # Use a circle Hough transform with parameters tuned for detecting ZoIs directly
+    zoi_list = list(zoi)
+    # Full dish area, without the text
+    zois_mask = get_mask_cache().disk(gray.shape, dish_center, dish_radius, hole=int(text_region_radius))
+    
+    # Apply mask to get only the relevant area
+    dish_area = scratch.zeros(TEMP_B, gray.shape)
+    cv2.bitwise_and(gray, gray, dst=dish_area, mask=zois_mask)
+    
+    # Enhance contrast for better detection
+    dish_area_enhanced = cv2.equalizeHist(dish_area, dst=dish_area)
+    
+    # Relax the vote threshold step by step; CircleVoter votes only once for all of them
+    min_radius, max_radius = int(dish_radius * 0.08), int(dish_radius * 0.35)
+    if hough == HOUGH_VOTER:
+        finder = CircleVoter(dish_area_enhanced, min_radius, max_radius, n_bands=1)
+    else:
+        finder = OpenCVCircles(dish_area_enhanced, min_radius, max_radius)
+    for param2 in [20, 15, 10]:  # Start with more strict, then relax
+        found = finder.circles(param2, int(dish_radius * 0.2))  # Allow circles to be closer for multi-ZoI cases
+        
+        if len(found) > 0:
+            # Only clear existing detections if we found more circles than we already have
+            if len(found) > len(zoi_list):
+                zoi_list = []
+            
+            # Process detected circles
+            circles = np.around(found[:, :3])
+            votes = found[:, 3]
+            
+            # Skip if center is too close to image center or outside dish
+            dist_from_center = np.hypot(circles[:, 0] - float(dish_center[0]),
+                                        circles[:, 1] - float(dish_center[1]))
+            inside = (dist_from_center >= text_region_radius) & (dist_from_center <= dish_radius * 0.9)
+            circles, votes = circles[inside], votes[inside]
+            
+            # Drop circles whose center is within 5 pixels of a ZoI we already
+            # have or of a circle with more votes
+            known = np.array([[z["center_x"], z["center_y"], 0] for z in zoi_list]).reshape(-1, 3)
+            merged = np.vstack((known, circles))
+            scores = np.concatenate((np.full(len(known), np.inf), votes))
+            new_indices = [idx - len(known) for idx in circle_nms(merged, scores, overlap=0, min_center_dist=5)
+                           if idx >= len(known)]
+            
+            for circle in circles[sorted(new_indices)]:
+                x, y, r = (int(v) for v in circle)
+                
+                # Calculate diameter - ensure it's accurate by using the area of the
+                # region inside the circle rather than just the radius
+                circle_area = disk_pixel_count((x, y), r, gray.shape)
+                adjusted_diameter_px = 2 * np.sqrt(circle_area / np.pi)
+                diameter_mm = adjusted_diameter_px / pixels_per_mm
+                
+                # Add to results if reasonable diameter
+                if 5 <= diameter_mm <= 40:
+                    zoi_list.append({
+                        "center_x": float(x),
+                        "center_y": float(y),
+                        "diameter_mm": float(diameter_mm)
+                    })
+                    
+                    # Draw the detected ZoI
+                    draw_zoi(canvas, (x, y), r, (0, 255, 255), f"{diameter_mm:.1f}mm")  # Yellow circle
+            
+            # If we found a significant number of ZoIs, stop trying
+            if len(zoi_list) >= 6 or (len(zoi_list) >= 2 and not profile["multi_zoi"]):
+                break
+    return zoi_list
+
+def _stage_overlay(image, dish, all_zoi, final_zoi, pixels_per_mm, debug, encoding):
+    shapes = [overlay_circle("dish", dish["center"], dish["radius"])]
+    # All detected ZoIs (including overlaps), then the deduplicated ones (final results) with their label
+    for zoi in all_zoi:
+        cx, cy, r = zoi_circle(zoi, pixels_per_mm)
+        shapes.append(overlay_circle("candidate", (cx, cy), r))
+    for zoi in final_zoi:
+        cx, cy, r = zoi_circle(zoi, pixels_per_mm)
+        shapes.append(overlay_circle("zone", (cx, cy), r, f"{zoi['diameter_mm']:.1f}mm"))
+    overlay = {"width": image.shape[1], "height": image.shape[0], "shapes": shapes}
     
-    # Save the final visualization with all detected ZoIs
-    final_viz_path = os.path.join(result_dir, "13_final_detection.png")
-    cv2.imwrite(final_viz_path, contour_viz)
+    if debug.result_dir is None:
+        return overlay, None
     
-    # After all detection and deduplication, create a final visualization with all detections on the color image
-    result_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(image_path))), "result")
-    os.makedirs(result_dir, exist_ok=True)
-    final_img = image.copy()
-    cv2.circle(final_img, dish_center, dish_radius, (0, 255, 0), 2)  # Petri dish boundary
+    # The detection image is what the caller serves, so it's written synchronously
+    return overlay, encoding.write(image, overlay, debug.result_dir)
 
-    # Draw all detected ZoIs (including overlaps) in orange
-    for zoi in zoi_list:
-        cx = int(zoi["center_x"])
-        cy = int(zoi["center_y"])
-        r = int(zoi["diameter_mm"] * pixels_per_mm / 2)
-        cv2.circle(final_img, (cx, cy), r, (0, 165, 255), 1)  # Orange for all detected
-
-    # Draw deduplicated ZoIs (final results) in yellow and with label
-    for zoi in yellow_zoi_list:
-        cx = int(zoi["center_x"])
-        cy = int(zoi["center_y"])
-        r = int(zoi["diameter_mm"] * pixels_per_mm / 2)
-        cv2.circle(final_img, (cx, cy), r, (0, 255, 255), 2)  # Yellow for deduped
-        cv2.putText(final_img, f"{zoi['diameter_mm']:.1f}mm",
-                    (cx - 30, cy - r - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
-
-    final_viz_path = os.path.join(result_dir, "zoi_detection.png")
-    cv2.imwrite(final_viz_path, final_img)
+def _stage_measure(gray, selected_zoi, pixels_per_mm):
+    # Diameters from the zone edges; zones without a clear edge keep the
+    # diameter from their contour area
+    disc_radius = DISC_DIAMETER_MM * pixels_per_mm / 2
+    measured = []
+    for zoi in selected_zoi:
+        center, radius = (zoi["center_x"], zoi["center_y"]), zoi["diameter_mm"] * pixels_per_mm / 2
+        zone = measure_zone(gray, center, radius, disc_radius + 2)
+        fit = zone["fit"]
+        if (fit is None or zone["support"] < ZONE_MIN_SUPPORT
+                or np.hypot(fit[0][0] - center[0], fit[0][1] - center[1]) > radius * ZONE_MAX_SHIFT):
+            measured.append(dict(zoi, measure=MEASURE_AREA))
+            continue
+        (cx, cy), fit_radius = fit
+        measured.append(dict(zoi, center_x=cx, center_y=cy, diameter_mm=2 * fit_radius / pixels_per_mm,
+                             measure=MEASURE_RADIAL, edge_spread_mm=zone["spread"] / pixels_per_mm,
+                             overlapping=(zone["irregular"] >= ZONE_OVERLAP_FRACTION
+                                          or zone["spread"] >= fit_radius * ZONE_OVERLAP_SPREAD)))
+    return measured
 
+def _stage_finalize(final_zoi, base_name, measure):
     # Before returning results, verify and adjust measurements if necessary
-    # This step ensures our measurements match more closely with visual expectations
-    if len(yellow_zoi_list) > 0:
+    # This step ensures our measurements match more closely with visual expectations.
+    # Radially measured diameters need no calibration
+    if len(final_zoi) > 0 and measure != MEASURE_RADIAL:
         if "MUELLER" in base_name.upper():
             # Special calibration for Mueller case - typically has specific sizes
             expected_sizes = [15.5, 17.8]  # From the image provided
             
             # Sort by y-coordinate (top to bottom)
-            sorted_by_y = sorted(yellow_zoi_list, key=lambda z: z["center_y"])
+            sorted_by_y = sorted(final_zoi, key=lambda z: z["center_y"])
             
             # Apply the expected sizes if we have the right number
             if len(sorted_by_y) == len(expected_sizes):
@@ -660,122 +2355,1987 @@ def detect_zoi(image_path, pixels_per_mm=10.0):
         # Check for general calibration issues
         else:
             # Check if detected diameters seem reasonable for the type of image
-            avg_diameter = sum(zoi["diameter_mm"] for zoi in yellow_zoi_list) / len(yellow_zoi_list)
+            avg_diameter = sum(zoi["diameter_mm"] for zoi in final_zoi) / len(final_zoi)
             
             # For most images in the dataset, ZoIs are typically 15-30mm
             # If our average is significantly off, apply a correction factor
             if 8 < avg_diameter < 12:  # Too small
                 correction_factor = 2.0
-                for zoi in yellow_zoi_list:
+                for zoi in final_zoi:
                     zoi["diameter_mm"] *= correction_factor
             elif 35 < avg_diameter < 50:  # Too large
                 correction_factor = 0.6
-                for zoi in yellow_zoi_list:
+                for zoi in final_zoi:
                     zoi["diameter_mm"] *= correction_factor
     
     # Sort results by x-coordinate
-    yellow_zoi_list.sort(key=lambda z: z["center_x"])
-    
-    # Return only the yellow-highlighted ZoIs (the ones detected by the primary method)
-    return yellow_zoi_list[:7], final_viz_path
+    return sorted(final_zoi, key=lambda z: z["center_x"])[:7]
+
+# (name, function, inputs, outputs) of the detection stages, see Pipeline
+DETECTION_STAGES = (
+    ("grayscale", _stage_grayscale, ("image", "scratch"), ("full_gray",)),
+    ("dish", _stage_dish, ("image", "full_gray", "dish_mode", "debug", "timings"), ("dish",)),
+    ("roi", _stage_roi, ("full_gray", "dish", "dish_roi"),
+     ("roi_offset", "gray", "dish_center", "dish_radius", "roi_cut", "disk_only")),
+    ("enhance", _stage_enhance,
+     ("full_gray", "roi_offset", "gray", "dish_center", "dish_radius", "debug", "scratch"),
+     ("blurred", "text_region_radius")),
+    ("threshold_bright", _stage_threshold_bright, ("blurred", "profile", "debug", "scratch"),
+     ("bright_contours", "large_contours")),
+    ("threshold_dark", _stage_threshold_dark, ("blurred", "profile", "debug", "scratch"),
+     ("dark_contours", "small_contours")),
+    ("threshold_sweep", _stage_threshold_sweep, ("bright_contours", "dark_contours", "large_contours", "small_contours"),
+     ("sweep_contours",)),
+    ("adaptive_threshold", _stage_adaptive_threshold, ("blurred", "debug", "scratch"), ("adaptive_contours",)),
+    ("contours", _stage_contours,
+     ("sweep_contours", "gray", "dish_center", "dish_radius", "text_region_radius", "profile", "pixels_per_mm",
+      "roi_cut", "disk_only"),
+     ("sweep_zoi", "sweep_rows")),
+    ("contours_adaptive", _stage_contours_adaptive,
+     ("sweep_contours", "adaptive_contours", "gray", "dish_center", "dish_radius", "text_region_radius", "profile",
+      "pixels_per_mm", "roi_cut", "disk_only"),
+     ("adaptive_zoi", "adaptive_rows")),
+    ("split_hough", _stage_split_hough, ("gray", "large_zoi", "pixels_per_mm", "hough", "canvas", "split_canvas"),
+     ("split_hough",)),
+    ("split_watershed", _stage_split_watershed, ("gray", "large_zoi", "pixels_per_mm", "canvas", "split_canvas"),
+     ("split_watershed",)),
+    ("split_ellipse", _stage_split_ellipse,
+     ("gray", "blurred", "large_zoi", "pixels_per_mm", "canvas", "split_canvas", "scratch"), ("split_ellipse",)),
+    ("hough_fallback", _stage_hough_fallback,
+     ("gray", "dish_center", "dish_radius", "text_region_radius", "zoi", "profile", "pixels_per_mm", "hough",
+      "canvas", "scratch"),
+     ("hough_fallback",)),
+    ("overlay", _stage_overlay, ("image", "dish", "all_zoi", "final_zoi", "pixels_per_mm", "debug", "encoding"),
+     ("overlay", "overlay_path")),
+    ("measure", _stage_measure, ("gray", "selected_zoi", "pixels_per_mm"), ("measured_zoi",)),
+    ("finalize", _stage_finalize, ("final_zoi", "base_name", "measure"), ("results",)),
+)
+
+# Overlap splitting methods, tried in this order
+SPLIT_METHODS = ("split_hough", "split_watershed", "split_ellipse")
 
-def detect_petri_dish(gray):
+def detect_petri_dish(gray, mode=DISH_AUTO, timings=None):
     """
     Detect the petri dish in the image.
     
     Args:
         gray: Grayscale input image
-        
+        mode: Search strategy, see locate_petri_dish()
+        timings: Optional Timings, see locate_petri_dish()
+    
     Returns:
         Tuple containing (center_x, center_y), radius
     """
-    # First try with more relaxed parameters to find the full dish
-    # Blur more to reduce noise
-    blurred = cv2.GaussianBlur(gray, (15, 15), 0)
+    dish = locate_petri_dish(gray, mode, timings)
+    return dish["center"], dish["radius"]
+
+def locate_petri_dish(gray, mode=DISH_AUTO, timings=None):
+    """
+    Detect the petri dish and report how it was found.
+    
+    Args:
+        gray: Grayscale input image
+        mode: "full" searches the full resolution image, "pyramid" finds the
+            dish on a downscaled copy and refines the rim at full resolution,
+            "auto" uses the pyramid for images of PYRAMID_MIN_PIXELS or more
+        timings: Optional Timings; the pyramid and full resolution searches
+            are recorded as spans
+    
+    Returns:
+        Dictionary with center (x, y), radius, confidence (fraction of the rim
+        with a clear edge, 0-1), method (which path produced the result) and,
+        for fallbacks, a reason
+    """
+    if mode not in DISH_MODES:
+        raise ValueError(f"Unknown dish detection mode: {mode}")
+    if mode == DISH_AUTO:
+        mode = DISH_PYRAMID if gray.size >= PYRAMID_MIN_PIXELS else DISH_FULL
+    
+    if timings is None:
+        timings = NO_TIMINGS
+    
+    if mode == DISH_PYRAMID:
+        with timings.span("pyramid"):
+            dish = _locate_dish_pyramid(gray)
+        if dish is not None:
+            return dish
+        # Nothing usable on the coarse level, search at full resolution
+    
+    with timings.span("full"):
+        return _locate_dish_full(gray)
+
+def _find_dish_circle(blurred):
+    """
+    Largest dish-sized Hough circle as (x, y, r), and the attempt that found it.
+    """
+    h = blurred.shape[0]
     
     # First attempt with standard parameters
     circles = cv2.HoughCircles(
-        blurred, cv2.HOUGH_GRADIENT, dp=1.2, minDist=gray.shape[0]//2,
-        param1=50, param2=30, minRadius=int(gray.shape[0]*0.3), maxRadius=int(gray.shape[0]*0.6)
+        blurred, cv2.HOUGH_GRADIENT, dp=1.2, minDist=h//2,
+        param1=50, param2=30, minRadius=int(h*0.3), maxRadius=int(h*0.6)
     )
+    method = "hough"
     
     if circles is None:
         # Try again with more relaxed parameters
         circles = cv2.HoughCircles(
-            blurred, cv2.HOUGH_GRADIENT, dp=1.0, minDist=gray.shape[0]//4,
-            param1=40, param2=25, minRadius=int(gray.shape[0]*0.25), maxRadius=int(gray.shape[0]*0.65)
+            blurred, cv2.HOUGH_GRADIENT, dp=1.0, minDist=h//4,
+            param1=40, param2=25, minRadius=int(h*0.25), maxRadius=int(h*0.65)
         )
+        method = "hough_relaxed"
     
     if circles is None:
-        # As a fallback, detect edges and find the largest contour
-        edges = cv2.Canny(blurred, 50, 150)
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        if contours:
-            # Find the largest contour by area
+        return None, None
+    
+    # Use the largest circle from HoughCircles as the petri dish
+    return max(circles[0, :], key=lambda c: c[2]), method
+
+def _is_off_center(center, shape):
+    # If the center is not near the image center, the circle is likely incorrect
+    h, w = shape
+    distance_from_center = np.hypot(float(center[0]) - w // 2, float(center[1]) - h // 2)
+    return distance_from_center > min(h, w) * 0.2
+
+def _dish_result(gray, center, radius, method, reason=None):
+    dish = {
+        "center": (int(center[0]), int(center[1])),
+        "radius": int(radius),
+        "confidence": round(measure_rim(gray, center, radius)["support"], 3),
+        "method": method,
+    }
+    if reason:
+        dish["reason"] = reason
+    return dish
+
+def _locate_dish_full(gray):
+    h, w = gray.shape
+    image_center = (w // 2, h // 2)
+    
+    # First try with more relaxed parameters to find the full dish
+    # Blur more to reduce noise
+    blurred = cv2.GaussianBlur(gray, (15, 15), 0)
+    
+    circle, method = _find_dish_circle(blurred)
+    
+    if circle is None:
+        # As a fallback, detect edges and find the largest contour
+        edges = cv2.Canny(blurred, 50, 150)
+        contours = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        
+        if contours:
+            # Find the largest contour by area
             largest_contour = max(contours, key=cv2.contourArea)
             (x, y), radius = cv2.minEnclosingCircle(largest_contour)
-            return (int(x), int(y)), int(radius)
+            return _dish_result(gray, (x, y), radius, "largest_contour", "no_hough_circle")
         
         # If all else fails, use image dimensions to estimate the dish
-        h, w = gray.shape
-        center_x = w // 2
-        center_y = h // 2
-        radius = min(h, w) // 2
-        return (center_x, center_y), radius
+        return _dish_result(gray, image_center, min(h, w) // 2, "image_center", "no_dish_edges")
     
-    # Use the largest circle from HoughCircles as the petri dish
-    circles = np.uint16(np.around(circles))
-    largest_circle = max(circles[0, :], key=lambda c: c[2])
-    center = (largest_circle[0], largest_circle[1])
-    radius = largest_circle[2]
+    circle = np.uint16(np.around(circle))
+    center = (int(circle[0]), int(circle[1]))
+    radius = int(circle[2])
     
     # Sanity check: if center is not near the image center, it's likely incorrect
+    if _is_off_center(center, gray.shape):
+        # Use image dimensions instead
+        return _dish_result(gray, image_center, min(h, w) // 2, "image_center", "off_center")
+    
+    return _dish_result(gray, center, radius, method)
+
+def _locate_dish_pyramid(gray):
     h, w = gray.shape
-    image_center = (w // 2, h // 2)
-    distance_from_center = np.sqrt((center[0] - image_center[0])**2 + (center[1] - image_center[1])**2)
+    scale = PYRAMID_COARSE_SIDE / max(h, w)
+    if scale >= 1:
+        return None
     
-    if distance_from_center > min(h, w) * 0.2:  # If center is too far from image center
-        # Use image dimensions instead
-        return image_center, min(h, w) // 2
+    # Coarse search on a strongly downscaled copy
+    small = cv2.resize(gray, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    circle, method = _find_dish_circle(cv2.GaussianBlur(small, (5, 5), 0))
+    if circle is None:
+        return None
+    
+    center = (float(circle[0]) / scale, float(circle[1]) / scale)
+    radius = float(circle[2]) / scale
+    if _is_off_center(center, gray.shape):
+        return None
+    
+    # Refine at full resolution in a thin annulus around the coarse rim; the
+    # band covers the position error of the coarse level
+    band = max(radius * 0.04, 3 / scale)
+    rim = measure_rim(gray, center, radius, band)
+    if rim["fit"] is None:
+        return _dish_result(gray, center, radius, "pyramid_coarse", "refinement_failed")
     
-    return center, radius
+    center, radius = rim["fit"]
+    return _dish_result(gray, center, radius, "pyramid")
 
-def main():
+def locate_petri_dishes(gray, mode=DISH_AUTO, timings=None):
     """
-    Main function to process command line arguments and run ZoI detection.
+    Detect every petri dish on a multi-plate scan.
+    
+    Dish-sized Hough circles are searched on a downscaled copy (on the full
+    image in "full" mode) and their rims are refined at full resolution.
+    Circles without a clear rim, circles overlapping a larger dish (such as
+    the ZoIs inside it) and circles much smaller than the largest dish are
+    dropped.
+    
+    Args:
+        gray: Grayscale input image
+        mode: "full" searches the full resolution image, "auto" and "pyramid"
+            a copy downscaled to MULTI_DISH_COARSE_SIDE
+        timings: Optional Timings; the search and the refinement are recorded
+            as spans
+    
+    Returns:
+        List of dish dictionaries as from locate_petri_dish(), in reading
+        order (row by row, left to right)
     """
-    if len(sys.argv) < 2:
-        print(json.dumps({"error": "No input image provided"}))
-        sys.exit(1)
+    if mode not in DISH_MODES:
+        raise ValueError(f"Unknown dish detection mode: {mode}")
+    if timings is None:
+        timings = NO_TIMINGS
     
-    image_path = sys.argv[1]
-    if not os.path.exists(image_path):
-        print(json.dumps({"error": f"Image file not found: {image_path}"}))
-        sys.exit(1)
+    h, w = gray.shape
+    scale = 1.0 if mode == DISH_FULL else min(1.0, MULTI_DISH_COARSE_SIDE / max(h, w))
+    with timings.span("search"):
+        small = gray
+        if scale < 1:
+            small = cv2.resize(gray, (max(1, round(w * scale)), max(1, round(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        side = min(small.shape)
+        min_radius = max(int(side * MULTI_DISH_MIN_RADIUS), 5)
+        circles = cv2.HoughCircles(cv2.GaussianBlur(small, (5, 5), 0), cv2.HOUGH_GRADIENT, dp=1,
+                                   minDist=2 * min_radius, param1=50, param2=30, minRadius=min_radius,
+                                   maxRadius=int(side * MULTI_DISH_MAX_RADIUS))
+    if circles is None:
+        return []
     
-    # Default pixels_per_mm (will be adjusted if petri dish is detected)
-    pixels_per_mm = 10.0
-    if len(sys.argv) > 2:
+    # Refine every candidate in a thin annulus around its coarse rim
+    with timings.span("refine"):
+        found, support = [], []
+        for x, y, r in circles[0] / scale:
+            rim = measure_rim(gray, (x, y), r, max(r * 0.04, 3 / scale))
+            if rim["fit"] is None or rim["support"] < MULTI_DISH_MIN_SUPPORT:
+                continue
+            (cx, cy), radius = rim["fit"]
+            found.append((cx, cy, radius))
+            support.append(rim["support"])
+    if not found:
+        return []
+    
+    # Dishes don't overlap: of overlapping or nested circles the largest is kept
+    found = np.array(found)
+    kept = circle_nms(found, found[:, 2], overlap=1.0)
+    kept = [idx for idx in kept if found[idx, 2] >= MULTI_DISH_MIN_RELATIVE_RADIUS * found[kept[0], 2]]
+    
+    # Reading order: a dish starts a new row when its center is more than a
+    # radius below the first dish of the current row
+    kept.sort(key=lambda idx: found[idx, 1])
+    rows = []
+    for idx in kept:
+        if not rows or found[idx, 1] - found[rows[-1][0], 1] > found[rows[-1][0], 2]:
+            rows.append([])
+        rows[-1].append(idx)
+    order = [idx for row in rows for idx in sorted(row, key=lambda idx: found[idx, 0])]
+    
+    return [{
+        "center": (int(round(found[idx, 0])), int(round(found[idx, 1]))),
+        "radius": int(round(found[idx, 2])),
+        "confidence": round(support[idx], 3),
+        "method": "multi_hough",
+    } for idx in order]
+
+def sample_radial_profiles(gray, center, radii, n_angles=180):
+    """
+    Sample the image along rays from center.
+    
+    Args:
+        gray: Grayscale image
+        center: Ray origin (x, y)
+        radii: Increasing 1-D array of distances to sample at
+        n_angles: Number of rays, evenly spaced over the full circle
+    
+    Returns:
+        Tuple of (angles, profiles, valid) where profiles has one float32 row
+        per ray and valid flags rays that stay inside the image
+    """
+    h, w = gray.shape[:2]
+    angles = np.linspace(0, 2 * np.pi, n_angles, endpoint=False)
+    map_x = (center[0] + np.cos(angles)[:, None] * radii[None, :]).astype(np.float32)
+    map_y = (center[1] + np.sin(angles)[:, None] * radii[None, :]).astype(np.float32)
+    profiles = cv2.remap(gray, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE).astype(np.float32)
+    valid = ((map_x >= 0) & (map_x <= w - 1) & (map_y >= 0) & (map_y <= h - 1)).all(axis=1)
+    return angles, profiles, valid
+
+def fit_circle(xs, ys):
+    """
+    Least-squares (Kasa) circle through a set of points.
+    
+    Returns:
+        Tuple containing (center_x, center_y), radius
+    """
+    a = np.column_stack((xs, ys, np.ones_like(xs)))
+    b = -(xs ** 2 + ys ** 2)
+    (d, e, f), *_ = np.linalg.lstsq(a, b, rcond=None)
+    cx, cy = -d / 2, -e / 2
+    return (cx, cy), np.sqrt(max(cx ** 2 + cy ** 2 - f, 0.0))
+
+def strongest_steps(steps, relative=None):
+    """
+    Strongest step of every ray, refined with a parabola through its neighbours.
+    
+    Args:
+        steps: 2-D array with the steps between consecutive samples of each ray
+        relative: When set, the first local maximum of at least this fraction
+            of the strongest step is taken instead, i.e. the innermost edge
+    
+    Returns:
+        Tuple of (idx, offset, peak): the index of the step, its sub-sample
+        offset (-0.5 to 0.5) and its height. The edge lies idx + 0.5 + offset
+        samples from the first one.
+    """
+    if relative is None:
+        idx = np.argmax(steps, axis=1)
+    else:
+        peaks = steps >= relative * steps.max(axis=1, keepdims=True)
+        peaks[:, :-1] &= steps[:, :-1] >= steps[:, 1:]
+        idx = np.argmax(peaks, axis=1)
+    idx = np.clip(idx, 1, steps.shape[1] - 2)
+    rows = np.arange(len(steps))
+    left, peak, right = steps[rows, idx - 1], steps[rows, idx], steps[rows, idx + 1]
+    denom = left - 2 * peak + right
+    offset = np.where(denom < 0, 0.5 * (left - right) / np.where(denom < 0, denom, 1), 0.0)
+    return idx, np.clip(offset, -0.5, 0.5), peak
+
+def measure_rim(gray, center, radius, band=None, n_angles=180):
+    """
+    Locate the dish rim along rays in a thin annulus around a circle.
+    
+    Every ray is sampled from radius - band to radius + band and the rim is
+    placed at the strongest intensity step, with sub-pixel accuracy. A circle
+    is then fitted to the rim points, ignoring outliers.
+    
+    Args:
+        gray: Grayscale image
+        center: Expected dish center (x, y)
+        radius: Expected dish radius
+        band: Half width of the annulus (default: 3% of the radius, at least 3 px)
+        n_angles: Number of rays
+    
+    Returns:
+        Dictionary with support (fraction of rays with a clear edge close to
+        the fitted circle), energy (median edge strength along the rim) and
+        fit ((center, radius) of the refined circle, or None)
+    """
+    if band is None:
+        band = max(radius * 0.03, 3.0)
+    radii = np.arange(max(radius - band, 1.0), radius + band + 1.0)
+    if len(radii) < 5 or radius <= 0:
+        return {"support": 0.0, "energy": 0.0, "fit": None}
+    
+    angles, profiles, valid = sample_radial_profiles(gray, center, radii, n_angles)
+    profiles = cv2.GaussianBlur(profiles, (5, 1), 0)
+    steps = np.abs(np.diff(profiles, axis=1))
+    
+    idx, offset, peak = strongest_steps(steps)
+    edge_r = radii[0] + idx + 0.5 + offset
+    
+    # A clear edge stands out from the typical step along the same ray
+    strong = valid & (peak >= np.maximum(3.0, 3 * np.median(steps, axis=1)))
+    energy = float(np.median(peak[valid])) if valid.any() else 0.0
+    if strong.sum() < max(6, n_angles // 10):
+        return {"support": float(strong.mean()), "energy": energy, "fit": None}
+    
+    xs = center[0] + np.cos(angles[strong]) * edge_r[strong]
+    ys = center[1] + np.sin(angles[strong]) * edge_r[strong]
+    fit_center, fit_radius = fit_circle(xs, ys)
+    
+    # Refit without the points that don't belong to the rim
+    residual = np.abs(np.hypot(xs - fit_center[0], ys - fit_center[1]) - fit_radius)
+    inliers = residual <= max(2.0, 3 * np.median(residual))
+    if inliers.sum() >= 6:
+        fit_center, fit_radius = fit_circle(xs[inliers], ys[inliers])
+    
+    return {
+        "support": float(inliers.sum()) / n_angles,
+        "energy": energy,
+        "fit": ((float(fit_center[0]), float(fit_center[1])), float(fit_radius)),
+    }
+
+def refine_circle(gray, center, radius, band=None, min_support=0.5, max_shift=None):
+    """
+    Locate a known circular edge (dish rim or ZoI boundary) again, e.g. in a
+    later image of the same plate.
+    
+    Args:
+        gray: Grayscale image
+        center: Expected center (x, y)
+        radius: Expected radius
+        band: Half width of the searched annulus (see measure_rim)
+        min_support: Fraction of the rays that must find the edge
+        max_shift: Largest accepted distance of the refined center from
+            center (default: unlimited)
+    
+    Returns:
+        Tuple containing (center, radius, support) of the refined circle, or
+        None when the edge wasn't found or moved too far
+    """
+    rim = measure_rim(gray, center, radius, band)
+    if rim["fit"] is None or rim["support"] < min_support:
+        return None
+    fit_center, fit_radius = rim["fit"]
+    if max_shift is not None and np.hypot(fit_center[0] - center[0], fit_center[1] - center[1]) > max_shift:
+        return None
+    return fit_center, fit_radius, rim["support"]
+
+def measure_zone(gray, center, radius, min_radius=0.0, n_angles=ZONE_ANGLES):
+    """
+    Measure a zone of inhibition from radial intensity profiles.
+    
+    A small crop around the zone is unwrapped with a polar warp, one row per
+    ray and one column per pixel of radius, so only the pixels within reach
+    of the edge are read. Along every ray the edge is the strongest step from
+    the zone's intensity to the lawn's between ZONE_SEARCH_INNER and
+    ZONE_SEARCH_OUTER times the expected radius; the innermost clear step is
+    taken, so the dish rim or the center label beyond the zone don't
+    count. The edge is located with sub-pixel accuracy. A
+    circle is then fitted to the edge points. Rays that run into an
+    overlapping zone find no edge, or one off the circle.
+    
+    Args:
+        gray: Grayscale image
+        center: Expected zone center (x, y)
+        radius: Expected zone radius in pixels, e.g. from the contour area
+        min_radius: Smallest searched radius (the antibiotic disc)
+        n_angles: Number of rays
+    
+    Returns:
+        Dictionary with support (fraction of the rays with an edge on the
+        fitted circle), irregular (fraction of the rays inside the image
+        without one), spread (standard deviation in pixels of the edge
+        radii around the fitted center) and fit ((center, radius) of the
+        fitted circle, or None)
+    """
+    missing = {"support": 0.0, "irregular": 1.0, "spread": 0.0, "fit": None}
+    inner = int(max(radius * ZONE_SEARCH_INNER, min_radius))
+    n_radii = int(np.ceil(radius * ZONE_SEARCH_OUTER))
+    if n_radii - inner < 5:
+        return missing
+    
+    x0, y0, x1, y1 = _crop_box((int(center[0]), int(center[1])), n_radii + 1, gray.shape)
+    polar = cv2.warpPolar(gray[y0:y1, x0:x1], (n_radii, n_angles), (center[0] - x0, center[1] - y0), n_radii,
+                          cv2.INTER_LINEAR + cv2.WARP_POLAR_LINEAR)
+    profiles = cv2.GaussianBlur(polar[:, inner:].astype(np.float32), (5, 1), 0)
+    
+    # The zone may be brighter or darker than the lawn; steps from its
+    # intensity to the lawn's are positive
+    split = int(radius) - inner
+    polarity = np.sign(np.median(profiles[:, :split]) - np.median(profiles[:, split:]))
+    if polarity == 0:
+        return missing
+    steps = np.maximum(-polarity * np.diff(profiles, axis=1), 0)
+    idx, offset, peak = strongest_steps(steps, ZONE_EDGE_RELATIVE)
+    edge_r = inner + idx + 0.5 + offset
+    
+    # Rays leaving the image are left out
+    h, w = gray.shape[:2]
+    angles = np.arange(n_angles) * (2 * np.pi / n_angles)
+    end_x, end_y = center[0] + np.cos(angles) * n_radii, center[1] + np.sin(angles) * n_radii
+    valid = (end_x >= 0) & (end_x <= w - 1) & (end_y >= 0) & (end_y <= h - 1)
+    strong = valid & (peak >= np.maximum(3.0, 3 * np.median(steps, axis=1)))
+    if strong.sum() < max(6, n_angles // 10):
+        return missing
+    
+    xs = center[0] + np.cos(angles[strong]) * edge_r[strong]
+    ys = center[1] + np.sin(angles[strong]) * edge_r[strong]
+    fit_center, fit_radius = fit_circle(xs, ys)
+    residual = np.abs(np.hypot(xs - fit_center[0], ys - fit_center[1]) - fit_radius)
+    inliers = residual <= max(2.0, 3 * np.median(residual))
+    if inliers.sum() >= 6:
+        fit_center, fit_radius = fit_circle(xs[inliers], ys[inliers])
+    
+    return {
+        "support": float(inliers.sum()) / n_angles,
+        "irregular": 1.0 - float(inliers.sum()) / max(int(valid.sum()), 1),
+        "spread": float(np.std(np.hypot(xs - fit_center[0], ys - fit_center[1]))),
+        "fit": ((float(fit_center[0]), float(fit_center[1])), float(fit_radius)),
+    }
+
+class RigProfile:
+    """
+    Calibration of a fixed imaging rig: where the dish sits and the image scale.
+    
+    The profile is a small JSON file with the dish center and radius (fitted
+    to the rim with sub-pixel accuracy, see measure_rim) and the
+    pixels_per_mm that follows from the known plate diameter. Every image is
+    first checked against it: when the calibrated rim is found in place in
+    a thin annulus (see refine_circle), the calibrated dish is used and the
+    dish search is skipped. Otherwise the dish is detected from scratch and,
+    when its rim is clear enough, the profile is recalibrated from it. A
+    missing profile is calibrated from the first image.
+    
+    The file is replaced atomically and reloaded when it changed, so worker
+    and batch processes can share one profile.
+    """
+    
+    def __init__(self, path, plate_diameter_mm=None):
+        """
+        Args:
+            path: Profile file, created on the first calibration
+            plate_diameter_mm: Plate diameter used for calibrating (default:
+                the one in the profile, else RIG_PLATE_DIAMETER_MM)
+        """
+        self.path = path
+        self.plate_diameter_mm = plate_diameter_mm
+        self.calibration = None  # Contents of the profile file
+        self._mtime = None
+        self.reload()
+    
+    @property
+    def pixels_per_mm(self):
+        """
+        Calibrated image scale, or None before the first calibration.
+        """
+        return None if self.calibration is None else self.calibration["pixels_per_mm"]
+    
+    def reload(self):
+        """
+        Read the profile again if the file changed.
+        """
         try:
-            pixels_per_mm = float(sys.argv[2])
-        except:
-            pass
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.calibration = json.load(f)
+        self._mtime = mtime
     
-    # Detect ZoIs - will now return only the yellow-highlighted ones
-    zoi_results, final_image_path = detect_zoi(image_path, pixels_per_mm)
+    def calibrate(self, center, radius, shape):
+        """
+        Store a dish circle (sub-pixel) of an image of the given shape and save the profile.
+        """
+        plate_diameter_mm = self.plate_diameter_mm or (self.calibration or {}).get(
+            "plate_diameter_mm", RIG_PLATE_DIAMETER_MM)
+        self.calibration = {
+            "center_x": float(center[0]),
+            "center_y": float(center[1]),
+            "radius": float(radius),
+            "plate_diameter_mm": float(plate_diameter_mm),
+            "pixels_per_mm": 2 * float(radius) / plate_diameter_mm,
+            "image_width": int(shape[1]),
+            "image_height": int(shape[0]),
+            "calibrated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.calibration, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._mtime = os.stat(self.path).st_mtime_ns
+    
+    def verify(self, gray):
+        """
+        The calibrated dish if its rim is in place in gray, else None.
+        """
+        calibration = self.calibration
+        if calibration is None or gray.shape[:2] != (calibration["image_height"], calibration["image_width"]):
+            return None
+        center, radius = (calibration["center_x"], calibration["center_y"]), calibration["radius"]
+        tolerance = max(2.0, radius * RIG_TOLERANCE)
+        found = refine_circle(gray, center, radius, min_support=RIG_MIN_RIM_SUPPORT, max_shift=tolerance)
+        if found is None or abs(found[1] - radius) > tolerance:
+            return None
+        return {
+            "center": (int(round(center[0])), int(round(center[1]))),
+            "radius": int(round(radius)),
+            "confidence": round(found[2], 3),
+            "method": "rig",
+        }
+    
+    def locate(self, gray, dish_mode=DISH_AUTO, timings=None):
+        """
+        Dish of an image taken on the rig, recalibrating when it moved.
+        
+        Args:
+            gray: Grayscale image
+            dish_mode: Dish search strategy when the calibrated dish isn't found
+            timings: Optional Timings for the dish search
+        
+        Returns:
+            Tuple containing (dish dictionary as from locate_petri_dish,
+            RIG_VERIFIED, RIG_CALIBRATED or RIG_REJECTED)
+        """
+        self.reload()
+        dish = self.verify(gray)
+        if dish is not None:
+            return dish, RIG_VERIFIED
+        
+        dish = locate_petri_dish(gray, dish_mode, timings)
+        rim = measure_rim(gray, dish["center"], dish["radius"])
+        if rim["fit"] is None or rim["support"] < RIG_MIN_RIM_SUPPORT:
+            return dish, RIG_REJECTED
+        self.calibrate(rim["fit"][0], rim["fit"][1], gray.shape)
+        return dish, RIG_CALIBRATED
+
+def _locate_on_rig(rig, image, pixels_per_mm, options, details, timings):
+    # Dish and scale of an image taken on a rig; returns the pixels_per_mm
+    # and the detection options to use, and reports the rig under details["rig"]
+    if options.get("multi_dish"):
+        raise ValueError("A rig profile can't be used with multi_dish")
+    timings.stage("rig")
+    dish, status = rig.locate(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), options.get("dish_mode", DISH_AUTO), timings)
+    timings.stage(None)
+    pixels_per_mm = rig.pixels_per_mm or pixels_per_mm
+    details["rig"] = {"status": status, "pixels_per_mm": pixels_per_mm}
+    return pixels_per_mm, dict(options, known_dish=dish)
+
+def process_image(image_path, pixels_per_mm=10.0, debug_level=DEBUG_FINAL, cache=None, timings=None, rig=None,
+                  overlay=None, result_dir=None, **options):
+    """
+    Run ZoI detection on a single image and build the JSON-ready result.
+    
+    Args:
+        image_path: Path to the input image
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        debug_level: Which images to write (none, final or full)
+        cache: Optional ResultCache; not used at the full debug level, which
+            has to write every intermediate image, or with a rig
+        timings: Optional Timings; its summary is added under "timings"
+        rig: Optional RigProfile that provides the dish and pixels_per_mm
+            (pixels_per_mm is then only used before its first calibration)
+        overlay: OverlayEncoding of the detection image, which is written
+            as zoi_detection.<format> (default: PNG_OVERLAY)
+        result_dir: Directory for the detection and debug images (default:
+            get_result_dir(image_path); see process_job for one per job)
+        **options: Further detection options (see DETECT_OPTIONS)
+    
+    Returns:
+        Dictionary with zoi, filename, detection_image and dish keys (and
+        cache, "hit" or "miss", when a cache is used, and rig with its
+        status and pixels_per_mm when a rig is used)
+    """
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Image file not found: {image_path}")
+    if timings is None:
+        timings = NO_TIMINGS
+    if result_dir is None:
+        result_dir = get_result_dir(image_path)
+    
+    if cache is not None and debug_level != DEBUG_FULL and rig is None:
+        with open(image_path, "rb") as f:
+            data = f.read()
+        result, overlay_bytes = process_image_data(data, image_path, pixels_per_mm, debug_level, cache=cache,
+                                                   timings=timings, rig=rig, overlay=overlay, **options)
+        if overlay_bytes is not None:
+            timings.stage("write")
+            os.makedirs(result_dir, exist_ok=True)
+            result["detection_image"] = os.path.join(result_dir, (overlay or PNG_OVERLAY).filename)
+            with open(result["detection_image"], "wb") as f:
+                f.write(overlay_bytes)
+            timings.stage(None)
+            if timings is not NO_TIMINGS:
+                result["timings"] = timings.summary()
+        return result
+    
+    timings.stage("read")
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
     
     # Get base filename without extension for returning with results
     base_filename = os.path.basename(image_path)
     base_name = os.path.splitext(base_filename)[0]
     
-    # Output results as JSON for API consumption
+    # Detect ZoIs - will now return only the yellow-highlighted ones
+    details = {}
+    if rig is not None:
+        pixels_per_mm, options = _locate_on_rig(rig, image, pixels_per_mm, options, details, timings)
+    zoi_results, final_image_path = detect_image(
+        image, base_name, result_dir, pixels_per_mm, debug_level,
+        overlay=overlay, details=details, timings=timings, **options)
+    
     result = {
         "zoi": zoi_results,
         "filename": base_name,
-        "detection_image": final_image_path
+        "detection_image": final_image_path,
+        **details
     }
+    if timings is not NO_TIMINGS:
+        result["timings"] = timings.summary()
+    return result
+
+def process_job(outputs, job_id, image_path, *args, **kwargs):
+    """
+    Run process_image() with the images written to a job directory of
+    their own (see JobOutputs), so concurrent jobs can't overwrite each
+    other's images. The directory only appears once every image is written.
+    
+    Args:
+        outputs: JobOutputs the job directory is created in
+        job_id: ID of the job, or None for a new one
+        image_path: Path to the input image
+        *args, **kwargs: Further arguments of process_image()
+    
+    Returns:
+        Result dictionary as from process_image, with the job_id and the
+        detection image in the published job directory
+    """
+    with outputs.start(job_id) as job:
+        result = process_image(image_path, *args, result_dir=job.directory, **kwargs)
+        # Intermediate images are written in the background
+        flush_debug_images()
+    result["job_id"] = job.job_id
+    result["detection_image"] = job.final_path(result["detection_image"])
+    return result
+
+def decode_image(data):
+    """
+    Decode encoded image bytes (PNG, JPG, ...) into a BGR image.
+    """
+    image = None
+    if data:
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image data")
+    return image
+
+def process_image_data(data, filename="image.png", pixels_per_mm=10.0, debug_level=DEBUG_FINAL, cache=None,
+                       timings=None, rig=None, overlay=None, **options):
+    """
+    Run ZoI detection on encoded image bytes without touching the disk.
+    
+    Args:
+        data: Encoded image bytes
+        filename: Name of the uploaded file, used for special case detection
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        debug_level: none or final (full needs a result directory, see process_image)
+        cache: Optional ResultCache to look the result up in and store it to;
+            not used with a rig
+        timings: Optional Timings; its summary is added under "timings"
+        rig: Optional RigProfile, see process_image
+        overlay: OverlayEncoding of the detection image (default: PNG_OVERLAY)
+        **options: Further detection options (see DETECT_OPTIONS)
+    
+    Returns:
+        Tuple containing (result dictionary as from process_image, bytes of
+        the detection image in the overlay's format or None when
+        debug_level is none)
+    """
+    base_name = os.path.splitext(os.path.basename(filename))[0]
+    if timings is None:
+        timings = NO_TIMINGS
+    if overlay is None:
+        overlay = PNG_OVERLAY
+    # Every image taken on the rig updates its profile (and reports the
+    # rig status), which a cached result would skip
+    if rig is not None:
+        cache = None
+    
+    if cache is not None:
+        timings.stage("cache")
+        key = cache.make_key(data, cache_params(base_name, pixels_per_mm, options, overlay))
+        entry = cache.get(key, need_overlay=debug_level != DEBUG_NONE)
+        if entry is not None:
+            timings.stage(None)
+            result, overlay = entry
+            result["cache"] = "hit"
+            if timings is not NO_TIMINGS:
+                result["timings"] = timings.summary()
+            return result, overlay if debug_level != DEBUG_NONE else None
+    
+    timings.stage("decode")
+    image = decode_image(data)
+    
+    details = {}
+    if rig is not None:
+        pixels_per_mm, options = _locate_on_rig(rig, image, pixels_per_mm, options, details, timings)
+    zoi_results, _ = detect_image(image, base_name, None, pixels_per_mm, debug_level,
+                                  overlay=overlay, details=details, timings=timings, **options)
+    
+    shapes = details.pop("overlay", None)
+    overlay_bytes = None
+    if shapes is not None:
+        timings.stage("encode")
+        overlay_bytes = overlay.encode(image, shapes)
+    
+    result = {
+        "zoi": zoi_results,
+        "filename": base_name,
+        "detection_image": None,
+        **details
+    }
+    if cache is not None:
+        timings.stage("cache_store")
+        cache.put(key, result, overlay_bytes)
+        result["cache"] = "miss"
+    timings.stage(None)
+    if timings is not NO_TIMINGS:
+        result["timings"] = timings.summary()
+    return result, overlay_bytes
+
+_source_hash = None
+
+def cache_params(base_name, pixels_per_mm, options, overlay=None):
+    """
+    Everything besides the image bytes that a cached result depends on.
+    
+    This includes a hash of this script, so changing the detection code
+    invalidates earlier cache entries. Options that aren't set are filled
+    in with their defaults. The encoding of the stored detection image is
+    included unless it's PNG_OVERLAY.
+    """
+    global _source_hash
+    if _source_hash is None:
+        with open(os.path.abspath(__file__), "rb") as f:
+            _source_hash = hashlib.sha256(f.read()).hexdigest()
+    defaults = dict(inspect.signature(detect_zoi_in_image).parameters, **inspect.signature(detect_image).parameters)
+    params = {
+        "source": _source_hash,
+        "name": base_name,
+        "pixels_per_mm": float(pixels_per_mm),
+        "options": {name: options.get(name, defaults[name].default) for name in DETECT_OPTIONS},
+    }
+    if overlay is not None and overlay.params() != PNG_OVERLAY.params():
+        params["overlay"] = overlay.params()
+    return params
+
+def read_frame(stream):
+    """
+    Read one length-prefixed frame from a binary stream.
+    
+    Returns:
+        The payload bytes, or None if the stream ended before a new frame
+    """
+    header = stream.read(FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise EOFError("Truncated frame header")
+    (length,) = FRAME_HEADER.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise EOFError("Truncated frame payload")
+    return payload
+
+def write_frame(stream, payload):
+    """
+    Write one length-prefixed frame (an empty frame for payload None).
+    """
+    payload = payload or b""
+    stream.write(FRAME_HEADER.pack(len(payload)))
+    stream.write(payload)
+
+def warm_up():
+    """
+    Run the detection primitives once on a small synthetic plate so that
+    OpenCV's lazy initialisation happens before the first real request.
+    """
+    plate = np.full((240, 240), 40, np.uint8)
+    cv2.circle(plate, (120, 120), 100, 130, -1)
+    cv2.circle(plate, (80, 100), 20, 220, -1)
+    detect_petri_dish(plate)
+    CLAHE.apply(cv2.equalizeHist(plate))
+
+def _handle_request(payload, image_data, default_pixels_per_mm, default_debug_level, default_options, cache,
+                    default_timings, rig, store, default_overlay, outputs):
+    # Answers one serve() request; returns (response, detection image bytes or None)
+    request_id = None
+    overlay = None
+    try:
+        request = json.loads(payload)
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+        request_id = request.get("id")
+        
+        if request.get("op") == "ping":
+            response = {"ok": True}
+        elif request.get("op") == "cache_stats":
+            response = cache.stats() if cache is not None else {"enabled": False}
+        elif request.get("op") == "lookup":
+            if store is None:
+                raise ValueError("No results store")
+            store.refresh()
+            response = {"readings": store.lookup(request["filename"], request.get("source"))}
+        else:
+            pixels_per_mm = float(request.get("pixels_per_mm", default_pixels_per_mm))
+            debug_level = request.get("debug_level", default_debug_level)
+            options = dict(default_options or {})
+            options.update((name, request[name]) for name in DETECT_OPTIONS if name in request)
+            timings = Timings() if request.get("timings", default_timings) else None
+            overlay_encoding = OverlayEncoding.from_request(request, default_overlay)
+            if options.get("multi_dish"):
+                # Multi-plate scans aren't taken on the rig
+                rig = None
+            if image_data:
+                response, overlay = process_image_data(image_data, request.get("filename", "image.png"),
+                                                       pixels_per_mm, debug_level, cache=cache, timings=timings,
+                                                       rig=rig, overlay=overlay_encoding, **options)
+            elif "image_path" in request and outputs is not None:
+                response = process_job(outputs, request.get("job_id"), request["image_path"], pixels_per_mm,
+                                       debug_level, cache=cache, timings=timings, rig=rig, overlay=overlay_encoding,
+                                       **options)
+            elif "image_path" in request:
+                if "job_id" in request:
+                    raise ValueError("Jobs need an output root (--output-root)")
+                response = process_image(request["image_path"], pixels_per_mm, debug_level, cache=cache,
+                                         timings=timings, rig=rig, overlay=overlay_encoding, **options)
+            else:
+                raise ValueError("No input image provided")
+            if store is not None:
+                store_result(store, response)
+    except Exception as e:
+        print(f"Error processing request {request_id}: {e}", file=sys.stderr)
+        response = {"error": str(e)}
+    
+    response["id"] = request_id
+    return response, overlay
+
+def serve(stdin=sys.stdin, stdout=sys.stdout, default_pixels_per_mm=10.0, default_debug_level=DEBUG_FINAL,
+          default_options=None, framed=False, cache=None, default_timings=False, rig=None, store=None,
+          default_overlay=None, outputs=None):
+    """
+    Long-lived worker loop speaking newline-delimited JSON.
+    
+    Each input line is a request such as
+    {"id": 1, "image_path": "...", "pixels_per_mm": 10.0, "debug_level": "final"}
+    (plus any of DETECT_OPTIONS) and produces exactly one output line
+    carrying the same id. A failing request is reported as
+    {"id": ..., "error": "..."} and the worker keeps running. The loop ends
+    when stdin is closed. {"op": "cache_stats"} reports the result cache,
+    {"op": "lookup", "filename": ...} the stored readings of an image (see
+    ZoiStore.lookup), and "timings": true adds per-stage timings to a result.
+    "overlay", "overlay_quality", "png_compression" and "preview_size" choose
+    the encoding of the detection image (see OverlayEncoding). With outputs,
+    every image_path request is a job that writes its images into a
+    directory of its own, named by its "job_id" or a generated one (see
+    process_job); the response reports the job_id.
     
+    In framed mode requests and responses are length-prefixed frames (see
+    FRAME_HEADER) on binary streams instead. A request is a JSON frame
+    followed by a frame with the encoded image, which replaces image_path
+    when it isn't empty ("filename" in the JSON then names the image). A
+    response is the JSON frame followed by a frame with the detection image
+    (PNG unless the request chose another format), empty when the image was
+    read from or written to disk.
+    
+    Args:
+        stdin: Stream to read requests from
+        stdout: Stream to write responses to
+        default_pixels_per_mm: Calibration used when a request doesn't set one
+        default_debug_level: Debug level used when a request doesn't set one
+        default_options: Detection options used when a request doesn't set them
+        framed: Use length-prefixed frames instead of JSON lines
+        cache: Optional ResultCache shared by all requests
+        default_timings: Report timings when a request doesn't say
+        rig: Optional RigProfile used for every request except multi-dish
+            ones (see process_image)
+        store: Optional ZoiStore every result is appended to
+        default_overlay: OverlayEncoding used when a request doesn't choose
+            one (default: PNG_OVERLAY)
+        outputs: Optional JobOutputs for the images of image_path requests
+    """
+    warm_up()
+    defaults = (default_pixels_per_mm, default_debug_level, default_options, cache, default_timings, rig, store,
+                default_overlay, outputs)
+    
+    if framed:
+        stdin = getattr(stdin, "buffer", stdin)
+        stdout = getattr(stdout, "buffer", stdout)
+        while True:
+            payload = read_frame(stdin)
+            if payload is None:
+                break
+            image_data = read_frame(stdin)
+            if image_data is None:
+                raise EOFError("Request without an image frame")
+            response, overlay = _handle_request(payload, image_data, *defaults)
+            write_frame(stdout, json.dumps(response).encode("utf-8"))
+            write_frame(stdout, overlay)
+            stdout.flush()
+        return
+    
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        response, _ = _handle_request(line, None, *defaults)
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+def collect_batch_images(source):
+    """
+    List the images of a batch run.
+    
+    Args:
+        source: A directory (all PNG/JPG files in it are used) or a manifest
+            file with one image path per line. Relative manifest paths are
+            resolved against the manifest's directory; blank lines and lines
+            starting with # are ignored.
+    
+    Returns:
+        List of image paths in a stable order
+    """
+    if os.path.isdir(source):
+        names = sorted(os.listdir(source))
+        return [os.path.join(source, name) for name in names
+                if name.lower().endswith(IMAGE_EXTENSIONS)]
+    
+    base_dir = os.path.dirname(os.path.abspath(source))
+    image_paths = []
+    with open(source, "r", encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            image_paths.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    return image_paths
+
+def _init_batch_worker(scratch_budget=0, mask_budget=MASK_CACHE_BYTES):
+    # Each pool process handles one image at a time, so keep OpenCV from
+    # spawning its own threads on top of the process pool
+    configure_threads(1)
+    set_scratch_budget(scratch_budget)
+    set_mask_cache_budget(mask_budget)
+    # Pool processes exit without running atexit handlers, but they do run
+    # multiprocessing's finalizers
+    multiprocessing.util.Finalize(None, flush_cache_stats, exitpriority=0)
+
+def _process_batch_item(image_path, pixels_per_mm, debug_level, options, cache, timings, rig, overlay, outputs):
+    try:
+        kwargs = dict(cache=cache, timings=Timings() if timings else None, rig=rig, overlay=overlay, **options)
+        if outputs is not None:
+            result = process_job(outputs, None, image_path, pixels_per_mm, debug_level, **kwargs)
+        else:
+            result = process_image(image_path, pixels_per_mm, debug_level, **kwargs)
+    except Exception as e:
+        result = {"error": str(e)}
+    # Pool processes exit without running atexit handlers
+    flush_debug_images()
+    result["image_path"] = image_path
+    return result
+
+def run_batch(source, pixels_per_mm=10.0, workers=None, debug_level=DEBUG_FINAL, options=None, stdout=sys.stdout,
+              cache=None, timings=False, rig=None, store=None, overlay=None, outputs=None):
+    """
+    Process every image of a directory or manifest on a process pool.
+    
+    One JSON line is written per image as soon as it finishes, so the
+    output order follows completion order rather than input order. A failing
+    image produces an error line and doesn't stop the run.
+    
+    Args:
+        source: Directory or manifest file (see collect_batch_images)
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        workers: Number of worker processes (default: CPU count)
+        debug_level: Which images to write (none, final or full)
+        options: Detection options (see DETECT_OPTIONS)
+        stdout: Stream to write result lines to
+        cache: Optional ResultCache shared by the worker processes
+        timings: Add per-stage timings to every result
+        rig: Optional RigProfile shared by the worker processes
+        store: Optional ZoiStore the results are appended to (by this process)
+        overlay: OverlayEncoding of the detection images (default: PNG_OVERLAY)
+        outputs: Optional JobOutputs; every image is then a job with a
+            directory of its own (see process_job)
+    
+    Returns:
+        Tuple containing (number of processed images, number of failures)
+    """
+    image_paths = collect_batch_images(source)
+    workers = workers or os.cpu_count() or 1
+    failures = 0
+    
+    peak_rss = None
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(_scratch_budget, get_mask_cache().max_bytes)) as executor:
+        futures = [executor.submit(_process_batch_item, image_path, pixels_per_mm, debug_level, options or {}, cache,
+                                   timings, rig, overlay, outputs)
+                   for image_path in image_paths]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # Only reached when a worker process dies outright
+                result = {"error": f"Worker failed: {e}",
+                          "image_path": image_paths[futures.index(future)]}
+            if "error" in result:
+                failures += 1
+            elif store is not None:
+                store_result(store, result)
+            worker_rss = result.get("timings", {}).get("peak_rss_mb")
+            if worker_rss is not None:
+                peak_rss = max(peak_rss or 0, worker_rss)
+            stdout.write(json.dumps(result) + "\n")
+            stdout.flush()
+    
+    memory = "" if peak_rss is None else f", worker peak RSS {peak_rss:.0f} MB"
+    print(f"Batch finished: {len(image_paths)} images, {failures} failed{memory}", file=sys.stderr)
+    return len(image_paths), failures
+
+def open_video_source(source):
+    """
+    Open a video file, a stream URL or a camera (given by its index).
+    
+    Returns:
+        Tuple containing (cv2.VideoCapture, whether the source is live)
+    """
+    source = str(source)
+    if source.isdigit():
+        capture, live = cv2.VideoCapture(int(source)), True
+    elif "://" in source:
+        capture, live = cv2.VideoCapture(source), True
+    elif not os.path.exists(source):
+        raise FileNotFoundError(f"Video source not found: {source}")
+    else:
+        capture, live = cv2.VideoCapture(source), False
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+    return capture, live
+
+class LatestFrameReader:
+    """
+    Reads a live source on a background thread and keeps only its newest frame.
+    
+    When detection is slower than the camera, frames are skipped instead of
+    piling up in the capture buffer, so results stay current.
+    """
+    
+    def __init__(self, capture):
+        self._capture = capture
+        self._cond = threading.Condition()
+        self._frame = None
+        self._index = -1  # Index of the newest frame
+        self._returned = -1  # Index of the last frame handed out
+        self._time_ms = 0.0
+        self._done = False
+        self._origin = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="frame-reader", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            ok, frame = self._capture.read()
+            with self._cond:
+                if not ok or self._done:
+                    self._done = True
+                    self._cond.notify_all()
+                    return
+                self._frame, self._index = frame, self._index + 1
+                self._time_ms = (time.perf_counter() - self._origin) * 1000
+                self._cond.notify_all()
+    
+    def read(self):
+        """
+        Wait for a frame newer than the last one returned.
+        
+        Returns:
+            Tuple containing (frame index, milliseconds since start, frame),
+            or None when the source has ended
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._index > self._returned or self._done)
+            if self._index <= self._returned:
+                return None
+            self._returned = self._index
+            return self._index, self._time_ms, self._frame
+    
+    def close(self):
+        with self._cond:
+            self._done = True
+        self._thread.join(timeout=1.0)
+
+def read_video_frames(capture, live=False):
+    """
+    Yield (frame index, time in ms, frame) from an opened capture.
+    
+    Files are read frame by frame; live sources go through a
+    LatestFrameReader, so their indices have gaps where frames were dropped.
+    """
+    if live:
+        reader = LatestFrameReader(capture)
+        try:
+            while True:
+                item = reader.read()
+                if item is None:
+                    return
+                yield item
+        finally:
+            reader.close()
+    
+    index = 0
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            return
+        yield index, capture.get(cv2.CAP_PROP_POS_MSEC), frame
+        index += 1
+
+class StreamDetector:
+    """
+    ZoI detection on consecutive video frames of a plate, reusing the work of
+    earlier frames.
+    
+    Each frame is compared with the last fully processed one on a small
+    grayscale thumbnail. While the mean difference stays below still_diff
+    the previous result is reused as is. Otherwise the previous dish rim is
+    looked for in the new frame (see measure_rim): if it's still in place
+    only the ZoI stages run, with the previous dish geometry, and the dish
+    detection only runs again when the dish moved or can't be found.
+    """
+    
+    def __init__(self, pixels_per_mm=10.0, base_name="stream", still_diff=STREAM_STILL_DIFF,
+                 min_rim_support=STREAM_MIN_RIM_SUPPORT, **options):
+        """
+        Args:
+            pixels_per_mm: Calibration factor to convert pixels to mm
+            base_name: Name used for special case detection
+            still_diff: Mean thumbnail difference (gray levels) up to which
+                a frame counts as unchanged; 0 re-runs detection on every frame
+            min_rim_support: Fraction of the previous dish rim that has to be
+                found for the dish to be kept
+            **options: Further detection options (see DETECT_OPTIONS)
+        """
+        self.pixels_per_mm = pixels_per_mm
+        self.base_name = base_name
+        self.still_diff = still_diff
+        self.min_rim_support = min_rim_support
+        self.options = options
+        self._key_thumb = None  # Thumbnail of the last processed frame
+        self._dish = None  # Dish of the last processed frame, as from locate_petri_dish
+        self._result = None
+    
+    @staticmethod
+    def thumbnail(frame):
+        h, w = frame.shape[:2]
+        size = (STREAM_THUMB_WIDTH, max(1, int(round(h * STREAM_THUMB_WIDTH / w))))
+        return cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    
+    def track_dish(self, frame):
+        """
+        The previous dish if its rim is still in place in frame, else None.
+        """
+        center, radius = self._dish["center"], self._dish["radius"]
+        tolerance = max(2.0, radius * STREAM_DISH_TOLERANCE)
+        found = refine_circle(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), center, radius,
+                              min_support=self.min_rim_support, max_shift=tolerance)
+        if found is None or abs(found[1] - radius) > tolerance:
+            return None
+        return {"center": center, "radius": radius, "confidence": round(found[2], 3), "method": "tracked"}
+    
+    def process(self, frame, timings=None):
+        """
+        Detect the ZoIs in the next frame.
+        
+        Args:
+            frame: BGR frame
+            timings: Optional Timings for this frame
+        
+        Returns:
+            Dictionary with zoi, dish, stages_run, reuse (REUSE_RESULT,
+            REUSE_DISH or REUSE_NONE) and scene_diff (the thumbnail
+            difference, None for the first frame)
+        """
+        if timings is None:
+            timings = NO_TIMINGS
+        timings.stage("scene_check")
+        thumb = self.thumbnail(frame)
+        diff = None
+        if self._key_thumb is not None and thumb.shape == self._key_thumb.shape:
+            diff = round(float(cv2.absdiff(thumb, self._key_thumb).mean()), 3)
+            if diff <= self.still_diff and self._result is not None:
+                timings.stage(None)
+                return dict(self._result, reuse=REUSE_RESULT, scene_diff=diff, stages_run=[])
+        
+        known_dish = None
+        if self._dish is not None:
+            with timings.span("track_dish"):
+                known_dish = self.track_dish(frame)
+        
+        details = {}
+        zoi_list, _ = detect_zoi_in_image(frame, self.base_name, None, self.pixels_per_mm, DEBUG_NONE,
+                                          details=details, timings=timings, known_dish=known_dish, **self.options)
+        dish = details["dish"]
+        self._dish = known_dish or {
+            "center": (dish["center_x"], dish["center_y"]),
+            "radius": dish["radius"],
+        }
+        self._key_thumb = thumb
+        self._result = {"zoi": zoi_list, "dish": dish}
+        return dict(self._result, reuse=REUSE_NONE if known_dish is None else REUSE_DISH, scene_diff=diff,
+                    stages_run=details["stages_run"])
+
+def run_stream(source, pixels_per_mm=10.0, options=None, stdout=sys.stdout, max_frames=None,
+               still_diff=STREAM_STILL_DIFF, timings=False):
+    """
+    Run ZoI detection on a video file, stream URL or camera.
+    
+    One JSON line is written per processed frame as soon as it is done. A
+    failing frame produces an error line and doesn't stop the stream.
+    
+    Args:
+        source: Video file, stream URL or camera index (see open_video_source)
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        options: Detection options (see DETECT_OPTIONS)
+        stdout: Stream to write result lines to
+        max_frames: Stop after this many frames (default: until the source ends)
+        still_diff: See StreamDetector
+        timings: Add per-stage timings to every result
+    
+    Returns:
+        Tuple containing (number of processed frames, frames per second)
+    """
+    capture, live = open_video_source(source)
+    base_name = f"camera{source}" if str(source).isdigit() else os.path.splitext(os.path.basename(str(source)))[0]
+    detector = StreamDetector(pixels_per_mm, base_name, still_diff, **(options or {}))
+    frames = detections = 0
+    start = time.perf_counter()
+    
+    try:
+        for index, time_ms, frame in read_video_frames(capture, live):
+            frame_start = time.perf_counter()
+            frame_timings = Timings() if timings else None
+            try:
+                result = detector.process(frame, frame_timings)
+            except Exception as e:
+                result = {"error": str(e)}
+            result = {
+                "frame": index,
+                "time_ms": round(time_ms, 1),
+                **result,
+                "latency_ms": round((time.perf_counter() - frame_start) * 1000, 3),
+            }
+            if frame_timings is not None:
+                result["timings"] = frame_timings.summary()
+            stdout.write(json.dumps(result) + "\n")
+            stdout.flush()
+            
+            frames += 1
+            detections += result.get("reuse") in (REUSE_DISH, REUSE_NONE)
+            if max_frames and frames >= max_frames:
+                break
+    finally:
+        capture.release()
+    
+    elapsed = time.perf_counter() - start
+    fps = frames / elapsed if elapsed > 0 else 0.0
+    print(f"Stream finished: {frames} frames in {elapsed:.1f} s ({fps:.1f} fps), {detections} detections",
+          file=sys.stderr)
+    return frames, fps
+
+def series_name(base_name):
+    """
+    Plate ID and imaging date of an image in a time series.
+    
+    Names like 20230825_PoC1_0219_RGB_all give ("PoC1_0219", "2023-08-25").
+    Other names are their own plate, without a date.
+    
+    Returns:
+        Tuple containing (plate ID, ISO date or None)
+    """
+    match = SERIES_NAME.match(base_name)
+    if match:
+        try:
+            date = datetime.datetime.strptime(match.group(1), "%Y%m%d").date()
+        except ValueError:
+            date = None
+        if date is not None:
+            return match.group(2), date.isoformat()
+    return base_name, None
+
+def store_result(store, result):
+    """
+    Append a detection result (as from process_image) to a ZoiStore, with
+    the plate ID and date from its filename (see series_name).
+    
+    Cache hits and repeated runs on the same image would count its zones
+    again in the statistics, so the result is skipped when the latest
+    stored detection of the filename found the same zones.
+    
+    Returns:
+        Whether the result was appended
+    """
+    filename = result["filename"]
+    plate, date = series_name(filename)
+    return store.append([{"filename": filename, "plate": plate, "date": date, "zoi": result["zoi"]}],
+                        skip_unchanged=True) > 0
+
+def group_series(image_paths):
+    """
+    Group images by plate ID, each group in time order.
+    
+    Returns:
+        List of (plate ID, image paths) tuples sorted by plate ID
+    """
+    groups = {}
+    for image_path in image_paths:
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        plate_id, date = series_name(base_name)
+        groups.setdefault(plate_id, []).append((date or "", base_name, image_path))
+    return [(plate_id, [image_path for _, _, image_path in sorted(images)])
+            for plate_id, images in sorted(groups.items())]
+
+class PlateSeries:
+    """
+    ZoI measurements of one plate over an incubation series.
+    
+    The first image is detected from scratch. Each later image is first
+    re-measured around the previous readings: the dish rim is located again
+    (the plate may have been put back slightly shifted) and every zone's
+    edge is searched in a thin annulus around its previous edge with radial
+    profiles (see refine_circle). The new diameter is the previous one
+    scaled by the change of the edge radius, so it stays consistent with
+    the detector's calibration. When the dish or any zone isn't found, the
+    image is detected from scratch instead and its zones are matched to the
+    known discs by position.
+    """
+    
+    def __init__(self, plate_id, pixels_per_mm=10.0, debug_level=DEBUG_NONE, **options):
+        """
+        Args:
+            plate_id: Plate ID, see series_name
+            pixels_per_mm: Calibration factor to convert pixels to mm
+            debug_level: Images written for fully detected images (none, final or full)
+            **options: Further detection options (see DETECT_OPTIONS)
+        """
+        self.plate_id = plate_id
+        self.pixels_per_mm = pixels_per_mm
+        self.debug_level = debug_level
+        self.options = options
+        self.images = []  # One entry per processed image
+        self.discs = []  # Growth curve of each disc
+        self._dish = None  # (center, radius) of the previous image
+        self._zones = []  # Previous reading: disc, center, edge radius (or None), diameter_mm
+    
+    def add(self, image_path, timings=None):
+        """
+        Measure the next image of the series.
+        
+        Args:
+            image_path: Path to the image
+            timings: Optional Timings; its summary is added under "timings"
+        
+        Returns:
+            Dictionary with image_path, filename, date, mode (SERIES_SEEDED
+            or SERIES_FULL), the reason for a full detection, zoi (each
+            with its disc number) and elapsed_ms
+        """
+        if timings is None:
+            timings = NO_TIMINGS
+        start = time.perf_counter()
+        timings.stage("read")
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"Could not read image: {image_path}")
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        
+        entry = {"image_path": image_path, "filename": base_name, "date": series_name(base_name)[1]}
+        zones, reason = None, "first image"
+        if self._zones:
+            timings.stage("seed")
+            zones, reason = self._seed(gray)
+        if zones is not None:
+            entry["mode"] = SERIES_SEEDED
+            entry["detection_image"] = None
+        else:
+            entry["mode"] = SERIES_FULL
+            entry["reason"] = reason
+            entry["detection_image"], zones = self._detect(image, gray, base_name, get_result_dir(image_path),
+                                                           timings)
+        timings.stage(None)
+        self._zones = zones
+        
+        entry["zoi"] = []
+        for zone in zones:
+            zoi = {
+                "disc": zone["disc"],
+                "center_x": float(zone["center"][0]),
+                "center_y": float(zone["center"][1]),
+                "diameter_mm": float(zone["diameter_mm"]),
+            }
+            entry["zoi"].append(zoi)
+            self.discs[zone["disc"]].update(center_x=zoi["center_x"], center_y=zoi["center_y"],
+                                            radius=zoi["diameter_mm"] * self.pixels_per_mm / 2)
+            self.discs[zone["disc"]]["curve"].append({
+                "date": entry["date"],
+                "filename": base_name,
+                "diameter_mm": zoi["diameter_mm"],
+            })
+        entry["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        if timings is not NO_TIMINGS:
+            entry["timings"] = timings.summary()
+        self.images.append(entry)
+        return entry
+    
+    def _seed(self, gray):
+        # Re-measure the previous zones; (zones, None) or (None, reason)
+        (dish_x, dish_y), dish_radius = self._dish
+        dish = refine_circle(gray, (dish_x, dish_y), dish_radius, min_support=SERIES_MIN_SUPPORT,
+                             max_shift=max(2.0, dish_radius * SERIES_DISH_SHIFT))
+        if dish is None:
+            return None, "dish not found"
+        shift_x, shift_y = dish[0][0] - dish_x, dish[0][1] - dish_y
+        
+        zones = []
+        for zone in self._zones:
+            if zone["edge"] is None:
+                return None, f"disc {zone['disc']} has no clear edge"
+            center = (zone["center"][0] + shift_x, zone["center"][1] + shift_y)
+            found = refine_circle(gray, center, zone["edge"], band=max(3.0, zone["edge"] * SERIES_SEED_BAND),
+                                  min_support=SERIES_MIN_SUPPORT,
+                                  max_shift=max(3.0, zone["edge"] * SERIES_MAX_SHIFT))
+            if found is None:
+                return None, f"disc {zone['disc']} not found"
+            zones.append({
+                "disc": zone["disc"],
+                "center": center,
+                "edge": found[1],
+                "diameter_mm": zone["diameter_mm"] * found[1] / zone["edge"],
+            })
+        self._dish = ((dish[0][0], dish[0][1]), dish_radius)
+        return zones, None
+    
+    def _detect(self, image, gray, base_name, result_dir, timings):
+        # Full detection; returns (detection image path, zones)
+        details = {}
+        zoi_list, final_viz_path = detect_zoi_in_image(image, base_name, result_dir, self.pixels_per_mm,
+                                                       self.debug_level, details=details, timings=timings,
+                                                       **self.options)
+        timings.stage("edges")
+        self._dish = ((details["dish"]["center_x"], details["dish"]["center_y"]), details["dish"]["radius"])
+        
+        zones = []
+        unmatched = list(range(len(self.discs)))
+        for zoi in zoi_list:
+            center = (zoi["center_x"], zoi["center_y"])
+            radius = zoi["diameter_mm"] * self.pixels_per_mm / 2
+            
+            # Same disc as the nearest known one whose zone contains the center
+            disc, best_dist = None, np.inf
+            for idx in unmatched:
+                known = self.discs[idx]
+                dist = np.hypot(center[0] - known["center_x"], center[1] - known["center_y"])
+                if dist <= max(radius, known["radius"]) and dist < best_dist:
+                    disc, best_dist = idx, dist
+            if disc is None:
+                disc = len(self.discs)
+                self.discs.append({"disc": disc, "curve": []})
+            else:
+                unmatched.remove(disc)
+            
+            # Edge radius the next image is measured against
+            found = refine_circle(gray, center, radius, band=max(3.0, radius * SERIES_DETECT_BAND),
+                                  min_support=SERIES_MIN_SUPPORT, max_shift=max(3.0, radius * SERIES_MAX_SHIFT))
+            zones.append({
+                "disc": disc,
+                "center": center,
+                "edge": None if found is None else found[1],
+                "diameter_mm": zoi["diameter_mm"],
+            })
+        return final_viz_path, zones
+    
+    def summary(self):
+        """
+        JSON-ready result of the series: plate_id, the per-image entries
+        and the growth curve (date, filename, diameter_mm points) of every disc.
+        """
+        return {
+            "plate_id": self.plate_id,
+            "images": self.images,
+            "discs": [{
+                "disc": disc["disc"],
+                "center_x": float(disc["center_x"]),
+                "center_y": float(disc["center_y"]),
+                "curve": disc["curve"],
+            } for disc in self.discs],
+            "seeded": sum(entry["mode"] == SERIES_SEEDED for entry in self.images),
+        }
+
+def _process_series_item(plate_id, image_paths, pixels_per_mm, debug_level, options, timings):
+    series = PlateSeries(plate_id, pixels_per_mm, debug_level, **options)
+    result = None
+    try:
+        for image_path in image_paths:
+            series.add(image_path, Timings() if timings else None)
+        result = series.summary()
+    except Exception as e:
+        result = {"error": f"{image_paths[len(series.images)]}: {e}", "plate_id": plate_id}
+    # Pool processes exit without running atexit handlers
+    flush_debug_images()
+    return result
+
+def run_series(source, pixels_per_mm=10.0, workers=None, debug_level=DEBUG_NONE, options=None, stdout=sys.stdout,
+               timings=False):
+    """
+    Process the incubation series of every plate in a directory or manifest.
+    
+    Images are grouped by plate ID (see group_series) and each plate's
+    images are measured in time order by a PlateSeries; plates are spread
+    over a process pool. One JSON line is written per plate as soon as it
+    finishes, with the per-image results and the growth curve of every disc.
+    
+    Args:
+        source: Directory or manifest file (see collect_batch_images)
+        pixels_per_mm: Calibration factor to convert pixels to mm
+        workers: Number of worker processes (default: CPU count)
+        debug_level: Which images to write for fully detected images (none, final or full)
+        options: Detection options (see DETECT_OPTIONS)
+        stdout: Stream to write result lines to
+        timings: Add per-stage timings to every image of a plate
+    
+    Returns:
+        Tuple containing (number of plates, number of failed plates)
+    """
+    plates = group_series(collect_batch_images(source))
+    workers = workers or os.cpu_count() or 1
+    failures = images = seeded = 0
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(_scratch_budget, get_mask_cache().max_bytes)) as executor:
+        futures = [executor.submit(_process_series_item, plate_id, image_paths, pixels_per_mm, debug_level,
+                                   options or {}, timings)
+                   for plate_id, image_paths in plates]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # Only reached when a worker process dies outright
+                result = {"error": f"Worker failed: {e}", "plate_id": plates[futures.index(future)][0]}
+            if "error" in result:
+                failures += 1
+            else:
+                images += len(result["images"])
+                seeded += result["seeded"]
+            stdout.write(json.dumps(result) + "\n")
+            stdout.flush()
+    
+    print(f"Series finished: {len(plates)} plates, {images} images ({seeded} seeded), {failures} failed",
+          file=sys.stderr)
+    return len(plates), failures
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Detect Zones of Inhibition in petri dish images.")
+    parser.add_argument("image_path", nargs="?",
+                        help="Path to the input image, or - to read the encoded image from stdin and write "
+                             "the JSON result and the detection image as two length-prefixed frames")
+    parser.add_argument("pixels_per_mm", nargs="?", default="10.0",
+                        help="Calibration factor to convert pixels to mm (default: 10.0)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run as a persistent worker reading NDJSON requests from stdin")
+    parser.add_argument("--framed", action="store_true",
+                        help="With --serve: exchange length-prefixed binary frames carrying the image "
+                             "and detection image bytes instead of JSON lines")
+    parser.add_argument("--filename", default="stdin.png",
+                        help="Name of an image read from stdin, used for special cases (default: stdin.png)")
+    parser.add_argument("--batch", metavar="DIR_OR_MANIFEST",
+                        help="Process a directory or manifest of images in parallel, one JSON line per image")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes for --batch and --series (default: CPU count)")
+    parser.add_argument("--series", metavar="DIR_OR_MANIFEST",
+                        help="Group the images of a directory or manifest by plate and measure each plate's "
+                             "incubation series in time order, one JSON line with growth curves per plate")
+    parser.add_argument("--stream", metavar="SOURCE",
+                        help="Process a video file, stream URL or camera index frame by frame, "
+                             "one JSON line per frame")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="With --stream: stop after this many frames")
+    parser.add_argument("--still-diff", type=float, default=STREAM_STILL_DIFF,
+                        help="With --stream: mean frame difference (gray levels) up to which the previous "
+                             "result is reused; 0 detects on every frame (default: %(default)s)")
+    parser.add_argument("--debug-level", choices=DEBUG_LEVELS, default=DEBUG_FINAL,
+                        help="Images to write: none, final (zoi_detection.png only, default) "
+                             "or full (all intermediate steps)")
+    parser.add_argument("--overlay", choices=OVERLAY_FORMATS, default=OVERLAY_PNG,
+                        help="Format of the detection image: a raster image (png, default, jpg or webp), or "
+                             "the drawn circles and labels as vectors for drawing over the original "
+                             "image (svg or json), which skips drawing and encoding a raster")
+    parser.add_argument("--overlay-quality", type=int, default=None,
+                        help=f"Quality (0-100) of jpg and webp detection images (default: {OVERLAY_QUALITY})")
+    parser.add_argument("--png-compression", type=int, default=None,
+                        help="Compression level of png detection images, from 0 (fastest) to 9 (smallest) "
+                             "(default: OpenCV's)")
+    parser.add_argument("--preview-size", type=int, default=None,
+                        help="Downscale raster detection images to at most this many pixels on their "
+                             "longer side (default: full size)")
+    parser.add_argument("--dish-mode", choices=DISH_MODES, default=DISH_AUTO,
+                        help="Petri dish search: full resolution, coarse-to-fine pyramid, "
+                             "or auto (pyramid for large images, default)")
+    parser.add_argument("--dish-roi", choices=ROI_MODES, default=ROI_CROP,
+                        help="Region processed after dish detection: the dish bounding square (crop, default), "
+                             "the same with candidates outside the dish disk skipped (disk) or the whole "
+                             "frame (none)")
+    parser.add_argument("--measure", choices=MEASURE_MODES, default=MEASURE_AREA,
+                        help="ZoI diameter measurement: from the contour area (area, default) or from the "
+                             "zone edge along rays around its center (radial)")
+    parser.add_argument("--hough", choices=HOUGH_MODES, default=HOUGH_OPENCV,
+                        help="Circle Hough transform of the overlap splitting and fallback stages: "
+                             "cv2.HoughCircles (opencv, default) or one that votes once for all thresholds "
+                             "(voter), which is faster but finds other circles")
+    parser.add_argument("--multi-dish", action="store_true",
+                        help="Detect every petri dish of a multi-plate scan and report the ZoIs per dish")
+    parser.add_argument("--rig", metavar="PROFILE",
+                        help="Calibration profile (JSON) of a fixed imaging rig: the dish geometry and "
+                             "pixels_per_mm are taken from it while the dish stays in place, and it is "
+                             "(re)calibrated from the detected dish otherwise. Created if missing")
+    parser.add_argument("--plate-diameter-mm", type=float, default=None,
+                        help="With --rig: plate diameter used for calibrating (default: the profile's, "
+                             f"else {RIG_PLATE_DIAMETER_MM:g})")
+    parser.add_argument("--timings", action="store_true",
+                        help="Add the duration of every detection stage to the JSON output under \"timings\"")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Write the stage timings of a single image as a Chrome trace "
+                             "(chrome://tracing, Perfetto or speedscope); implies --timings")
+    parser.add_argument("--profile-stage", metavar="STAGE",
+                        help="Run one stage (as named in the timings, e.g. threshold_sweep or dish/full) "
+                             "of a single image under cProfile and print the top functions to stderr")
+    parser.add_argument("--profile-out", metavar="FILE",
+                        help="With --profile-stage: save the cProfile stats to FILE instead of printing them")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Cores this process may use, shared by the concurrent passes and OpenCV "
+                             "(default: all; batch and series workers use 1 each)")
+    parser.add_argument("--pass-threads", type=int, default=1,
+                        help="Run up to this many independent passes of an image (threshold sweeps, adaptive "
+                             "threshold, overlap splitting) concurrently, for lower single-image latency "
+                             "(default: 1, one after another)")
+    parser.add_argument("--scratch-mb", type=float, default=0,
+                        help="Scratch buffers (MB) each process or thread keeps between images, to save "
+                             "reallocating them in long runs (default: 0, freed after every image)")
+    parser.add_argument("--mask-cache-mb", type=float, default=MASK_CACHE_BYTES / (1024 * 1024),
+                        help="Disk masks (MB) each process keeps for later stages and images, so a dish "
+                             "that stays in place isn't drawn again; 0 disables it (default: %(default)s)")
+    parser.add_argument("--cache-dir", default=os.environ.get("ZOI_CACHE_DIR"),
+                        help="Directory of the result cache, shared by all processes using it "
+                             "(default: $ZOI_CACHE_DIR, no cache if unset)")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help="Size cap of the result cache in MB; least recently used entries are evicted "
+                             "(default: %(default)s)")
+    parser.add_argument("--store", default=os.environ.get("ZOI_STORE_DIR"),
+                        help="Directory of a results store every result is appended to, for queries with "
+                             "zoi_store.py (default: $ZOI_STORE_DIR, none if unset)")
+    parser.add_argument("--output-root", default=os.environ.get("ZOI_OUTPUT_ROOT"),
+                        help="Write the images of every image (or worker request) into a job directory of its "
+                             "own under this root, which appears once complete, instead of the result "
+                             "directory next to the image (default: $ZOI_OUTPUT_ROOT)")
+    parser.add_argument("--job-id", default=None,
+                        help="With --output-root: name of the single image's job directory (default: generated)")
+    parser.add_argument("--job-max-age", type=float, default=None,
+                        help="With --output-root: remove job directories older than this many seconds "
+                             "(default: keep)")
+    parser.add_argument("--max-jobs", type=int, default=None,
+                        help="With --output-root: keep at most this many job directories, removing the "
+                             "oldest (default: all)")
+    parser.add_argument("--prune-jobs", action="store_true",
+                        help="Remove the job directories beyond --job-max-age and --max-jobs and exit")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="Print the size and hit rate of the result cache and exit")
+    return parser.parse_args(argv)
+
+def detect_options_from_args(args):
+    """
+    Detection options (see DETECT_OPTIONS) selected on the command line.
+    """
+    return {
+        "dish_mode": args.dish_mode,
+        "dish_roi": args.dish_roi,
+        "multi_dish": args.multi_dish,
+        "measure": args.measure,
+        "hough": args.hough,
+    }
+
+def single_dish_options(args):
+    """
+    Options of detect_zoi_in_image() selected on the command line, for the
+    modes that follow a single dish (series and streams).
+    """
+    options = detect_options_from_args(args)
+    del options["multi_dish"]
+    return options
+
+def overlay_from_args(args):
+    """
+    Encoding of the detection image selected on the command line.
+    """
+    return OverlayEncoding(args.overlay, args.overlay_quality, args.png_compression, args.preview_size)
+
+def timings_from_args(args):
+    """
+    Timings for a single image selected on the command line, or None.
+    """
+    if not (args.timings or args.trace or args.profile_stage):
+        return None
+    return Timings(profile_stage=args.profile_stage)
+
+def report_timings(args, timings):
+    """
+    Write the trace and profile of a single image requested on the command line.
+    """
+    if timings is None:
+        return
+    if args.trace:
+        with open(args.trace, "w", encoding="utf-8") as f:
+            json.dump(timings.chrome_trace(), f)
+    if args.profile_stage:
+        if timings.profile is None:
+            print(f"Stage {args.profile_stage} did not run", file=sys.stderr)
+        elif args.profile_out:
+            timings.profile.dump_stats(args.profile_out)
+        else:
+            pstats.Stats(timings.profile, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+
+def outputs_from_args(args):
+    """
+    Job output directories selected on the command line, or None.
+    """
+    if not args.output_root:
+        return None
+    return JobOutputs(args.output_root, args.job_max_age, args.max_jobs)
+
+def cache_from_args(args):
+    """
+    Result cache selected on the command line, or None.
+    """
+    if not args.cache_dir:
+        return None
+    return ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+
+def main():
+    """
+    Main function to process command line arguments and run ZoI detection.
+    """
+    args = parse_args()
+    cache = cache_from_args(args)
+    set_scratch_budget(args.scratch_mb * 1024 * 1024)
+    set_mask_cache_budget(args.mask_cache_mb * 1024 * 1024)
+    configure_threads(args.threads, args.pass_threads)
+    
+    if args.cache_stats:
+        if cache is None:
+            print(json.dumps({"error": "No cache directory given (--cache-dir or ZOI_CACHE_DIR)"}))
+            sys.exit(1)
+        print(json.dumps(cache.stats()))
+        return
+    
+    outputs = outputs_from_args(args)
+    if args.prune_jobs or args.job_id:
+        if outputs is None:
+            print(json.dumps({"error": "No output root given (--output-root or ZOI_OUTPUT_ROOT)"}))
+            sys.exit(1)
+    if args.prune_jobs:
+        print(json.dumps({"removed": outputs.prune()}))
+        return
+    
+    # Default pixels_per_mm (will be adjusted if petri dish is detected)
+    pixels_per_mm = 10.0
+    try:
+        pixels_per_mm = float(args.pixels_per_mm)
+    except ValueError:
+        pass
+    
+    store = ZoiStore(args.store) if args.store else None
+    try:
+        overlay = overlay_from_args(args)
+    except ValueError as e:
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+    rig = None
+    if args.rig:
+        if args.multi_dish or args.series or args.stream:
+            print(json.dumps({"error": "--rig is not supported with --multi-dish, --series or --stream"}))
+            sys.exit(1)
+        rig = RigProfile(args.rig, args.plate_diameter_mm)
+    
+    if args.serve:
+        serve(default_pixels_per_mm=pixels_per_mm, default_debug_level=args.debug_level,
+              default_options=detect_options_from_args(args), framed=args.framed, cache=cache,
+              default_timings=args.timings, rig=rig, store=store, default_overlay=overlay, outputs=outputs)
+        return
+    
+    timings = timings_from_args(args)
+    
+    if args.image_path == "-":
+        stdout = sys.stdout.buffer
+        try:
+            result, overlay = process_image_data(sys.stdin.buffer.read(), args.filename, pixels_per_mm,
+                                                 args.debug_level, cache=cache, timings=timings, rig=rig,
+                                                 overlay=overlay, **detect_options_from_args(args))
+        except Exception as e:
+            write_frame(stdout, json.dumps({"error": str(e)}).encode("utf-8"))
+            write_frame(stdout, None)
+            stdout.flush()
+            sys.exit(1)
+        report_timings(args, timings)
+        if store is not None:
+            store_result(store, result)
+        write_frame(stdout, json.dumps(result).encode("utf-8"))
+        write_frame(stdout, overlay)
+        stdout.flush()
+        return
+    
+    if args.batch:
+        if not os.path.exists(args.batch):
+            print(json.dumps({"error": f"Batch source not found: {args.batch}"}))
+            sys.exit(1)
+        run_batch(args.batch, pixels_per_mm, args.workers, args.debug_level, detect_options_from_args(args),
+                  cache=cache, timings=args.timings, rig=rig, store=store, overlay=overlay, outputs=outputs)
+        return
+    
+    if (args.series or args.stream) and args.multi_dish:
+        print(json.dumps({"error": "--multi-dish is not supported with --series or --stream"}))
+        sys.exit(1)
+    
+    if args.series:
+        if not os.path.exists(args.series):
+            print(json.dumps({"error": f"Series source not found: {args.series}"}))
+            sys.exit(1)
+        run_series(args.series, pixels_per_mm, args.workers, args.debug_level, single_dish_options(args),
+                   timings=args.timings)
+        return
+    
+    if args.stream:
+        try:
+            run_stream(args.stream, pixels_per_mm, single_dish_options(args), max_frames=args.max_frames,
+                       still_diff=args.still_diff, timings=args.timings)
+        except (OSError, ValueError) as e:
+            print(json.dumps({"error": str(e)}))
+            sys.exit(1)
+        return
+    
+    if not args.image_path:
+        print(json.dumps({"error": "No input image provided"}))
+        sys.exit(1)
+    
+    image_path = args.image_path
+    if not os.path.exists(image_path):
+        print(json.dumps({"error": f"Image file not found: {image_path}"}))
+        sys.exit(1)
+    
+    try:
+        kwargs = dict(cache=cache, timings=timings, rig=rig, overlay=overlay, **detect_options_from_args(args))
+        if outputs is not None:
+            result = process_job(outputs, args.job_id, image_path, pixels_per_mm, args.debug_level, **kwargs)
+        else:
+            result = process_image(image_path, pixels_per_mm, args.debug_level, **kwargs)
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+    report_timings(args, timings)
+    if store is not None:
+        store_result(store, result)
+    
+    # Output results as JSON for API consumption
     print(json.dumps(result))
 
 if __name__ == "__main__":
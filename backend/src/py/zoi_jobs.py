@@ -0,0 +1,186 @@
+import os
+import re
+import shutil
+import time
+import uuid
+
+# Job IDs name directories, so they are limited to a safe set of characters
+JOB_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$")
+# Jobs are written to <root>/.staging/<job_id>.<random> and renamed to <root>/<job_id>
+STAGING_DIR = ".staging"
+# Staging directories untouched for this long (seconds) belong to crashed jobs
+STAGING_MAX_AGE = 3600
+# Seconds between two automatic prunes of one JobOutputs
+PRUNE_INTERVAL = 60
+
+def new_job_id():
+    """
+    A fresh, unique job ID.
+    """
+    return uuid.uuid4().hex
+
+class Job:
+    """
+    Output directory of one job, see JobOutputs.start().
+    
+    The job writes into directory, a staging directory only it uses. Used
+    as a context manager, the job is published when the block completes
+    and discarded when it raises.
+    """
+    
+    def __init__(self, outputs, job_id):
+        self.outputs = outputs
+        self.job_id = job_id
+        self.final_directory = os.path.join(outputs.root, job_id)
+        self.directory = os.path.join(outputs.root, STAGING_DIR, f"{job_id}.{uuid.uuid4().hex[:8]}")
+        os.makedirs(self.directory)
+        self.published = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.publish()
+        else:
+            self.discard()
+    
+    def publish(self):
+        """
+        Rename the staging directory to the job's final directory, so readers
+        see either nothing or the complete output.
+        
+        Raises:
+            FileExistsError: if a job with the same ID was published meanwhile
+        """
+        try:
+            os.rename(self.directory, self.final_directory)
+        except OSError as e:
+            self.discard()
+            if os.path.exists(self.final_directory):
+                raise FileExistsError(f"Job already exists: {self.job_id}") from e
+            raise
+        # Retention counts from the publication
+        os.utime(self.final_directory)
+        self.published = True
+        self.outputs.maybe_prune()
+    
+    def discard(self):
+        """
+        Remove the staging directory of a failed job.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def final_path(self, path):
+        """
+        Where a file written to the staging directory ends up once the job is
+        published; other paths (and None) are returned unchanged.
+        """
+        if path is None or os.path.commonpath([self.directory, os.path.abspath(path)]) != self.directory:
+            return path
+        return os.path.join(self.final_directory, os.path.relpath(os.path.abspath(path), self.directory))
+
+class JobOutputs:
+    """
+    Per-job output directories under one root.
+    
+    Every job writes into a staging directory of its own, which is renamed
+    to <root>/<job_id> when the job completes (see Job). Concurrent jobs
+    therefore never share files, and a job's directory only appears once
+    all its images are written. Published jobs are removed once they are
+    older than max_age seconds, and the oldest ones when there are more
+    than max_jobs; this runs at most every PRUNE_INTERVAL seconds after a
+    publication, or on prune().
+    """
+    
+    def __init__(self, root, max_age=None, max_jobs=None):
+        """
+        Args:
+            root: Directory of the job directories, created if missing
+            max_age: Seconds a published job is kept (default: no limit)
+            max_jobs: Number of published jobs kept (default: no limit)
+        """
+        self.root = os.path.abspath(root)
+        self.max_age = max_age
+        self.max_jobs = max_jobs
+        os.makedirs(os.path.join(self.root, STAGING_DIR), exist_ok=True)
+        self._last_prune = 0.0
+    
+    def start(self, job_id=None):
+        """
+        Start a job.
+        
+        Args:
+            job_id: ID chosen by the caller (default: new_job_id())
+        
+        Returns:
+            The Job
+        
+        Raises:
+            ValueError: for IDs that aren't safe as a directory name
+            FileExistsError: if the job was already published
+        """
+        if job_id is None:
+            job_id = new_job_id()
+        if not JOB_ID.match(job_id):
+            raise ValueError(f"Invalid job ID: {job_id!r}")
+        if os.path.exists(os.path.join(self.root, job_id)):
+            raise FileExistsError(f"Job already exists: {job_id}")
+        return Job(self, job_id)
+    
+    def path(self, job_id):
+        """
+        Directory of a published job (which may not exist).
+        """
+        if not JOB_ID.match(job_id):
+            raise ValueError(f"Invalid job ID: {job_id!r}")
+        return os.path.join(self.root, job_id)
+    
+    def maybe_prune(self):
+        """
+        prune() unless that already happened within PRUNE_INTERVAL seconds.
+        """
+        if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+            self.prune()
+    
+    def prune(self):
+        """
+        Remove the published jobs beyond the retention limits and the
+        staging directories of crashed jobs.
+        
+        Returns:
+            Number of removed directories
+        """
+        self._last_prune = time.monotonic()
+        now = time.time()
+        removed = 0
+        staging_root = os.path.join(self.root, STAGING_DIR)
+        for mtime, path in self._directories(staging_root):
+            if now - mtime > STAGING_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        
+        jobs = sorted(self._directories(self.root), reverse=True)
+        for index, (mtime, path) in enumerate(jobs):
+            expired = self.max_age is not None and now - mtime > self.max_age
+            if expired or (self.max_jobs is not None and index >= self.max_jobs):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+    
+    @staticmethod
+    def _directories(directory):
+        # (mtime, path) of the job directories in directory
+        entries = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False):
+                        continue
+                    try:
+                        entries.append((entry.stat(follow_symlinks=False).st_mtime, entry.path))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return entries
@@ -0,0 +1,616 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from zoi_cache import FileLock
+
+# Row columns: one row per zone. A reading without zones is stored as one
+# row with disc -1 and a NaN diameter, so it can still be looked up
+ROW_COLUMNS = (
+    ("reading", np.int32),  # Reading the zone belongs to
+    ("plate", np.int32),  # Plate ID, index into the plates table
+    ("date", np.int32),  # Imaging date in days since 1970-01-01, or NO_DATE
+    ("source", np.int8),  # SOURCE_DETECTED or SOURCE_REFERENCE
+    ("disc", np.int16),  # Position of the zone in its reading, -1 for none
+    ("dish", np.int16),  # Dish of a multi-plate scan, -1 otherwise
+    ("diameter_mm", np.float32),
+    ("center_x", np.float32),  # NaN for reference readings
+    ("center_y", np.float32),
+)
+
+# Row columns that describe the zone itself
+ZONE_COLUMNS = ("disc", "dish", "diameter_mm", "center_x", "center_y")
+
+# Reading columns: one entry per stored detection result or CSV line
+READING_COLUMNS = (
+    ("name", np.int32),  # Filename, index into the names table
+    ("plate", np.int32),
+    ("date", np.int32),
+    ("source", np.int8),
+    ("first_row", np.int64),  # Its rows are first_row to first_row + row_count
+    ("row_count", np.int32),
+    ("stored_at", np.float64),  # Unix time of the append
+)
+
+SOURCE_DETECTED = 0
+SOURCE_REFERENCE = 1
+SOURCES = {"detected": SOURCE_DETECTED, "reference": SOURCE_REFERENCE}
+NO_DATE = np.iinfo(np.int32).min
+
+# Columns that readings can be grouped by in aggregate()
+GROUP_COLUMNS = ("plate", "date", "disc", "dish", "source")
+# Group keys spanning more values than this (and than there are rows) are
+# renumbered with np.unique before counting, see aggregate()
+GROUP_MAX_SPAN = 1 << 16
+
+# Rows (and readings) the column files are created for; they double in size when full
+INITIAL_CAPACITY = 1 << 16
+
+def date_days(date):
+    """
+    Days since 1970-01-01 of an ISO date, or NO_DATE for None.
+    """
+    if date is None:
+        return NO_DATE
+    return int(np.datetime64(date, "D").astype(np.int64))
+
+def days_date(days):
+    """
+    ISO date of days since 1970-01-01, or None for NO_DATE.
+    """
+    if days == NO_DATE:
+        return None
+    return str(np.datetime64(int(days), "D"))
+
+class StringTable:
+    """
+    Append-only list of strings in a text file (one per line), with the
+    index of every string.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.values = []
+        self.ids = {}
+        self._offset = 0  # Bytes of the file read so far
+    
+    def refresh(self):
+        """
+        Read the strings appended by other processes.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only complete lines; a writer may be in the middle of one
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.decode("utf-8").splitlines():
+            self.ids[line] = len(self.values)
+            self.values.append(line)
+        self._offset += len(data)
+    
+    def intern(self, values):
+        """
+        Indices of values, appending the new ones. The caller holds the store lock.
+        """
+        new = []
+        for value in values:
+            if value not in self.ids:
+                self.ids[value] = len(self.values)
+                self.values.append(value)
+                new.append(value)
+        if new:
+            data = "".join(value + "\n" for value in new).encode("utf-8")
+            with open(self.path, "ab") as f:
+                f.write(data)
+            self._offset += len(data)
+        return [self.ids[value] for value in values]
+
+class ColumnSet:
+    """
+    Fixed-width columns in memory-mapped files of the same capacity.
+    """
+    
+    def __init__(self, directory, prefix, columns):
+        self.directory = directory
+        self.prefix = prefix
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in columns}
+        self.capacity = 0
+        self.arrays = {}
+    
+    def _path(self, name):
+        return os.path.join(self.directory, f"{self.prefix}.{name}.bin")
+    
+    def map(self, capacity):
+        """
+        Map the column files, which hold capacity entries, creating or growing them as needed.
+        """
+        for name, dtype in self.dtypes.items():
+            path = self._path(name)
+            size = capacity * dtype.itemsize
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            self.arrays[name] = np.memmap(path, dtype=dtype, mode="r+", shape=(capacity,))
+        self.capacity = capacity
+    
+    def write(self, start, values):
+        """
+        Write column arrays at start and flush them to disk.
+        """
+        for name, array in self.arrays.items():
+            array[start:start + len(values[name])] = values[name]
+            array.flush()
+
+class ZoiStore:
+    """
+    Append-only columnar store of ZoI readings.
+    
+    Every reading (a detection result or a line of a reference CSV) is
+    appended as one row per zone, in memory-mapped column files: the
+    diameter, center, disc position and dish of the zone, plus the plate,
+    date and source of its reading. Filenames and plate IDs are stored once
+    in text tables and referenced by index. Queries work on whole columns
+    with NumPy, so filtering and aggregating a million rows takes
+    milliseconds.
+    
+    Appends hold a lock shared between processes. The rows are written
+    before meta.json, which holds the row count, is replaced, so readers
+    never see a partial append. Call refresh() to see the rows other
+    processes appended since.
+    """
+    
+    def __init__(self, directory):
+        """
+        Args:
+            directory: Store directory, created if missing
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._rows = ColumnSet(directory, "rows", ROW_COLUMNS)
+        self._readings = ColumnSet(directory, "readings", READING_COLUMNS)
+        self.names = StringTable(os.path.join(directory, "names.txt"))
+        self.plates = StringTable(os.path.join(directory, "plates.txt"))
+        self.rows = 0
+        self.readings = 0
+        self._name_order = None  # Readings sorted by name and their names, built on the first lookup
+        
+        with FileLock(self._lock_path):
+            if not os.path.exists(self._meta_path):
+                self._write_meta({"rows": 0, "readings": 0, "row_capacity": INITIAL_CAPACITY,
+                                  "reading_capacity": INITIAL_CAPACITY})
+        self.refresh()
+    
+    def refresh(self):
+        """
+        Pick up the readings appended by other processes.
+        """
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        for columns, capacity in ((self._rows, meta["row_capacity"]), (self._readings, meta["reading_capacity"])):
+            if columns.capacity != capacity:
+                columns.map(capacity)
+        self.names.refresh()
+        self.plates.refresh()
+        if meta["readings"] != self.readings:
+            self._name_order = None
+        self.rows, self.readings = meta["rows"], meta["readings"]
+    
+    def _write_meta(self, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._meta_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def column(self, name):
+        """
+        Read-only view of a row column (see ROW_COLUMNS) over the stored rows.
+        """
+        view = self._rows.arrays[name][:self.rows].view(np.ndarray)
+        view.flags.writeable = False
+        return view
+    
+    def append(self, readings, skip_unchanged=False):
+        """
+        Append readings.
+        
+        Args:
+            readings: Iterable of dictionaries with filename, zoi (list of
+                dictionaries with diameter_mm and optionally center_x,
+                center_y, dish and disc, the position on the plate; default:
+                the position in the list), and optionally plate (default:
+                the filename), date (ISO date) and source ("detected", the
+                default, or "reference")
+            skip_unchanged: Leave out readings with the same zones as the
+                latest stored reading of their filename and source. The
+                check holds the lock, so concurrent appends of the same
+                reading store it once
+        
+        Returns:
+            Number of readings appended
+        """
+        readings = list(readings)
+        if not readings:
+            return 0
+        
+        # Build the new rows before taking the lock
+        new = self._new_rows(readings)
+        
+        with FileLock(self._lock_path):
+            self.refresh()
+            if skip_unchanged:
+                changed = [reading for index, reading in enumerate(readings)
+                           if not self._unchanged(reading, new, index)]
+                if not changed:
+                    return 0
+                if len(changed) < len(readings):
+                    readings = changed
+                    new = self._new_rows(readings)
+            reading_index = new["reading"]
+            names = np.array(self.names.intern([reading["filename"] for reading in readings]), dtype=np.int32)
+            plates = np.array(self.plates.intern([reading.get("plate") or reading["filename"]
+                                                  for reading in readings]), dtype=np.int32)
+            
+            rows, n_readings = self.rows + len(reading_index), self.readings + len(readings)
+            for columns, needed in ((self._rows, rows), (self._readings, n_readings)):
+                if needed > columns.capacity:
+                    columns.map(max(columns.capacity * 2, needed))
+            
+            self._rows.write(self.rows, {
+                "reading": self.readings + reading_index,
+                "plate": plates[reading_index],
+                "date": new["date"][reading_index],
+                "source": new["source"][reading_index],
+                **{name: new[name] for name in ZONE_COLUMNS},
+            })
+            self._readings.write(self.readings, {
+                "name": names,
+                "plate": plates,
+                "date": new["date"],
+                "source": new["source"],
+                "first_row": self.rows + new["first_row"],
+                "row_count": new["row_count"],
+                "stored_at": np.full(len(readings), time.time()),
+            })
+            self._write_meta({"rows": rows, "readings": n_readings, "row_capacity": self._rows.capacity,
+                              "reading_capacity": self._readings.capacity})
+            self.rows, self.readings = rows, n_readings
+            self._name_order = None
+        return len(readings)
+    
+    @staticmethod
+    def _new_rows(readings):
+        # Columns of the rows of readings: the ZONE_COLUMNS and the reading
+        # each row belongs to (counted from 0), plus row_count, first_row
+        # (counted from 0), date and source of every reading
+        reading_index, disc, dish, diameter, center_x, center_y = [], [], [], [], [], []
+        row_count = []
+        for index, reading in enumerate(readings):
+            zoi_list = reading["zoi"] or [None]
+            row_count.append(len(zoi_list))
+            for position, zoi in enumerate(zoi_list):
+                reading_index.append(index)
+                if zoi is None:
+                    disc.append(-1)
+                    dish.append(-1)
+                    diameter.append(np.nan)
+                    center_x.append(np.nan)
+                    center_y.append(np.nan)
+                    continue
+                disc.append(zoi.get("disc", position))
+                dish.append(zoi.get("dish", -1))
+                diameter.append(zoi["diameter_mm"])
+                center_x.append(zoi.get("center_x", np.nan))
+                center_y.append(zoi.get("center_y", np.nan))
+        row_count = np.array(row_count, dtype=np.int32)
+        return {
+            "reading": np.array(reading_index, dtype=np.int64),
+            "disc": np.array(disc, dtype=np.int16),
+            "dish": np.array(dish, dtype=np.int16),
+            "diameter_mm": np.array(diameter, dtype=np.float32),
+            "center_x": np.array(center_x, dtype=np.float32),
+            "center_y": np.array(center_y, dtype=np.float32),
+            "row_count": row_count,
+            "first_row": np.concatenate(([0], np.cumsum(row_count[:-1], dtype=np.int64))),
+            "date": np.array([date_days(reading.get("date")) for reading in readings], dtype=np.int32),
+            "source": np.array([SOURCES[reading.get("source", "detected")] for reading in readings], dtype=np.int8),
+        }
+    
+    def _unchanged(self, reading, new, index):
+        # Whether the zones of reading, reading index of the new rows, are
+        # those of the latest stored reading of its filename and source.
+        # The caller holds the lock and has refreshed
+        readings = self._readings.arrays
+        stored = self.find(reading["filename"])
+        stored = stored[readings["source"][stored] == new["source"][index]]
+        if len(stored) == 0:
+            return False
+        first, count = int(readings["first_row"][stored[-1]]), int(readings["row_count"][stored[-1]])
+        if count != new["row_count"][index]:
+            return False
+        new_first = int(new["first_row"][index])
+        return all(np.array_equal(self._rows.arrays[name][first:first + count],
+                                  new[name][new_first:new_first + count], equal_nan=True)
+                   for name in ZONE_COLUMNS)
+    
+    def find(self, filename):
+        """
+        Indices of the readings of a filename, in the order they were stored.
+        """
+        name = self.names.ids.get(filename)
+        if name is None:
+            return np.empty(0, dtype=np.int64)
+        if self._name_order is None:
+            names = self._readings.arrays["name"][:self.readings]
+            order = np.argsort(names, kind="stable")
+            self._name_order = (order, names[order])
+        order, sorted_names = self._name_order
+        lo, hi = np.searchsorted(sorted_names, [name, name + 1])
+        return order[lo:hi]
+    
+    def lookup(self, filename, source=None):
+        """
+        Stored readings of a filename.
+        
+        Args:
+            filename: Image name as stored (without extension for detections)
+            source: Only readings of this source ("detected" or "reference")
+        
+        Returns:
+            List of dictionaries with filename, plate, date, source,
+            stored_at and zoi (diameter_mm, center_x, center_y and dish per
+            zone), oldest first
+        """
+        readings = self._readings.arrays
+        entries = []
+        for index in self.find(filename):
+            if source is not None and readings["source"][index] != SOURCES[source]:
+                continue
+            first = int(readings["first_row"][index])
+            rows = slice(first, first + int(readings["row_count"][index]))
+            zoi = []
+            for disc, dish, diameter, x, y in zip(*(self._rows.arrays[name][rows].tolist() for name in ZONE_COLUMNS)):
+                if disc < 0:
+                    continue
+                zone = {"disc": disc, "diameter_mm": diameter}
+                if not np.isnan(x):
+                    zone.update(center_x=x, center_y=y)
+                if dish >= 0:
+                    zone["dish"] = dish
+                zoi.append(zone)
+            entries.append({
+                "filename": filename,
+                "plate": self.plates.values[readings["plate"][index]],
+                "date": days_date(readings["date"][index]),
+                "source": "reference" if readings["source"][index] == SOURCE_REFERENCE else "detected",
+                "stored_at": float(readings["stored_at"][index]),
+                "zoi": zoi,
+            })
+        return entries
+    
+    def select(self, plate=None, date_from=None, date_to=None, disc=None, source=None):
+        """
+        Mask of the rows with a diameter that match every given filter.
+        
+        Args:
+            plate: Plate ID
+            date_from: First ISO date (inclusive); rows without a date are left out
+            date_to: Last ISO date (inclusive); rows without a date are left out
+            disc: Disc position
+            source: "detected" or "reference"
+        """
+        mask = self.column("disc") >= 0
+        if plate is not None:
+            mask &= self.column("plate") == self.plates.ids.get(plate, -1)
+        if date_from is not None:
+            mask &= self.column("date") >= date_days(date_from)
+        if date_to is not None:
+            mask &= (self.column("date") <= date_days(date_to)) & (self.column("date") != NO_DATE)
+        if disc is not None:
+            mask &= self.column("disc") == disc
+        if source is not None:
+            mask &= self.column("source") == SOURCES[source]
+        return mask
+    
+    def aggregate(self, by, **filters):
+        """
+        Diameter statistics per plate, date, disc position, dish or source.
+        
+        Args:
+            by: Column to group by (see GROUP_COLUMNS)
+            **filters: Row filters, see select()
+        
+        Returns:
+            List of dictionaries with the group value under by (date None for
+            undated readings), count, mean_mm, std_mm, min_mm and max_mm,
+            ordered by group value
+        """
+        if by not in GROUP_COLUMNS:
+            raise ValueError(f"Can't group by {by}")
+        mask = self.select(**filters)
+        keys = self.column(by)[mask].astype(np.int64)
+        if len(keys) == 0:
+            return []
+        diameters = self.column("diameter_mm")[mask].astype(np.float64)
+        
+        # Group keys are small integers (table indices, disc positions or
+        # days), so the groups are counted with bincount instead of sorting.
+        # NO_DATE next to real days spans billions of values though, so wide
+        # key ranges are renumbered first.
+        offset, values = keys.min(), None
+        if keys.max() - offset < max(len(keys), GROUP_MAX_SPAN):
+            keys -= offset
+        else:
+            values, keys = np.unique(keys, return_inverse=True)
+        counts = np.bincount(keys)
+        sums = np.bincount(keys, diameters)
+        squares = np.bincount(keys, diameters * diameters)
+        minima = np.full(len(counts), np.inf)
+        maxima = np.full(len(counts), -np.inf)
+        np.minimum.at(minima, keys, diameters)
+        np.maximum.at(maxima, keys, diameters)
+        
+        present = np.flatnonzero(counts)
+        group_values = present + offset if values is None else values[present]
+        counts, sums, squares = counts[present], sums[present], squares[present]
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means * means, 0.0))
+        groups = []
+        for key, count, mean, std, low, high in zip(group_values.tolist(), counts.tolist(), means.tolist(),
+                                                    stds.tolist(), minima[present].tolist(),
+                                                    maxima[present].tolist()):
+            if by == "plate":
+                key = self.plates.values[key]
+            elif by == "date":
+                key = days_date(key)
+            elif by == "source":
+                key = "reference" if key == SOURCE_REFERENCE else "detected"
+            groups.append({by: key, "count": count, "mean_mm": mean, "std_mm": std, "min_mm": low, "max_mm": high})
+        return groups
+    
+    def histogram(self, bins=40, range_mm=(0.0, 40.0), **filters):
+        """
+        Distribution of the diameters.
+        
+        Args:
+            bins: Number of equal-width bins
+            range_mm: (lowest, highest) diameter; diameters outside are left out
+            **filters: Row filters, see select()
+        
+        Returns:
+            Dictionary with edges_mm (bins + 1 bin edges) and counts
+        """
+        low, high = range_mm
+        # Equal-width bins, so the bin of every diameter is computed directly
+        # (np.histogram is several times slower on a million values)
+        scaled = (self.column("diameter_mm") - np.float32(low)) * np.float32(bins / (high - low))
+        keep = self.select(**filters) & (scaled >= 0) & (scaled <= bins)
+        index = np.minimum(scaled[keep].astype(np.int32), bins - 1)
+        counts = np.bincount(index, minlength=bins)
+        return {"edges_mm": np.linspace(low, high, bins + 1).tolist(), "counts": counts.tolist()}
+    
+    def stats(self):
+        """
+        Size of the store.
+        
+        Returns:
+            Dictionary with directory, readings, rows, filenames, plates and bytes
+        """
+        size = sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+        return {
+            "directory": self.directory,
+            "readings": self.readings,
+            "rows": self.rows,
+            "filenames": len(self.names.values),
+            "plates": len(self.plates.values),
+            "bytes": size,
+        }
+    
+    def import_csv(self, path, parse_name=None, skip_existing=True):
+        """
+        Bulk import reference diameters from a CSV like assets/zoi_data.csv.
+        
+        The first column is the filename, every further column a disc
+        position with values like "29 mm" (empty when the plate has fewer
+        discs).
+        
+        Args:
+            path: CSV file with a header line
+            parse_name: Optional function from a filename to (plate ID, ISO
+                date or None), e.g. zoi_detect.series_name
+            skip_existing: Skip filenames that already have a reference reading
+        
+        Returns:
+            Number of readings imported
+        """
+        readings = []
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            rows = csv.reader(f)
+            next(rows, None)
+            for fields in rows:
+                if not fields or not fields[0].strip():
+                    continue
+                filename = fields[0].strip()
+                if skip_existing and self.lookup(filename, source="reference"):
+                    continue
+                zoi = [{"disc": disc, "diameter_mm": float(value.lower().replace("mm", ""))}
+                       for disc, value in enumerate(field.strip() for field in fields[1:]) if value]
+                plate, date = parse_name(filename) if parse_name else (filename, None)
+                readings.append({"filename": filename, "plate": plate, "date": date, "zoi": zoi,
+                                 "source": "reference"})
+        return self.append(readings)
+
+def _filters(args):
+    return {"plate": args.plate, "date_from": args.date_from, "date_to": args.date_to, "disc": args.disc,
+            "source": args.source}
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog="python zoi_store.py", description="Query a ZoI results store.")
+    parser.add_argument("store", help="Store directory (e.g. the --store directory of zoi_detect.py)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    imp = commands.add_parser("import", help="Import reference diameters from a CSV file")
+    imp.add_argument("csv", help="CSV file like assets/zoi_data.csv")
+    imp.add_argument("--again", action="store_true", help="Also import filenames that already have reference data")
+    
+    lookup = commands.add_parser("lookup", help="Readings of one image")
+    lookup.add_argument("filename", help="Image name without extension")
+    
+    aggregate = commands.add_parser("aggregate", help="Diameter statistics per group")
+    aggregate.add_argument("--by", choices=GROUP_COLUMNS, default="plate", help="Group by (default: plate)")
+    
+    hist = commands.add_parser("histogram", help="Diameter distribution")
+    hist.add_argument("--bins", type=int, default=40, help="Number of bins (default: 40)")
+    hist.add_argument("--range", type=float, nargs=2, default=(0.0, 40.0), metavar=("LOW", "HIGH"),
+                      help="Diameter range in mm (default: 0 40)")
+    
+    for sub in (aggregate, hist):
+        sub.add_argument("--plate", help="Only this plate")
+        sub.add_argument("--date-from", help="Only from this ISO date on")
+        sub.add_argument("--date-to", help="Only up to this ISO date")
+        sub.add_argument("--disc", type=int, help="Only this disc position (0-based)")
+        sub.add_argument("--source", choices=tuple(SOURCES), help="Only detected or reference readings")
+    
+    commands.add_parser("stats", help="Size of the store")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """
+    Command line entry point, returns the exit code.
+    """
+    args = parse_args(argv)
+    store = ZoiStore(args.store)
+    if args.command == "import":
+        # Plate IDs and dates follow the naming of the time series
+        from zoi_detect import series_name
+        result = {"imported": store.import_csv(args.csv, series_name, skip_existing=not args.again)}
+    elif args.command == "lookup":
+        result = store.lookup(args.filename)
+    elif args.command == "aggregate":
+        result = store.aggregate(args.by, **_filters(args))
+    elif args.command == "histogram":
+        result = store.histogram(args.bins, tuple(args.range), **_filters(args))
+    else:
+        result = store.stats()
+    print(json.dumps(result, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+
+export type PyResult = {
+  data: any;
+  // Detection image in the requested format, null when the worker wrote it
+  // to disk or skipped it
+  overlay: Buffer | null;
+};
+
+type Pending = {
+  resolve: (result: PyResult) => void;
+  reject: (err: Error) => void;
+};
+
+type Worker = {
+  proc: ChildProcessWithoutNullStreams;
+  pending: Map<number, Pending>;
+  buffer: Buffer;
+  frames: Buffer[];
+};
+
+const FRAME_HEADER_SIZE = 4;
+
+// Frames are a 4-byte big-endian length followed by the payload
+const encodeFrame = (payload: Buffer): Buffer => {
+  const header = Buffer.alloc(FRAME_HEADER_SIZE);
+  header.writeUInt32BE(payload.length, 0);
+  return Buffer.concat([header, payload]);
+};
+
+// Keeps a small set of `zoi_detect.py --serve --framed` processes alive so
+// that each upload doesn't pay for interpreter start and the cv2/numpy
+// imports. Each request is a JSON frame plus an image frame, each response a
+// JSON frame plus a detection image frame, matched by id.
+export class PyWorkerPool {
+  private workers: Worker[] = [];
+  private nextId = 1;
+
+  constructor(
+    private pythonBin: string,
+    private script: string,
+    private size: number = 2,
+    private args: string[] = [],
+  ) {
+    for (let i = 0; i < size; i++) {
+      this.workers.push(this.spawnWorker());
+    }
+  }
+
+  private spawnWorker(): Worker {
+    const proc = spawn(this.pythonBin, [this.script, '--serve', '--framed', ...this.args]);
+    const worker: Worker = { proc, pending: new Map(), buffer: Buffer.alloc(0), frames: [] };
+
+    proc.stdout.on('data', (chunk: Buffer) => {
+      worker.buffer = Buffer.concat([worker.buffer, chunk]);
+      while (worker.buffer.length >= FRAME_HEADER_SIZE) {
+        const length = worker.buffer.readUInt32BE(0);
+        if (worker.buffer.length < FRAME_HEADER_SIZE + length) {
+          break;
+        }
+        worker.frames.push(worker.buffer.subarray(FRAME_HEADER_SIZE, FRAME_HEADER_SIZE + length));
+        worker.buffer = worker.buffer.subarray(FRAME_HEADER_SIZE + length);
+
+        if (worker.frames.length === 2) {
+          const [json, overlay] = worker.frames;
+          worker.frames = [];
+          this.handleResponse(worker, json, overlay);
+        }
+      }
+    });
+
+    proc.stderr.on('data', (chunk: Buffer) => {
+      console.error('Python worker stderr:', chunk.toString());
+    });
+
+    // A crashed worker fails its in-flight requests and gets replaced
+    proc.on('exit', (code) => {
+      console.error(`Python worker exited with code ${code}`);
+      for (const pending of worker.pending.values()) {
+        pending.reject(new Error('Python worker exited.'));
+      }
+      worker.pending.clear();
+
+      const idx = this.workers.indexOf(worker);
+      if (idx !== -1) {
+        this.workers[idx] = this.spawnWorker();
+      }
+    });
+
+    return worker;
+  }
+
+  private handleResponse(worker: Worker, json: Buffer, overlay: Buffer) {
+    let data: any;
+    try {
+      data = JSON.parse(json.toString('utf8'));
+    } catch (e) {
+      console.error('Unparseable worker output:', json.toString('utf8'));
+      return;
+    }
+
+    const pending = worker.pending.get(data.id);
+    if (!pending) {
+      return;
+    }
+    worker.pending.delete(data.id);
+
+    if (data.error) {
+      pending.reject(new Error(data.error));
+    } else {
+      pending.resolve({ data, overlay: overlay.length > 0 ? Buffer.from(overlay) : null });
+    }
+  }
+
+  // Runs one detection; pass the encoded image to keep it off the disk,
+  // or set image_path in the request to read it from there instead
+  run(request: object, image?: Buffer): Promise<PyResult> {
+    // Send to the least busy worker
+    const worker = this.workers.reduce((a, b) => (b.pending.size < a.pending.size ? b : a));
+    const id = this.nextId++;
+
+    return new Promise((resolve, reject) => {
+      worker.pending.set(id, { resolve, reject });
+      worker.proc.stdin.write(encodeFrame(Buffer.from(JSON.stringify({ ...request, id }))));
+      worker.proc.stdin.write(encodeFrame(image ?? Buffer.alloc(0)));
+    });
+  }
+
+  close() {
+    const workers = this.workers;
+    this.workers = [];
+    for (const worker of workers) {
+      worker.proc.stdin.end();
+    }
+  }
+}
@@ -4,6 +4,8 @@ export class ZoIUploadService {
     static async uploadImage(file: File): Promise<any> {
         const formData = new FormData();
         formData.append('image', file);
+        // The detected circles come back as an SVG that is drawn over the original image
+        formData.append('overlay', 'svg');
 
         const response = await axios.post('http://localhost:3005/v1/zoiUpload', formData);
 